@@ -1,18 +1,44 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import requests
 from datetime import datetime
 import os
+import hashlib
 import json
 import uuid
+import threading
+import time
+import atexit
+import signal
+
+from context_cache import ContextCache
+from context_digest import ContextDigest
+from context_window import ConversationWindow, estimate_tokens, turn_tokens
+from file_cache import FileCache, thaw
+from session_store import SessionStore
+from gemini_client import GeminiBusyError, GeminiClient, GeminiHTTPError
+from json_stream import JsonFieldStream
+from pagination import PageError, paginate, paginate_log, wants_page
+from media_store import MediaStore, UploadTooLarge, is_blob_name
+from retrieval import RetrievalIndex
+from search_index import SearchIndex, fts5_available
+from static_assets import StaticAssets
+from write_queue import PartialCommit, QueueFull, WriteBehindQueue
+from job_queue import JobQueue, JobQueueFull
+from storage import CHAT_FILE, CHAT_LOG_DIR, DATA_FILES, DEFAULT_DB_FILE, open_storage
+from thumbnails import ThumbnailPipeline, VIDEO_EXTENSIONS
+from tenants import (DEFAULT_TENANT, InvalidToken, TenantRegistry, UnknownTenant, current_tenant_id,
+                     group_by_tenant, set_current_tenant, use_tenant)
+from werkzeug.local import LocalProxy
+from metrics import BYTES_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE, TOKEN_BUCKETS, Registry
 
 app = Flask(__name__)
 # Enable CORS with proper configuration for preflight requests
 CORS(app, resources={
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "methods": ["GET", "POST", "PATCH", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "If-Match", "X-Tenant-ID"]
     }
 })
 
@@ -32,21 +58,122 @@ except ImportError:
 
 # Configure Gemini API — key lives in .env, never in source code
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1/models/gemini-2.5-flash-lite:generateContent?key={GEMINI_API_KEY}"
-
-# File to store memories
-# File to store memories
-MEMORIES_FILE = "memories.json"
-PROFILE_FILE = "profile.json"
-ROUTINES_FILE = "routines.json"
-FAMILY_FILE = "family.json"
-CHAT_FILE = "chat.json"
-NOTES_FILE = "notes.json"
+# GEMINI_API_BASE can point at fake_gemini.py for offline testing
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1")
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_API_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent?key={GEMINI_API_KEY}"
+
+# -------------------------------------------------------
+# Metrics (Prometheus text format on /metrics)
+# -------------------------------------------------------
+metrics = Registry('aegis_')
+HTTP_REQUESTS = metrics.counter('http_requests_total', 'API requests by route, method and status',
+                                ('route', 'method', 'status'))
+HTTP_LATENCY = metrics.histogram('http_request_seconds',
+                                 'API request latency (streaming routes: until the response starts)',
+                                 ('route', 'method'))
+CHAT_STAGE = metrics.histogram('chat_stage_seconds', 'Time spent in each stage of a chat turn', ('stage',))
+PROMPT_BYTES = metrics.histogram('prompt_bytes', 'Size of the Gemini request body of chat turns',
+                                 buckets=BYTES_BUCKETS)
+PROMPT_TOKENS = metrics.histogram('prompt_tokens', 'Estimated prompt tokens of chat turns', buckets=TOKEN_BUCKETS)
+OUTPUT_TOKENS = metrics.histogram('output_tokens', 'Output tokens reported by Gemini', ('stage',),
+                                  buckets=TOKEN_BUCKETS)
+UPSTREAM_LATENCY = metrics.histogram('gemini_request_seconds', 'Gemini call latency including retries',
+                                     ('method', 'status'))
+PARSE_RESULTS = metrics.counter('model_output_parse_total',
+                                'Model output parsing: json (bare), recovered (JSON found in text), '
+                                'plain (no JSON) or error', ('result',))
+CONTEXT_REFRESHES = metrics.counter('session_context_refresh_total',
+                                    'Live sessions given a newer personal context')
+SYSTEM_CONTEXT_SENT = metrics.counter('system_context_total',
+                                      'How chat turns sent the instructions and personal context: '
+                                      'contents, instruction (systemInstruction), cached (cachedContent) '
+                                      'or rejected (cache entry refused upstream, resent as instruction)',
+                                      ('mode',))
+PERSIST_LATENCY = metrics.histogram('persist_seconds', 'Time to commit one write-behind batch', ('kind',))
+
+# Shared keep-alive client: timeouts, jittered retries on 429/5xx, concurrency cap
+gemini = GeminiClient(
+    GEMINI_API_BASE, GEMINI_API_KEY, GEMINI_MODEL,
+    connect_timeout=float(os.environ.get("GEMINI_CONNECT_TIMEOUT", 5)),
+    read_timeout=float(os.environ.get("GEMINI_READ_TIMEOUT", 60)),
+    max_retries=int(os.environ.get("GEMINI_MAX_RETRIES", 2)),
+    max_concurrency=int(os.environ.get("GEMINI_MAX_CONCURRENCY", 8)),
+    on_call=lambda method, status, seconds: UPSTREAM_LATENCY.observe(seconds, method, str(status)),
+)
+
+# Files to store user data: DATA_FILES, CHAT_LOG_DIR and CHAT_FILE (see storage.py).
+# "json" keeps those files; "sqlite" stores everything in SQLITE_DB_FILE
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+SQLITE_DB_FILE = os.environ.get("SQLITE_DB_FILE", DEFAULT_DB_FILE)
+# Set by wsgi.py when several worker processes serve the same data: sessions
+# and extraction results live in SESSION_DB_FILE, and writes to the JSON
+# files, chat log and upload refcounts take inter-process file locks.
+MULTIPROCESS = os.environ.get("MULTIPROCESS", "0").lower() in ("1", "true", "yes")
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'webm'}
-
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+MEDIA_MAX_AGE = 365 * 24 * 3600       # content-addressed uploads never change
+LEGACY_MEDIA_MAX_AGE = 24 * 3600      # pre-hash uploads: cache a day, then revalidate
+# Set behind nginx/Apache to let the proxy stream files (X-Sendfile)
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+
+# Werkzeug rejects bodies over this before the route runs
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+
+# Front-end files: fingerprinted URLs, gzip/brotli bodies, immutable caching.
+# Built once at startup; STATIC_RELOAD (on with FLASK_DEBUG) rebuilds on edits.
+STATIC_RELOAD = os.environ.get("STATIC_RELOAD", os.environ.get("FLASK_DEBUG", "0")).lower() in ("1", "true", "yes")
+static_assets = StaticAssets(app.root_path, reload=STATIC_RELOAD)
+
+# Resized WebP/JPEG variants and video poster frames, rendered in the background
+thumbnails = ThumbnailPipeline(UPLOAD_FOLDER, workers=int(os.environ.get("THUMBNAIL_WORKERS", 2)))
+
+# Uploads are stored by content hash, so re-uploading the same photo reuses one file
+media_store = MediaStore(UPLOAD_FOLDER, MAX_UPLOAD_BYTES, on_remove=thumbnails.remove, interprocess=MULTIPROCESS)
+
+# Tenants: each person's data lives in TENANTS_DIR/<tenant id>/ (the default
+# tenant uses the files above, in the working directory). Tenants are
+# provisioned with `python tenants.py create <id>`, which prints the tenant's
+# access token. A request's tenant is the one its token was issued for
+# ("Authorization: Bearer <token>", or the cookie /api/login sets); requests
+# without a token get the default tenant.
+# (TENANTS_AUTO_CREATE=1 creates a missing data directory on first use, for
+# development only.)
+TENANT_COOKIE = 'tenant_token'
+TENANTS_DIR = os.environ.get("TENANTS_DIR", "tenants")
+TENANT_MAX_OPEN = int(os.environ.get("TENANT_MAX_OPEN", 256))
+TENANTS_AUTO_CREATE = os.environ.get("TENANTS_AUTO_CREATE", "0").lower() in ("1", "true", "yes")
+
+class TenantData:
+    """One tenant's storage backend, caches and indexes"""
+    def __init__(self, tenant_id, data_dir):
+        def path(name):
+            # Absolute paths from the environment only apply to the default tenant
+            return name if tenant_id == DEFAULT_TENANT else os.path.join(data_dir, os.path.basename(name))
+        self.tenant_id = tenant_id
+        # Storage backend for all user data. With the JSON backend, chat history
+        # goes to an append-only log (replaces rewriting chat.json on every turn).
+        self.storage = open_storage(STORAGE_BACKEND, {name: path(f) for name, f in DATA_FILES.items()},
+                                    path(CHAT_LOG_DIR), legacy_chat_file=path(CHAT_FILE),
+                                    db_file=path(SQLITE_DB_FILE), interprocess=MULTIPROCESS)
+        # Read-through cache for profile / routines / memories / family.
+        # Loaders return frozen data; use thaw() before modifying it.
+        self.file_cache = FileCache()
+        self.retrieval_index = RetrievalIndex()
+        self.indexed_stamps = {}
+        self.search_index = SearchIndex(path(SEARCH_DB_FILE)) if SEARCH_ENABLED else None
+        self.search_chat_checked = False
+        # Dedup index for the stored memories, valid while the storage stamp matches
+        self.memories_dedup = {'stamp': None, 'index': None}
+        # Rendered personal context pinned to chat sessions
+        self.context_digest = open_context_digest(self.storage)
+
+tenants = TenantRegistry(TENANTS_DIR, TenantData, max_open=TENANT_MAX_OPEN, auto_create=TENANTS_AUTO_CREATE)
+
+# The current tenant's parts, under the names the rest of the module uses
+storage = LocalProxy(lambda: tenants.current().storage)
+file_cache = LocalProxy(lambda: tenants.current().file_cache)
 
 # System prompt for elderly care assistant
 SYSTEM_PROMPT = """
@@ -216,12 +343,194 @@ CONVERSATION STYLE
 You are not just storing information. You are helping a person feel recognized across time while maintaining safety, dignity, and emotional trust.
 """
 
-# Store conversation history (in production, use a database)
-conversation_history = {}
+# Structured output: Gemini is held to RESPONSE_SCHEMA (responseMimeType JSON)
+# and told to leave out empty categories instead of echoing the full template.
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no")
+
+_STRING_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+_MEMORY_OBJECT = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "date": {"type": "STRING", "nullable": True},
+    },
+    "required": ["title"],
+}
+# Stored as dicts (DICT_CATEGORIES), so the schema asks for objects too
+_ROUTINE_OBJECT = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "time": {"type": "STRING", "nullable": True},
+        "description": {"type": "STRING"},
+    },
+    "required": ["title"],
+}
+_MEDICATION_OBJECT = {
+    "type": "OBJECT",
+    "properties": {
+        "name": {"type": "STRING"},
+        "notes": {"type": "STRING"},
+    },
+    "required": ["name"],
+}
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "response": {"type": "STRING"},
+        "extracted_data": {
+            "type": "OBJECT",
+            "properties": {
+                "memories": {"type": "ARRAY", "items": _MEMORY_OBJECT},
+                "daily_routines": {"type": "ARRAY", "items": _ROUTINE_OBJECT},
+                "medications": {"type": "ARRAY", "items": _MEDICATION_OBJECT},
+                **{category: _STRING_LIST for category in (
+                    "interests", "preferences", "people", "places", "life_roles",
+                    "values_beliefs", "emotional_patterns", "achievements", "challenges",
+                    "historical_events", "identity_details", "health_context")},
+                # JSON Schema maps cannot be expressed here; parse_model_output turns
+                # [{"category", "items"}] back into the stored {category: [items]} form
+                "adaptive_categories": {
+                    "type": "ARRAY",
+                    "items": {
+                        "type": "OBJECT",
+                        "properties": {"category": {"type": "STRING"}, "items": _STRING_LIST},
+                        "required": ["category", "items"],
+                    },
+                },
+            },
+        },
+        "memory_actions": {
+            "type": "OBJECT",
+            "properties": {
+                "surfaced_memory": {"type": "STRING"},
+                "surfacing_mode": {"type": "STRING", "enum": ["echo", "soft_reminder", "invitation"]},
+                "reason_for_surfacing": {"type": "STRING"},
+            },
+        },
+        "memory_to_confirm": dict(_MEMORY_OBJECT, nullable=True),
+    },
+    "required": ["response"],
+    # "response" first, so the streaming endpoint can forward it as it is generated
+    "propertyOrdering": ["response", "extracted_data", "memory_actions", "memory_to_confirm"],
+}
+
+COMPACT_RESPONSE_RULES = """WHEN RESPONDING
+Return one JSON object following the response schema. Keep it compact:
+- "response" (always): your warm, natural conversational reply to the user.
+- "extracted_data": only the categories that have NEW information in this message. Leave out empty categories, and leave out "extracted_data" entirely when there is nothing new. "adaptive_categories" is a list of {"category": name, "items": [...]}.
+- "memory_actions": only when you surface a memory.
+- "memory_to_confirm": only when the Double Mention Rule asks for it.
+
+"""
+
+def _compact_system_prompt(prompt):
+    """SYSTEM_PROMPT with the full JSON template replaced by the compact rules"""
+    start = prompt.index("WHEN RESPONDING")
+    end = prompt.index("EXTRACTION RULES")
+    prompt = prompt[:start] + COMPACT_RESPONSE_RULES + prompt[end:]
+    return prompt.replace("- If no new information exists in a category, return an empty array.",
+                          "- If no new information exists in a category, omit it.")
+
+# Two-stage turns: the chat call only writes the reply (REPLY_SCHEMA); extraction
+# runs afterwards as a background job (EXTRACTION_SCHEMA) and the client polls
+# /api/extractions/<id> for its result. Needs structured output.
+ASYNC_EXTRACTION = STRUCTURED_OUTPUT and os.environ.get("ASYNC_EXTRACTION", "1").lower() not in ("0", "false", "no")
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", 2))
+EXTRACTION_CONTEXT_TURNS = 4  # earlier turns shown to the extractor for context
+
+def _schema_subset(*names):
+    properties = RESPONSE_SCHEMA["properties"]
+    return {
+        "type": "OBJECT",
+        "properties": {name: properties[name] for name in names},
+        "propertyOrdering": list(names),
+    }
+
+REPLY_SCHEMA = dict(_schema_subset("response", "memory_actions"), required=["response"])
+EXTRACTION_SCHEMA = _schema_subset("extracted_data", "memory_to_confirm")
+
+REPLY_RESPONSE_RULES = """WHEN RESPONDING
+Return one JSON object following the response schema:
+- "response" (always): your warm, natural conversational reply to the user.
+- "memory_actions": only when you surface a memory.
+Saving information and memories is handled separately; never mention it unless the Double Mention Rule applies.
+
+"""
+
+def _reply_system_prompt(prompt):
+    """SYSTEM_PROMPT for the reply-only call: no template, no extraction sections"""
+    start = prompt.index("WHEN RESPONDING")
+    end = prompt.index("DOUBLE MENTION RULE")
+    prompt = prompt[:start] + REPLY_RESPONSE_RULES + prompt[end:]
+    start = prompt.index("3. In the JSON response, populate")
+    end = prompt.index("4. Do this only ONCE")
+    return prompt[:start] + prompt[end:]
+
+EXTRACTION_SYSTEM_PROMPT = (
+    "You record what an elderly person shares with their memory companion. You are given the "
+    "latest exchange of their conversation (with a little earlier context) and return one JSON "
+    "object following the response schema.\n\n"
+    "- \"extracted_data\": only the categories that have NEW information in the CURRENT MESSAGE. "
+    "Leave out empty categories, and leave out \"extracted_data\" entirely when there is nothing new. "
+    "\"adaptive_categories\" is a list of {\"category\": name, \"items\": [...]}.\n"
+    "- \"memory_to_confirm\": only when the input is marked [REPEATED TOPIC: ...]. Fill it with "
+    "{\"title\": short descriptive title (3-6 words), \"description\": one or two warm sentences "
+    "about what was shared, \"date\": null unless the user stated a date}.\n\n"
+    + SYSTEM_PROMPT[SYSTEM_PROMPT.index("EXTRACTION RULES"):SYSTEM_PROMPT.index("DOUBLE MENTION RULE")]
+        .replace("- If no new information exists in a category, return an empty array.",
+                 "- If no new information exists in a category, omit it.")
+)
+
+if ASYNC_EXTRACTION:
+    CHAT_SYSTEM_PROMPT = _reply_system_prompt(SYSTEM_PROMPT)
+elif STRUCTURED_OUTPUT:
+    CHAT_SYSTEM_PROMPT = _compact_system_prompt(SYSTEM_PROMPT)
+else:
+    CHAT_SYSTEM_PROMPT = SYSTEM_PROMPT
+
+# The instructions and personal context are sent as systemInstruction, not as
+# the first turn of every session's contents. With CONTEXT_CACHE they are also
+# stored upstream (cachedContents: one entry per user and context version,
+# renewed before CONTEXT_CACHE_TTL runs out) and turns refer to them by name.
+# cachedContents is a v1beta API: GEMINI_API_BASE=.../v1beta.
+SYSTEM_INSTRUCTION = os.environ.get("SYSTEM_INSTRUCTION", "1").lower() not in ("0", "false", "no")
+CONTEXT_CACHE = SYSTEM_INSTRUCTION and os.environ.get("CONTEXT_CACHE", "0").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_TTL = int(os.environ.get("CONTEXT_CACHE_TTL", 3600))
+context_cache = ContextCache(gemini, ttl=CONTEXT_CACHE_TTL) if CONTEXT_CACHE else None
+if CONTEXT_CACHE and not GEMINI_API_BASE.rstrip('/').endswith('v1beta'):
+    print("CONTEXT_CACHE: cachedContents is only served under v1beta; set GEMINI_API_BASE=.../v1beta "
+          "(turns fall back to systemInstruction until then)")
+
+# Per-session state is bounded: least-recently-used sessions beyond
+# SESSION_MAX_ENTRIES, or idle for SESSION_TTL_SECONDS, are evicted and
+# spilled to SESSION_DB_FILE so they can be rehydrated later. With
+# MULTIPROCESS, SESSION_DB_FILE holds every session and each worker only
+# caches them (in-place changes are written back with .save()). The spill
+# table keeps at most SESSION_SPILL_MAX_ROWS sessions per store.
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 500))
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", 2 * 3600))
+SESSION_DB_FILE = os.environ.get("SESSION_DB_FILE", "sessions.db")
+SESSION_SPILL_MAX_ROWS = int(os.environ.get("SESSION_SPILL_MAX_ROWS", 20000))
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 12000))
+CONTEXT_KEEP_RECENT = int(os.environ.get("CONTEXT_KEEP_RECENT", 6))  # verbatim exchanges
+
+# Store conversation history: each session is a token-budgeted ConversationWindow
+conversation_history = SessionStore(
+    'conversation', max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL_SECONDS,
+    spill_db=SESSION_DB_FILE, spill_max_rows=SESSION_SPILL_MAX_ROWS, shared=MULTIPROCESS,
+    serialize=lambda window: window.to_dict(),
+    deserialize=lambda data: ConversationWindow.from_dict(data, summarize=summarize_turns,
+                                                          resume=not MULTIPROCESS)
+)
 
 # Per-session mention tracker for the Double Mention Rule
 # Structure: { session_id: { normalized_topic: { count: int, prompted: bool } } }
-mention_tracker = {}
+mention_tracker = SessionStore(
+    'mentions', max_entries=SESSION_MAX_ENTRIES, ttl_seconds=SESSION_TTL_SECONDS,
+    spill_db=SESSION_DB_FILE, spill_max_rows=SESSION_SPILL_MAX_ROWS, shared=MULTIPROCESS
+)
 
 # Default memory structure with all categories
 DEFAULT_MEMORIES = {
@@ -244,38 +553,62 @@ DEFAULT_MEMORIES = {
     "last_updated": None
 }
 
-def load_memories():
-    """Load memories from JSON file, ensuring all fields exist"""
+def _cached(name, reader):
+    """Serve a collection through the read-through cache"""
+    return file_cache.get(name, storage.stamp(name), reader)
+
+def _normalize_memories(loaded_data):
+    """Merge stored memories into the default structure"""
     memories = DEFAULT_MEMORIES.copy()
-    if os.path.exists(MEMORIES_FILE):
-        try:
-            with open(MEMORIES_FILE, 'r') as f:
-                loaded_data = json.load(f)
-                # Update default structure with loaded data (preserves defaults for missing keys)
-                memories.update(loaded_data)
-                
-                # Ensure adaptive_categories is a dict if it exists but is extracted incorrectly or missing
-                if "adaptive_categories" not in memories or not isinstance(memories["adaptive_categories"], dict):
-                    memories["adaptive_categories"] = {}
-                    
-        except json.JSONDecodeError:
-            pass
+    if isinstance(loaded_data, dict):
+        # Update default structure with loaded data (preserves defaults for missing keys)
+        memories.update(loaded_data)
+
+        # Ensure adaptive_categories is a dict if it exists but is extracted incorrectly or missing
+        if "adaptive_categories" not in memories or not isinstance(memories["adaptive_categories"], dict):
+            memories["adaptive_categories"] = {}
+    elif isinstance(loaded_data, list):
+        # The oldest memories.json held the bare list of memories
+        memories["memories"] = loaded_data
     return memories
 
-def save_memories(memories_data):
-    """Save memories to JSON file"""
-    memories_data["last_updated"] = datetime.now().isoformat()
-    with open(MEMORIES_FILE, 'w') as f:
-        json.dump(memories_data, f, indent=2)
-
-def load_profile():
-    """Load profile from JSON file"""
-    if os.path.exists(PROFILE_FILE):
-        try:
-            with open(PROFILE_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            pass
+def load_memories():
+    """Load memories (cached, read-only), ensuring all fields exist"""
+    return _cached('memories', lambda: _normalize_memories(storage.load('memories')))
+
+def _media_urls(data):
+    """Every /uploads/ URL referenced anywhere in a collection"""
+    if isinstance(data, str):
+        return [data] if data.startswith('/uploads/') else []
+    if isinstance(data, dict):
+        data = data.values()
+    elif not isinstance(data, (list, tuple)):
+        return []
+    urls = []
+    for value in data:
+        urls.extend(_media_urls(value))
+    return urls
+
+def update_memories(fn):
+    """Apply fn to a mutable copy of the memories and save it atomically"""
+    old_urls = []
+    def apply(loaded_data):
+        old_urls[:] = _media_urls(loaded_data)
+        memories_data = fn(thaw(_normalize_memories(loaded_data)))
+        memories_data["last_updated"] = datetime.now().isoformat()
+        return memories_data
+    result = storage.update('memories', apply)
+    media_store.update_refs(old_urls, _media_urls(result))
+    file_cache.invalidate('memories')
+    refresh_retrieval_index('memories')
+    refresh_context_section('memories')
+    return result
+
+def _read_profile():
+    """Load profile from storage"""
+    data = storage.load('profile')
+    if isinstance(data, dict):
+        return data
     return {
         "name": "",
         "age": "",
@@ -286,82 +619,431 @@ def load_profile():
         "notes": ""
     }
 
+def load_profile():
+    """Load profile (cached, read-only)"""
+    return _cached('profile', _read_profile)
+
 def save_profile(profile_data):
-    """Save profile to JSON file"""
-    with open(PROFILE_FILE, 'w') as f:
-        json.dump(profile_data, f, indent=2)
+    """Save profile to storage"""
+    storage.save('profile', profile_data)
+    file_cache.invalidate('profile')
+    refresh_context_section('profile')
+
+def _read_routines():
+    """Load routines from storage"""
+    data = storage.load('routines')
+    # Ensure it's a list
+    if isinstance(data, list):
+        return data
+    # If it's the old dict format, verify and return empty list or migrate?
+    # For now, just return empty list to reset if schema mismatch
+    return []
 
 def load_routines():
-    """Load routines from JSON file"""
-    if os.path.exists(ROUTINES_FILE):
-        try:
-            with open(ROUTINES_FILE, 'r') as f:
-                data = json.load(f)
-                # Ensure it's a list
-                if isinstance(data, list):
-                    return data
-                # If it's the old dict format, verify and return empty list or migrate?
-                # For now, just return empty list to reset if schema mismatch
-                return []
-        except json.JSONDecodeError:
-            pass
+    """Load routines (cached, read-only)"""
+    return _cached('routines', _read_routines)
+
+def _read_family():
+    """Load family data from storage"""
+    data = storage.load('family')
+    if isinstance(data, list):
+        return data
     return []
 
-def save_routines(routines_data):
-    """Save routines to JSON file"""
-    with open(ROUTINES_FILE, 'w') as f:
-        json.dump(routines_data, f, indent=2)
-
 def load_family():
-    """Load family data from JSON file"""
-    if os.path.exists(FAMILY_FILE):
-        try:
-            with open(FAMILY_FILE, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-                return []
-        except json.JSONDecodeError:
-            pass
+    """Load family data (cached, read-only)"""
+    return _cached('family', _read_family)
+
+def _notes_list(data):
+    """notes.json holds {"notes": [...]}, older files a bare list"""
+    if isinstance(data, dict):
+        return data.get('notes', [])
+    return data if isinstance(data, list) else []
+
+def load_notes():
+    """Load notes from storage"""
+    return _notes_list(storage.load('notes'))
+
+# -------------------------------------------------------
+# Item-level updates (optimistic concurrency)
+# -------------------------------------------------------
+# Collections edited item by item, and where their item list lives in the stored data
+ITEM_COLLECTIONS = {
+    'memories': 'memories',
+    'notes': 'notes',
+    'routines': None,
+    'family': None,
+}
+# Deleted ids kept next to the item list (collections with a key above) for ?since= queries
+TOMBSTONE_KEY = 'deleted_items'
+TOMBSTONE_LIMIT = int(os.environ.get("TOMBSTONE_LIMIT", 1000))
+
+class VersionConflict(Exception):
+    """The client edited an item from an older version than the stored one"""
+    def __init__(self, item):
+        super().__init__(f"Item {item.get('id')} is at version {item.get('version', 1)}")
+        self.item = item
+
+class ListConflict(VersionConflict):
+    """A whole-list save was made from an older copy of the list"""
+    def __init__(self, message, items):
+        Exception.__init__(self, message)
+        self.item = None
+        self.items = items
+
+def list_tag(items):
+    """ETag of a whole list: changes when any item is added, removed, reordered or edited"""
+    pairs = [[i.get('id'), i.get('version', 1)] for i in items if isinstance(i, dict)]
+    return hashlib.sha1(json.dumps(pairs).encode('utf-8')).hexdigest()[:16]
+
+def stamp_new_item(item):
+    """Give a newly created item its id, first version and timestamps"""
+    item.setdefault('id', str(uuid.uuid4()))
+    item['version'] = 1
+    item['updated_at'] = datetime.now().isoformat()
+    item.setdefault('created_at', item['updated_at'])
+    return item
+
+def restamp_items(old_items, new_items):
+    """Carry versions across a whole-list save, bumping only items whose content changed"""
+    old_by_id = {i.get('id'): i for i in old_items if isinstance(i, dict)}
+    for item in new_items:
+        if not isinstance(item, dict):
+            continue
+        old = old_by_id.get(item.get('id'))
+        if old is None:
+            item.setdefault('version', 1)
+            item.setdefault('updated_at', datetime.now().isoformat())
+            item.setdefault('created_at', item['updated_at'])
+            continue
+        strip = lambda d: {k: v for k, v in d.items() if k not in ('version', 'updated_at')}
+        if strip(old) == strip(item):
+            item['version'] = old.get('version', 1)
+            item['updated_at'] = old.get('updated_at')
+        else:
+            item['version'] = old.get('version', 1) + 1
+            item['updated_at'] = datetime.now().isoformat()
+    return new_items
+
+def _check_version(item, expected):
+    if expected is not None and int(expected) != item.get('version', 1):
+        raise VersionConflict(item)
+
+def tombstones(data):
+    """The [{id, deleted_at}] records of items deleted from a stored collection"""
+    if isinstance(data, dict) and isinstance(data.get(TOMBSTONE_KEY), list):
+        return data[TOMBSTONE_KEY]
     return []
 
+def _record_deletions(data, items, before):
+    """Tombstone the ids in before that are gone from items (newest TOMBSTONE_LIMIT kept)"""
+    after = {i.get('id') for i in items if isinstance(i, dict)}
+    now = datetime.now().isoformat()
+    kept = [t for t in tombstones(data) if t.get('id') not in after]
+    kept.extend({'id': item_id, 'deleted_at': now} for item_id in before if item_id not in after)
+    if kept or TOMBSTONE_KEY in data:
+        data[TOMBSTONE_KEY] = kept[-TOMBSTONE_LIMIT:]
+
+def update_items(name, fn):
+    """
+    Apply fn(items) to a mutable copy of a collection's item list under the
+    storage lock and save it. Returns fn's result; nothing is saved if fn raises.
+    Ids that fn removes are recorded as tombstones (see tombstones()).
+    """
+    key = ITEM_COLLECTIONS[name]
+    old_urls = []
+    result = []
+    def apply(loaded_data):
+        old_urls[:] = _media_urls(loaded_data)
+        if name == 'memories':
+            data = thaw(_normalize_memories(loaded_data))
+            data['last_updated'] = datetime.now().isoformat()
+        elif name == 'notes':
+            data = thaw(loaded_data) if isinstance(loaded_data, dict) else {}
+            data['notes'] = thaw(_notes_list(loaded_data))
+        else:
+            data = thaw(loaded_data) if isinstance(loaded_data, list) else []
+        if not key:
+            result.append(fn(data))
+            return data
+        before = [i.get('id') for i in data[key] if isinstance(i, dict) and i.get('id')]
+        result.append(fn(data[key]))
+        _record_deletions(data, data[key], before)
+        return data
+    new_data = storage.update(name, apply)
+    file_cache.invalidate(name)
+    if name in RETRIEVAL_SOURCES:
+        refresh_retrieval_index(name)
+    refresh_context_section(name)
+    media_store.update_refs(old_urls, _media_urls(new_data))
+    return result[0]
+
+def create_item(name, item):
+    item = stamp_new_item(dict(item))
+    def add(items):
+        if any(i.get('id') == item['id'] for i in items):
+            raise ValueError(f"Item {item['id']} already exists")
+        items.append(item)
+        return item
+    return update_items(name, add)
+
+def patch_item(name, item_id, changes, expected_version):
+    """Apply a partial update; returns the new item, or None if there is no such item"""
+    def apply(items):
+        for item in items:
+            if item.get('id') == item_id:
+                _check_version(item, expected_version)
+                item.update({k: v for k, v in changes.items() if k not in ('id', 'version', 'updated_at')})
+                item['version'] = item.get('version', 1) + 1
+                item['updated_at'] = datetime.now().isoformat()
+                return item
+        return None
+    return update_items(name, apply)
+
+def replace_items(name, new_items, if_match=None):
+    """
+    Whole-list save, under the same lock as item edits; nothing is saved on a
+    conflict, so a list edited from a stale copy cannot undo concurrent changes:
+    - an item sent with an older version than the stored one: VersionConflict
+    - an item sent with a version but no longer stored (deleted elsewhere): ListConflict
+    - if_match (the list's ETag when the client loaded it) no longer matching: ListConflict
+    - without if_match, leaving out a stored item: ListConflict, since it may
+      have been added after the client loaded the list (use DELETE, or send If-Match)
+    Items sent without a version are not version-checked.
+    """
+    def apply(items):
+        if if_match and not if_match.contains(list_tag(items)):
+            raise ListConflict('The list was changed since it was loaded', items)
+        stored = {i.get('id'): i for i in items if isinstance(i, dict)}
+        for item in new_items:
+            if not isinstance(item, dict):
+                continue
+            if item.get('id') in stored:
+                _check_version(stored[item['id']], item.get('version'))
+            elif item.get('version') is not None:
+                raise ListConflict(f"Item {item.get('id')} was deleted", items)
+        if not if_match:
+            sent = {i.get('id') for i in new_items if isinstance(i, dict)}
+            if any(item_id not in sent for item_id in stored):
+                raise ListConflict('Removing items needs If-Match with the list ETag, or DELETE', items)
+        items[:] = restamp_items(items, new_items)
+        return items
+    return update_items(name, apply)
+
+def _list_response(items, key=None):
+    """A whole list (or {'status', key: list} after a save), with the list's ETag for If-Match"""
+    response = jsonify(items if key is None else {'status': 'success', key: items})
+    response.set_etag(list_tag(items))
+    return response
+
+def delete_item(name, item_id, expected_version):
+    """Remove an item; returns it, or None if there is no such item"""
+    def apply(items):
+        for index, item in enumerate(items):
+            if item.get('id') == item_id:
+                _check_version(item, expected_version)
+                return items.pop(index)
+        return None
+    return update_items(name, apply)
+
 def load_chat_history_data():
-    """Load chat history from JSON file"""
-    if os.path.exists(CHAT_FILE):
-        try:
-            with open(CHAT_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            pass
-    return []
+    """Load the full chat history (including turns still in the write queue)"""
+    write_queue.flush(timeout=5)
+    return storage.all_chat()
+
+def load_recent_chat(limit=10):
+    """Load only the latest chat messages"""
+    write_queue.flush(timeout=5)
+    return storage.recent_chat(limit)
+
+# -------------------------------------------------------
+# Retrieval — only the records relevant to each message go into the prompt
+# -------------------------------------------------------
+RETRIEVAL_LIMITS = {'memories': 5, 'routines': 3, 'family': 3}
+RETRIEVAL_BUDGET_CHARS = int(os.environ.get("RETRIEVAL_BUDGET_CHARS", 2000))
+retrieval_index = LocalProxy(lambda: tenants.current().retrieval_index)
+_indexed_stamps = LocalProxy(lambda: tenants.current().indexed_stamps)
+
+def _memory_records():
+    for i, m in enumerate(load_memories().get('memories', [])):
+        if isinstance(m, dict):
+            yield (m.get('id') or f"pos{i}",
+                   f"memory {m.get('title') or ''} {m.get('description') or ''} {m.get('date') or ''}",
+                   f"- {m.get('title')}: {m.get('description')}")
+
+def _routine_records():
+    for i, r in enumerate(load_routines()):
+        if isinstance(r, dict):
+            days = ' '.join(r.get('days') or [])
+            yield (r.get('id') or f"pos{i}",
+                   f"routine schedule {r.get('title') or ''} {r.get('description') or ''} {r.get('time') or ''} {days}",
+                   f"- {r.get('title')} at {r.get('time')} ({r.get('days')})")
+
+def _family_records():
+    for i, f in enumerate(load_family()):
+        if isinstance(f, dict):
+            display = f"- {f.get('name')} ({f.get('relation')})"
+            if f.get('birthday'): display += f" - Birthday: {f.get('birthday')}"
+            yield (f.get('id') or f"pos{i}",
+                   f"family contact {f.get('name') or ''} {f.get('relation') or ''} {f.get('notes') or ''} birthday",
+                   display)
+
+RETRIEVAL_SOURCES = {
+    'memories': ('STORED MEMORIES', _memory_records),
+    'routines': ('CURRENT ROUTINES', _routine_records),
+    'family': ('FAMILY & CONTACTS', _family_records),
+}
 
-def save_family(family_data):
-    """Save family data to JSON file"""
-    with open(FAMILY_FILE, 'w') as f:
-        json.dump(family_data, f, indent=2)
+def refresh_retrieval_index(kind=None):
+    """Re-index a collection if its stored version changed (only changed records are touched)"""
+    for name in ([kind] if kind else RETRIEVAL_SOURCES):
+        stamp = storage.stamp(name)
+        if _indexed_stamps.get(name) != stamp:
+            retrieval_index.sync(name, RETRIEVAL_SOURCES[name][1]())
+            _indexed_stamps[name] = stamp
+
+def retrieve_relevant_context(user_message):
+    """Format the top-k stored records for this message, or '' if nothing matches"""
+    refresh_retrieval_index()
+    results = retrieval_index.search(user_message, RETRIEVAL_LIMITS, RETRIEVAL_BUDGET_CHARS)
+    if not results:
+        return ''
+    sections = []
+    for kind, (heading, _) in RETRIEVAL_SOURCES.items():
+        lines = [display for _, k, display in results if k == kind]
+        if lines:
+            sections.append(heading + ":\n" + "\n".join(lines))
+    return "[RELEVANT PERSONAL CONTEXT for this message:\n" + "\n\n".join(sections) + "]"
+
+# -------------------------------------------------------
+# Full-text search over chat, memories and notes
+# -------------------------------------------------------
+SEARCH_DB_FILE = os.environ.get("SEARCH_DB_FILE", "search.db")
+SEARCH_KINDS = ('chat', 'memories', 'notes')
+SEARCH_ENABLED = fts5_available()
+if not SEARCH_ENABLED:
+    print("⚠️ SQLite was built without FTS5; /api/search is disabled")
+search_index = LocalProxy(lambda: tenants.current().search_index)
+
+def _chat_search_records(messages):
+    return [(m.get('id') or f"{m.get('timestamp')}-{m.get('sender')}", m.get('timestamp'),
+             m.get('sender') or '', m.get('content') or '')
+            for m in messages if isinstance(m, dict)]
+
+def _memory_search_records():
+    return [(m.get('id') or f"pos{i}", m.get('date'), m.get('title') or '', m.get('description') or '')
+            for i, m in enumerate(load_memories().get('memories', [])) if isinstance(m, dict)]
+
+def _note_search_records():
+    return [(n.get('id') or f"pos{i}", n.get('created_at'), n.get('title') or '', n.get('content') or '')
+            for i, n in enumerate(load_notes()) if isinstance(n, dict)]
+
+def index_chat_messages(messages, replace=False):
+    """Keep the search index in step with the chat log (never fails the caller)"""
+    if not SEARCH_ENABLED:
+        return
+    try:
+        if replace:
+            search_index.sync('chat', None, _chat_search_records(messages))
+        else:
+            search_index.append('chat', _chat_search_records(messages))
+    except Exception as e:
+        print(f"Could not index chat messages: {e}")
+
+def refresh_search_index():
+    """Bring memories/notes up to date by storage stamp; reconcile chat once per process"""
+    tenant = tenants.current()
+    search_index.sync('memories', storage.stamp('memories'), _memory_search_records)
+    search_index.sync('notes', storage.stamp('notes'), _note_search_records)
+    if not tenant.search_chat_checked:
+        messages = load_chat_history_data()
+        if search_index.count('chat') != len(messages):
+            search_index.sync('chat', None, _chat_search_records(messages))
+        tenant.search_chat_checked = True
+
+# Categories of extracted data that hold dicts rather than strings
+DICT_CATEGORIES = ["memories", "daily_routines", "medications"]
+# Field a plain string goes into when the model writes one for a dict category
+# (the prompt's own examples for medications are strings)
+DICT_TEXT_FIELDS = {"memories": "title", "daily_routines": "title", "medications": "name"}
+
+# Keys that identify where a fact came from rather than what it says
+DEDUP_IGNORED_KEYS = {'id', 'source', 'chatRef', 'mediaPath'}
+
+def _normalize_text(value):
+    """Case- and whitespace-folded form used for duplicate detection"""
+    return ' '.join(value.casefold().split())
+
+def dedup_key(item):
+    """Hashable canonical key for an extracted item (string or dict)"""
+    if isinstance(item, str):
+        return _normalize_text(item)
+    if isinstance(item, dict):
+        return tuple(sorted(
+            (k, dedup_key(v)) for k, v in item.items()
+            if k not in DEDUP_IGNORED_KEYS and v not in (None, '', [], {})
+        ))
+    if isinstance(item, list):
+        return tuple(dedup_key(v) for v in item)
+    return item
+
+class DedupIndex:
+    """Per-category sets of canonical keys, so merges cost O(new items)"""
+
+    def __init__(self, data=None):
+        self.keys = {}
+        if data:
+            for category, items in data.items():
+                if category == "adaptive_categories" and isinstance(items, dict):
+                    for adaptive_key, adaptive_items in items.items():
+                        if isinstance(adaptive_items, list):
+                            self._keys(("adaptive", adaptive_key)).update(
+                                dedup_key(i) for i in adaptive_items)
+                elif isinstance(items, list):
+                    self._keys(category).update(dedup_key(i) for i in items)
+
+    def _keys(self, category):
+        keys = self.keys.get(category)
+        if keys is None:
+            keys = self.keys[category] = set()
+        return keys
+
+    def add(self, category, item):
+        """Record item; returns False if an equivalent item is already present"""
+        keys = self._keys(category)
+        key = dedup_key(item)
+        if key in keys:
+            return False
+        keys.add(key)
+        return True
+
+def merge_extracted_data(existing_data, new_data, index=None):
+    """
+    Merge new extracted data with existing memories.
+    Pass a DedupIndex built from existing_data to avoid rebuilding it per merge.
+    """
+    if index is None:
+        index = DedupIndex(existing_data)
 
-def merge_extracted_data(existing_data, new_data):
-    """Merge new extracted data with existing memories"""
-    # Define which categories should be lists of dictionaries
-    DICT_CATEGORIES = ["memories", "daily_routines", "medications"]
-    
     # Handle standard list categories
     for category, items in new_data.items():
         if category == "adaptive_categories":
             continue
-            
+
         if isinstance(items, list):
             # Initialize category if it doesn't exist (safety check)
             if category not in existing_data:
                 existing_data[category] = []
-                
+
             # Add new items that aren't already in the list
             for item in items:
                 if not item:
                     continue
-                    
+
                 # Validation: If it's a dict category, item must be a dict
                 if category in DICT_CATEGORIES:
+                    if isinstance(item, str):
+                        item = {DICT_TEXT_FIELDS[category]: item}
                     if not isinstance(item, dict):
                         print(f"Skipping invalid item in {category}: {item} (expected dict)")
                         continue
@@ -370,98 +1052,268 @@ def merge_extracted_data(existing_data, new_data):
                     if not isinstance(item, str):
                         print(f"Skipping invalid item in {category}: {item} (expected string)")
                         continue
-                        
-                if item not in existing_data[category]:
+
+                if index.add(category, item):
                     existing_data[category].append(item)
-    
+
     # Handle adaptive categories specially
     if "adaptive_categories" in new_data and isinstance(new_data["adaptive_categories"], dict):
         if "adaptive_categories" not in existing_data:
             existing_data["adaptive_categories"] = {}
-            
+
         for adaptive_key, adaptive_value in new_data["adaptive_categories"].items():
             # If the adaptive category doesn't exist, create it as a list
             if adaptive_key not in existing_data["adaptive_categories"]:
                 existing_data["adaptive_categories"][adaptive_key] = []
-            
-            # If the value is a string, add it to the list if unique
-            if isinstance(adaptive_value, str):
-                if adaptive_value not in existing_data["adaptive_categories"][adaptive_key]:
-                    existing_data["adaptive_categories"][adaptive_key].append(adaptive_value)
-            # If the value is a list, extend the list with unique items
-            elif isinstance(adaptive_value, list):
-                for item in adaptive_value:
-                    if item not in existing_data["adaptive_categories"][adaptive_key]:
+
+            # A single string or a list of items, each added if unique
+            values = [adaptive_value] if isinstance(adaptive_value, str) else adaptive_value
+            if isinstance(values, list):
+                for item in values:
+                    if index.add(("adaptive", adaptive_key), item):
                         existing_data["adaptive_categories"][adaptive_key].append(item)
-                        
+
     return existing_data
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
+# Dedup index for the stored memories, valid while the storage stamp matches
+_memories_dedup = LocalProxy(lambda: tenants.current().memories_dedup)
+
+def merge_into_memories(extractions):
     """
-    Handle chat messages and return Gemini AI responses with memory extraction
+    Merge a list of extracted_data dicts into stored memories in one save,
+    reusing the dedup index across merges
     """
+    def apply(full_data):
+        stamp = storage.stamp('memories')
+        index = _memories_dedup['index'] if _memories_dedup['stamp'] == stamp else None
+        _memories_dedup['index'] = None
+        if index is None:
+            index = DedupIndex(full_data)
+        merged = full_data
+        for new_data in extractions:
+            merged = merge_extracted_data(merged, new_data, index)
+        _memories_dedup['index'] = index
+        return merged
+    result = update_memories(apply)
+    if _memories_dedup['index'] is not None:
+        _memories_dedup['stamp'] = storage.stamp('memories')
+    return result
+
+def mergeable_extraction(extracted_data):
+    """
+    The part of a turn's extracted_data that is merged automatically. Story
+    memories are left out: those are only saved once the user confirms them.
+    """
+    if not isinstance(extracted_data, dict):
+        return {}
+    return {k: v for k, v in extracted_data.items() if k != 'memories' and v}
+
+# -------------------------------------------------------
+# Write-behind persistence (group commit off the request path)
+# -------------------------------------------------------
+# Payloads are (tenant_id, data); each tenant's share of a batch is committed
+# to that tenant's storage on its own, so one tenant's failure (disk full,
+# lock timeout, bad record) only retries that tenant's writes. Writes that
+# still fail after the queue's retries are parked in FAILED_WRITES_FILE and
+# replayed at the next start.
+FAILED_WRITES_FILE = os.environ.get("FAILED_WRITES_FILE", "failed_writes.jsonl")
+
+def _commit_per_tenant(entries, commit):
+    """Run commit(payloads) per tenant; raise PartialCommit with the entries of tenants that failed"""
+    failed, error = [], None
+    for tenant_id, group in group_by_tenant((entry[0], entry) for entry in entries).items():
+        try:
+            with use_tenant(tenant_id):
+                commit([payload for _, payload in group])
+        except Exception as e:
+            print(f"Commit for tenant {tenant_id} failed: {e}")
+            failed.extend(group)
+            error = error or e
+    if failed:
+        raise PartialCommit(failed, error)
+
+def _commit_chat_turns(entries):
+    """One log append (one fsync) per tenant for every turn in the batch"""
+    def commit(turns):
+        with PERSIST_LATENCY.time('chat'):
+            messages = [m for turn in turns for m in turn]
+            storage.append_chat(messages)
+            index_chat_messages(messages)
+    _commit_per_tenant(entries, commit)
+
+def _commit_extractions(entries):
+    """One atomic memories rewrite per tenant in the batch"""
+    def commit(extractions):
+        with PERSIST_LATENCY.time('memories'):
+            merge_into_memories(extractions)
+    _commit_per_tenant(entries, commit)
+
+def _park_failed_writes(kind, entries, error):
+    """Keep writes that kept failing on disk, to be replayed at the next start"""
+    with open(FAILED_WRITES_FILE, 'a') as f:
+        for tenant_id, payload in entries:
+            f.write(json.dumps({'kind': kind, 'tenant': tenant_id, 'payload': payload, 'error': str(error),
+                                'time': datetime.now().isoformat()}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    print(f"Parked {len(entries)} failed {kind} write(s) in {FAILED_WRITES_FILE}")
+
+def replay_failed_writes():
+    """Queue the writes parked by an earlier run again (they are parked again if they still fail)"""
+    if not os.path.exists(FAILED_WRITES_FILE):
+        return 0
+    replaying = FAILED_WRITES_FILE + '.replay'
     try:
-        data = request.get_json()
-        user_message = data.get('message', '')
-        session_id = data.get('session_id', 'default')
-        
-        if not user_message:
-            return jsonify({'error': 'No message provided'}), 400
-
-        # -------------------------------------------------------
-        # DOUBLE MENTION RULE — track recurring topics per session
-        # -------------------------------------------------------
-        if session_id not in mention_tracker:
-            mention_tracker[session_id] = {}
-
-        # Use simple keyword extraction: lowercase words > 4 chars, excluding stopwords
-        STOPWORDS = {
-            'that', 'this', 'with', 'have', 'from', 'they', 'were', 'been',
-            'would', 'could', 'should', 'about', 'when', 'what', 'just',
-            'there', 'their', 'then', 'than', 'will', 'some', 'also', 'which'
-        }
-        words = [w.strip(".,!?\"'") for w in user_message.lower().split()]
-        keywords = [w for w in words if len(w) > 4 and w not in STOPWORDS]
-
-        repeated_topic = None  # Will be injected into the AI context if a repeat is found
-        for kw in keywords:
-            if kw not in mention_tracker[session_id]:
-                mention_tracker[session_id][kw] = {'count': 1, 'prompted': False}
-            else:
-                mention_tracker[session_id][kw]['count'] += 1
-                # Trigger the confirmation prompt the first time a topic hits 2+ mentions
-                if (mention_tracker[session_id][kw]['count'] >= 2
-                        and not mention_tracker[session_id][kw]['prompted']):
-                    mention_tracker[session_id][kw]['prompted'] = True
-                    repeated_topic = kw
-                    break  # Only flag one topic per turn
-
-        # Initialize conversation history for this session if it doesn't exist
-        if session_id not in conversation_history:
-            # Load all personal data to provide full context
-            profile = load_profile()
-            routines = load_routines()
-            memories = load_memories()
-            family = load_family()
-            past_chat = load_chat_history_data()
-
-            # ---- Language context ----
-            app_language = profile.get('app_language', 'en')
-            languages_spoken = profile.get('languages_spoken', [])
-            if isinstance(languages_spoken, str):
-                languages_spoken = [l.strip() for l in languages_spoken.split(',') if l.strip()]
-
-            LANG_NAMES = {
-                'en': 'English', 'fr': 'French', 'es': 'Spanish', 'de': 'German',
-                'it': 'Italian', 'pt': 'Portuguese', 'hi': 'Hindi', 'ar': 'Arabic',
-                'zh': 'Mandarin Chinese', 'ja': 'Japanese', 'ko': 'Korean', 'pa': 'Punjabi',
-            }
-            primary_lang_name = LANG_NAMES.get(app_language, app_language)
-            spoken_list = ', '.join(languages_spoken) if languages_spoken else primary_lang_name
+        os.replace(FAILED_WRITES_FILE, replaying)
+    except FileNotFoundError:
+        return 0  # another worker process took them
+    count = 0
+    with open(replaying, 'r') as f:
+        for line in f:
+            try:
+                parked = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if parked.get('kind') in WRITE_HANDLERS:
+                write_queue.submit(parked['kind'], (parked['tenant'], parked['payload']))
+                count += 1
+    write_queue.flush()
+    os.remove(replaying)
+    print(f"Replayed {count} parked write(s) from {FAILED_WRITES_FILE}")
+    return count
+
+WRITE_HANDLERS = {
+    'chat': _commit_chat_turns,
+    'memories': _commit_extractions,
+}
+write_queue = WriteBehindQueue(
+    WRITE_HANDLERS,
+    max_depth=int(os.environ.get("WRITE_QUEUE_DEPTH", 1000)),
+    linger=float(os.environ.get("WRITE_QUEUE_LINGER_MS", 2)) / 1000,
+    retries=int(os.environ.get("WRITE_QUEUE_RETRIES", 3)),
+    on_failure=_park_failed_writes,
+)
+atexit.register(write_queue.close)
+replay_failed_writes()
+
+# Background extraction jobs (two-stage turns). Registered after the write
+# queue so that, at exit, running extractions finish before it is closed.
+extraction_jobs = JobQueue(workers=EXTRACTION_WORKERS, name='extraction')
+atexit.register(extraction_jobs.close)
+# With several workers the client's poll may reach one that did not run the
+# job, so job states are also recorded in the shared session database
+extraction_results = SessionStore(
+    'extractions', max_entries=SESSION_MAX_ENTRIES, ttl_seconds=600,
+    spill_db=SESSION_DB_FILE, spill_ttl_seconds=3600, shared=True
+) if MULTIPROCESS else None
+
+def persist(kind, payload):
+    """
+    Queue a write for the background writer. The write is in memory only
+    until its batch commits, so a crash before then loses it (see
+    write_queue.py). When the queue stays full the caller has already
+    waited put_timeout (backpressure); the write is then done inline.
+    """
+    entry = (current_tenant_id(), payload)
+    try:
+        write_queue.submit(kind, entry)
+    except QueueFull as e:
+        print(f"{e}; writing {kind} inline")
+        WRITE_HANDLERS[kind]([entry])
+
+# -------------------------------------------------------
+# Chat pipeline stages (shared by /api/chat and /api/chat/stream)
+# -------------------------------------------------------
+class InvalidSessionId(ValueError):
+    pass
+
+def session_key(session_id):
+    """Session id as stored: always qualified by the tenant, so one tenant cannot name another's session"""
+    if not isinstance(session_id, str) or not session_id or ':' in session_id:
+        raise InvalidSessionId('session_id must be a non-empty string without ":"')
+    return f"{current_tenant_id()}:{session_id}"
+
+def track_mentions(session_id, user_message):
+    """
+    DOUBLE MENTION RULE — track recurring topics per session.
+    Returns (the keyword that just hit its second mention or None, the
+    keywords counted), for untrack_mentions() if the turn is abandoned.
+    """
+    mentions = mention_tracker.get(session_id)
+    if mentions is None:
+        mentions = mention_tracker[session_id] = {}
+
+    # Use simple keyword extraction: lowercase words > 4 chars, excluding stopwords
+    STOPWORDS = {
+        'that', 'this', 'with', 'have', 'from', 'they', 'were', 'been',
+        'would', 'could', 'should', 'about', 'when', 'what', 'just',
+        'there', 'their', 'then', 'than', 'will', 'some', 'also', 'which'
+    }
+    words = [w.strip(".,!?\"'") for w in user_message.lower().split()]
+    keywords = [w for w in words if len(w) > 4 and w not in STOPWORDS]
+
+    repeated_topic = None  # Will be injected into the AI context if a repeat is found
+    counted = []
+    for kw in keywords:
+        counted.append(kw)
+        if kw not in mentions:
+            mentions[kw] = {'count': 1, 'prompted': False}
+        else:
+            mentions[kw]['count'] += 1
+            # Trigger the confirmation prompt the first time a topic hits 2+ mentions
+            if (mentions[kw]['count'] >= 2
+                    and not mentions[kw]['prompted']):
+                mentions[kw]['prompted'] = True
+                repeated_topic = kw
+                break  # Only flag one topic per turn
+    if keywords:
+        mention_tracker.save(session_id)
+    return repeated_topic, counted
+
+def untrack_mentions(session_id, repeated_topic, counted):
+    """Take back what track_mentions counted for a turn that never got a reply"""
+    mentions = mention_tracker.get(session_id)
+    if not mentions or not counted:
+        return
+    for kw in counted:
+        if kw in mentions:
+            mentions[kw]['count'] -= 1
+            if mentions[kw]['count'] <= 0:
+                del mentions[kw]
+    if repeated_topic in mentions:
+        mentions[repeated_topic]['prompted'] = False
+    mention_tracker.save(session_id)
+
+# -------------------------------------------------------
+# Context digest: the personal context pinned to each session
+# -------------------------------------------------------
+# Sections are rendered per tenant and re-rendered only when their
+# collection is saved (or its storage stamp moves). Sessions compare the
+# digest version on every turn and swap in the new context when it changed,
+# so a routine added mid-session is seen on the next message.
+DIGEST_MAX_ITEMS = int(os.environ.get("DIGEST_MAX_ITEMS", 20))
+RECAP_MESSAGES = 10
+
+LANG_NAMES = {
+    'en': 'English', 'fr': 'French', 'es': 'Spanish', 'de': 'German',
+    'it': 'Italian', 'pt': 'Portuguese', 'hi': 'Hindi', 'ar': 'Arabic',
+    'zh': 'Mandarin Chinese', 'ja': 'Japanese', 'ko': 'Korean', 'pa': 'Punjabi',
+}
 
-            language_instructions = f"""
-LANGUAGE SETTINGS:
+def profile_languages(profile):
+    """(primary language code, its name, languages the user also speaks as text)"""
+    app_language = profile.get('app_language', 'en')
+    languages_spoken = profile.get('languages_spoken', [])
+    if isinstance(languages_spoken, str):
+        languages_spoken = [l.strip() for l in languages_spoken.split(',') if l.strip()]
+    primary_lang_name = LANG_NAMES.get(app_language, app_language)
+    spoken_list = ', '.join(languages_spoken) if languages_spoken else primary_lang_name
+    return app_language, primary_lang_name, spoken_list
+
+def _profile_section():
+    profile = load_profile()
+    app_language, primary_lang_name, spoken_list = profile_languages(profile)
+    language_instructions = f"""LANGUAGE SETTINGS:
 - Primary App Language: {primary_lang_name} (code: {app_language})
   → You MUST respond in {primary_lang_name} by default in every message.
 - Languages the user also speaks: {spoken_list}
@@ -473,200 +1325,759 @@ LANGUAGE SETTINGS:
   → Do NOT permanently change App Language or add it to their spoken languages.
   → At the start of the NEXT conversation, revert to {primary_lang_name}."""
 
-            # Format Personal Context
-            context_parts = []
-
-            # 1. Profile Context
-            profile_text = "USER PROFILE:\n"
-            if profile.get('name'): profile_text += f"- Name: {profile['name']}\n"
-            if profile.get('age'): profile_text += f"- Age: {profile['age']}\n"
-            if profile.get('medical_conditions'): profile_text += f"- Medical Context: {profile['medical_conditions']}\n"
-            if profile.get('hobbies'): profile_text += f"- Interests: {profile['hobbies']}\n"
-            context_parts.append(profile_text)
-
-            # 2. Routine Context
-            if routines:
-                routine_text = "CURRENT ROUTINES:\n"
-                for r in routines:
-                    routine_text += f"- {r.get('title')} at {r.get('time')} ({r.get('days')})\n"
-                context_parts.append(routine_text)
-
-            # 3. Memory Context
-            if memories.get('memories'):
-                memory_text = "STORED MEMORIES:\n"
-                for m in memories['memories']:
-                    memory_text += f"- {m.get('title')}: {m.get('description')}\n"
-                context_parts.append(memory_text)
-
-            # 4. Family Context
-            if family:
-                family_text = "FAMILY & CONTACTS:\n"
-                for f in family:
-                    family_text += f"- {f.get('name')} ({f.get('relation')})"
-                    if f.get('birthday'): family_text += f" - Birthday: {f.get('birthday')}"
-                    family_text += "\n"
-                context_parts.append(family_text)
-
-            # 5. Past Chat Context (Latest 10 messages for brevity)
-            if past_chat:
-                chat_text = "PAST CONVERSATIONS (RECAP):\n"
-                for msg in past_chat[-10:]:
-                    chat_text += f"[{msg.get('timestamp')}] {msg.get('sender')}: {msg.get('content')}\n"
-                context_parts.append(chat_text)
-
-            full_context = "\n\n".join(context_parts)
-
-            conversation_history[session_id] = [
-                {
-                    "role": "user",
-                    "parts": [{"text": SYSTEM_PROMPT + language_instructions + "\n\nENVIRONMENT CONTEXT:\nCurrent Time: " + datetime.now().strftime("%Y-%m-%d %H:%M") + "\n\n" + full_context}]
-                },
-                {
-                    "role": "model",
-                    "parts": [{"text": f"I understand. I will respond primarily in {primary_lang_name} and adapt seamlessly if you speak in {spoken_list}. I have loaded all your personal context and am ready to help."}]
-                }
-            ]
-
-        # Add user message to history, injecting Double Mention hint if applicable
-        user_turn_text = user_message
-        if repeated_topic:
-            user_turn_text = (
-                f"{user_message}\n\n"
-                f"[REPEATED TOPIC: The user has now mentioned '{repeated_topic}' at least twice "
-                f"in this session. Please gently offer to save this as a memory and populate "
-                f"'memory_to_confirm' in your JSON response.]"
-            )
-        conversation_history[session_id].append({
+    profile_text = "USER PROFILE:\n"
+    if profile.get('name'): profile_text += f"- Name: {profile['name']}\n"
+    if profile.get('age'): profile_text += f"- Age: {profile['age']}\n"
+    if profile.get('medical_conditions'): profile_text += f"- Medical Context: {profile['medical_conditions']}\n"
+    if profile.get('hobbies'): profile_text += f"- Interests: {profile['hobbies']}\n"
+    return language_instructions + "\n\n" + profile_text
+
+def _routines_section():
+    lines = []
+    for r in load_routines():
+        if isinstance(r, dict) and not r.get('paused'):
+            days = r.get('days') or []
+            lines.append(f"- {r.get('time') or 'any time'} {r.get('title')}"
+                         + (f" ({', '.join(days)})" if days and len(days) < 7 else " (daily)" if days else ""))
+    if not lines:
+        return ''
+    return "DAILY SCHEDULE:\n" + "\n".join(lines[:DIGEST_MAX_ITEMS])
+
+def _family_section():
+    lines = [f"- {f.get('name')}" + (f" ({f['relation']})" if f.get('relation') else "")
+             for f in load_family() if isinstance(f, dict) and f.get('name')]
+    if not lines:
+        return ''
+    return "FAMILY & CONTACTS:\n" + "\n".join(lines[:DIGEST_MAX_ITEMS])
+
+def _memories_section():
+    stories = [m for m in load_memories().get('memories', []) if isinstance(m, dict) and m.get('title')]
+    if not stories:
+        return ''
+    latest = [f"- {m['title']}" + (f" ({m['date']})" if m.get('date') else "") for m in stories[-DIGEST_MAX_ITEMS:]]
+    return f"SAVED MEMORIES ({len(stories)}, most recent):\n" + "\n".join(reversed(latest))
+
+def _recap_section():
+    past_chat = load_recent_chat(RECAP_MESSAGES)
+    if not past_chat:
+        return ''
+    chat_text = "PAST CONVERSATIONS (RECAP):\n"
+    for msg in past_chat:
+        chat_text += f"[{msg.get('timestamp')}] {msg.get('sender')}: {msg.get('content')}\n"
+    return chat_text
+
+# Section -> (renderer, stored collection it is built from), in prompt order
+CONTEXT_SECTIONS = {
+    'profile': (_profile_section, 'profile'),
+    'routines': (_routines_section, 'routines'),
+    'family': (_family_section, 'family'),
+    'memories': (_memories_section, 'memories'),
+    'recap': (_recap_section, 'chat'),
+}
+
+def open_context_digest(storage):
+    return ContextDigest({name: render for name, (render, _) in CONTEXT_SECTIONS.items()},
+                         stamp=lambda name: storage.stamp(CONTEXT_SECTIONS[name][1]))
+
+context_digest = LocalProxy(lambda: tenants.current().context_digest)
+
+def refresh_context_section(collection):
+    """Re-render the digest section built from a collection that was just saved"""
+    for name, (_, source) in CONTEXT_SECTIONS.items():
+        if source == collection:
+            context_digest.refresh(name)
+
+RECORDS_NOTE = (
+    "PERSONAL RECORDS:\nThe stored memories (STORED MEMORIES), routines (CURRENT ROUTINES) and "
+    "family & contacts (FAMILY & CONTACTS) most relevant to each user message are attached to "
+    "that message under [RELEVANT PERSONAL CONTEXT ...]; the lists above are only an overview. "
+    "Use the attached records for details.\n"
+)
+
+def system_context(sections):
+    """The chat instructions followed by the user's context"""
+    return CHAT_SYSTEM_PROMPT + "\n" + "\n\n".join(sections + [RECORDS_NOTE])
+
+def context_turns(sections):
+    """The leading pinned turns of every session (without SYSTEM_INSTRUCTION)"""
+    _, primary_lang_name, spoken_list = profile_languages(load_profile())
+    return [
+        {
             "role": "user",
-            "parts": [{"text": user_turn_text}]
-        })
-        
-        # Prepare the request payload
-        payload = {
-            "contents": conversation_history[session_id],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 1024,
-            }
-        }
-        
-        # Send request to Gemini API
-        response = requests.post(GEMINI_API_URL, json=payload)
-        
-        if response.status_code != 200:
-            print(f"API Error: {response.status_code} - {response.text}")
-            return jsonify({'error': f'Gemini API error: {response.status_code}'}), 500
-        
-        # Extract the response text
-        response_data = response.json()
-        bot_response_text = response_data['candidates'][0]['content']['parts'][0]['text']
-        
-        # Add bot response to history
-        conversation_history[session_id].append({
+            "parts": [{"text": system_context(sections)}]
+        },
+        {
             "role": "model",
-            "parts": [{"text": bot_response_text}]
-        })
-        
-        # Parse the JSON response from Gemini
-        memory_to_confirm = None
-        memory_actions = {}
-        try:
-            # Extract JSON from the response (it might be wrapped in markdown code blocks)
-            json_start = bot_response_text.find('{')
-            json_end = bot_response_text.rfind('}') + 1
-            
-            if json_start != -1 and json_end > json_start:
-                json_str = bot_response_text[json_start:json_end]
-                parsed_response = json.loads(json_str)
-                
-                # Extract the conversational response and data
-                conversational_response = parsed_response.get('response', bot_response_text)
-                extracted_data = parsed_response.get('extracted_data', {})
-                memory_actions = parsed_response.get('memory_actions', {})
-
-                # Extract memory_to_confirm — populated by AI when Double Mention Rule fires
-                raw_confirm = parsed_response.get('memory_to_confirm')
-                if isinstance(raw_confirm, dict) and raw_confirm.get('title'):
-                    memory_to_confirm = raw_confirm
-
-                print(f"Detected potential data: {extracted_data}")
-                if memory_to_confirm:
-                    print(f"Memory to confirm (Double Mention): {memory_to_confirm}")
-                if memory_actions.get('surfaced_memory'):
-                    print(f"Surfaced memory: {memory_actions['surfaced_memory']} (mode: {memory_actions.get('surfacing_mode')})")
-                
-            else:
-                # If no JSON found, use the whole response
-                conversational_response = bot_response_text
-                extracted_data = {}
-        
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
-            print(f"Response text: {bot_response_text}")
+            "parts": [{"text": f"I understand. I will respond primarily in {primary_lang_name} and adapt seamlessly if you speak in {spoken_list}. I have loaded all your personal context and am ready to help."}]
+        }
+    ]
+
+def session_start_turns():
+    """Pinned turns fixed for the session's lifetime: when it started and the recap before it"""
+    write_queue.flush(timeout=5)  # the recap includes turns still being written
+    recap = context_digest.section('recap')
+    text = "ENVIRONMENT CONTEXT:\nSession started: " + datetime.now().strftime("%Y-%m-%d %H:%M")
+    if recap:
+        text += "\n\n" + recap
+    return [
+        {"role": "user", "parts": [{"text": text}]},
+        {"role": "model", "parts": [{"text": "Thank you, I remember our past conversations."}]}
+    ]
+
+# context_version of windows whose context travels in systemInstruction
+SYSTEM_CONTEXT = 'systemInstruction'
+
+def refresh_session_context(window):
+    """Swap in the user's current context if it changed since the window was pinned"""
+    if SYSTEM_INSTRUCTION:
+        # Each turn sends the current context; drop it from windows pinned with it
+        if window.context_version != SYSTEM_CONTEXT:
+            window.replace_context([], SYSTEM_CONTEXT, replaced=2)
+            CONTEXT_REFRESHES.inc()
+        return
+    sections, version = context_digest.context()
+    if window.context_version != version:
+        # Windows started with SYSTEM_INSTRUCTION have no context turns to replace
+        window.replace_context(context_turns(sections), version,
+                               replaced=0 if window.context_version == SYSTEM_CONTEXT else None)
+        CONTEXT_REFRESHES.inc()
+
+def attach_system_context(payload):
+    """
+    Add the instructions and personal context to a chat payload: by name when
+    they are in the context cache, else as systemInstruction. Returns their
+    estimated token count.
+    """
+    sections, version = context_digest.context()
+    text = system_context(sections)
+    if context_cache is not None:
+        name = context_cache.get(current_tenant_id(), version, text)
+        if name:
+            payload['cachedContent'] = name
+            SYSTEM_CONTEXT_SENT.inc('cached')
+            return estimate_tokens(text)
+    payload['systemInstruction'] = {'parts': [{'text': text}]}
+    SYSTEM_CONTEXT_SENT.inc('instruction')
+    return estimate_tokens(text)
+
+# generateContent answers for a cachedContent entry that has expired or gone
+CACHE_REJECTED_STATUSES = {400, 403, 404}
+
+def uncached_payload(payload):
+    """The payload with its (rejected) cache entry swapped for the plain systemInstruction"""
+    context_cache.invalidate(current_tenant_id(), payload['cachedContent'])
+    SYSTEM_CONTEXT_SENT.inc('rejected')
+    payload = {k: v for k, v in payload.items() if k != 'cachedContent'}
+    payload['systemInstruction'] = {'parts': [{'text': system_context(context_digest.context()[0])}]}
+    return payload
+
+def generate_reply(payload):
+    """generateContent for a chat turn, resent without the context cache if upstream refuses it"""
+    response = gemini.generate_content(payload)
+    if response.status_code in CACHE_REJECTED_STATUSES and 'cachedContent' in payload:
+        print(f"Context cache refused: {response.status_code} - {response.text[:200]}")
+        response = gemini.generate_content(uncached_payload(payload))
+    return response
+
+def stream_reply(payload, usage):
+    """stream_generate_content for a chat turn, with the same fallback as generate_reply"""
+    try:
+        yield from gemini.stream_generate_content(payload, usage=usage)
+    except GeminiHTTPError as e:
+        # Raised before any text arrives, so nothing has been yielded yet
+        if e.status_code not in CACHE_REJECTED_STATUSES or 'cachedContent' not in payload:
+            raise
+        print(f"Context cache refused: {e}")
+        yield from gemini.stream_generate_content(uncached_payload(payload), usage=usage)
+
+def reply_text(bot_response_text):
+    """The conversational part of a model turn, without logging"""
+    try:
+        parsed = json.loads(bot_response_text[bot_response_text.find('{'):bot_response_text.rfind('}') + 1])
+        if isinstance(parsed, dict) and isinstance(parsed.get('response'), str):
+            return parsed['response']
+    except json.JSONDecodeError:
+        pass
+    return bot_response_text
+
+def transcript_lines(turns):
+    """Plain 'User: ...' / 'Assistant: ...' lines for window turns"""
+    transcript = []
+    for turn in turns:
+        text = ' '.join(p.get('text', '') for p in turn.get('parts', []))
+        if turn.get('role') == 'model':
+            transcript.append(f"Assistant: {reply_text(text)}")
+        else:
+            # Drop the injected [REPEATED TOPIC ...] hint
+            text = text.split("\n\n[REPEATED TOPIC")[0]
+            transcript.append(f"User: {text}")
+    return transcript
+
+def summarize_turns(previous_summary, turns):
+    """Fold older conversation turns into the session's running summary (runs in background)"""
+    transcript = transcript_lines(turns)
+    prompt = (
+        "Update the running summary of a conversation between an elderly person and their "
+        "memory companion. Keep names, places, dates, feelings and anything the person asked "
+        "to remember. Write at most 150 words of plain text, no JSON.\n\n"
+        f"CURRENT SUMMARY:\n{previous_summary or '(none)'}\n\n"
+        "NEW CONVERSATION TO ADD:\n" + '\n'.join(transcript)
+    )
+    response = gemini.generate_content({
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.2, "maxOutputTokens": 300}
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f"Gemini API error: {response.status_code}")
+    return reply_text(response.json()['candidates'][0]['content']['parts'][0]['text']).strip()
+
+def new_conversation_window():
+    """Fresh session window pinned to the current personal context"""
+    with CHAT_STAGE.time('session_context'):
+        if SYSTEM_INSTRUCTION:
+            pinned, version = session_start_turns(), SYSTEM_CONTEXT
+        else:
+            sections, version = context_digest.context()
+            pinned = context_turns(sections) + session_start_turns()
+        window = ConversationWindow(
+            pinned,
+            max_tokens=CONTEXT_MAX_TOKENS,
+            keep_recent=CONTEXT_KEEP_RECENT,
+            summarize=summarize_turns
+        )
+        window.context_version = version
+    return window
+
+def start_turn(session_id, user_message):
+    """
+    Record the user's turn in the session history. Returns the Gemini payload
+    and the turn's bookkeeping, which abandon_turn() takes to undo it.
+    """
+    repeated_topic, counted = track_mentions(session_id, user_message)
+    turn = {'repeated_topic': repeated_topic, 'counted': counted, 'settled': False}
+
+    # Initialize conversation history for this session if it doesn't exist
+    window = conversation_history.get(session_id)
+    if window is None:
+        window = conversation_history[session_id] = new_conversation_window()
+    else:
+        with CHAT_STAGE.time('session_context'):
+            refresh_session_context(window)
+
+    # Add user message to history, injecting Double Mention hint if applicable
+    user_turn_text = user_message
+    if repeated_topic:
+        user_turn_text = (
+            f"{user_message}\n\n"
+            f"[REPEATED TOPIC: The user has now mentioned '{repeated_topic}' at least twice "
+            f"in this session. Please gently offer to save this as a memory and populate "
+            f"'memory_to_confirm' in your JSON response.]"
+        )
+    window.append({
+        "role": "user",
+        "parts": [{"text": user_turn_text}]
+    })
+    conversation_history.save(session_id)
+
+    # Attach the relevant stored records to this request only (not kept in history)
+    contents = window.contents()
+    with CHAT_STAGE.time('retrieval'):
+        relevant = retrieve_relevant_context(user_message)
+    if relevant:
+        contents[-1] = {"role": "user", "parts": [{"text": f"{user_turn_text}\n\n{relevant}"}]}
+
+    # Prepare the request payload
+    payload = {"contents": contents}
+    if SYSTEM_INSTRUCTION:
+        with CHAT_STAGE.time('session_context'):
+            window.system_tokens = attach_system_context(payload)
+    window.last_prompt_tokens = window.system_tokens + sum(turn_tokens(t) for t in contents)
+    print(f"Prompt size for session {session_id}: ~{window.last_prompt_tokens} tokens")
+    generation_config = {
+        "temperature": 0.7,
+        "topK": 40,
+        "topP": 0.95,
+        "maxOutputTokens": 512 if ASYNC_EXTRACTION else 1024,
+    }
+    if STRUCTURED_OUTPUT:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = REPLY_SCHEMA if ASYNC_EXTRACTION else RESPONSE_SCHEMA
+    payload["generationConfig"] = generation_config
+    PROMPT_TOKENS.observe(window.last_prompt_tokens)
+    PROMPT_BYTES.observe(len(json.dumps(payload)))
+    return payload, turn
+
+def abandon_turn(session_id, turn):
+    """
+    Undo a turn that will get no reply (upstream failure, client gone): drop
+    the pending user turn and its mention counts, so a retry of the same
+    message is not counted twice. Does nothing once the turn is settled.
+    """
+    if turn['settled']:
+        return
+    turn['settled'] = True
+    untrack_mentions(session_id, turn['repeated_topic'], turn['counted'])
+    window = conversation_history.get(session_id)
+    if window:
+        window.pop_user_turn()
+        conversation_history.save(session_id)
+
+def parse_model_output(bot_response_text):
+    """
+    Recover the JSON envelope from the model text.
+    Returns (conversational_response, extracted_data, memory_actions, memory_to_confirm).
+    """
+    memory_to_confirm = None
+    memory_actions = {}
+    try:
+        # Extract JSON from the response (it might be wrapped in markdown code blocks)
+        json_start = bot_response_text.find('{')
+        json_end = bot_response_text.rfind('}') + 1
+
+        parsed_response = None
+        if STRUCTURED_OUTPUT:
+            # Schema-constrained replies are bare JSON; no need to hunt for it
+            try:
+                parsed_response = json.loads(bot_response_text)
+            except json.JSONDecodeError:
+                parsed_response = None
+
+        result = 'json' if parsed_response is not None else 'recovered'
+        if parsed_response is None and json_start != -1 and json_end > json_start:
+            json_str = bot_response_text[json_start:json_end]
+            parsed_response = json.loads(json_str)
+
+        if isinstance(parsed_response, dict):
+            PARSE_RESULTS.inc(result)
+            # Extract the conversational response and data
+            conversational_response = parsed_response.get('response', bot_response_text)
+            extracted_data = parsed_response.get('extracted_data') or {}
+            memory_actions = parsed_response.get('memory_actions') or {}
+
+            # The schema carries adaptive categories as [{category, items}]
+            adaptive = extracted_data.get('adaptive_categories')
+            if isinstance(adaptive, list):
+                extracted_data['adaptive_categories'] = {
+                    entry['category']: entry.get('items', [])
+                    for entry in adaptive if isinstance(entry, dict) and entry.get('category')
+                }
+
+            # Extract memory_to_confirm — populated by AI when Double Mention Rule fires
+            raw_confirm = parsed_response.get('memory_to_confirm')
+            if isinstance(raw_confirm, dict) and raw_confirm.get('title'):
+                memory_to_confirm = raw_confirm
+
+            print(f"Detected potential data: {extracted_data}")
+            if memory_to_confirm:
+                print(f"Memory to confirm (Double Mention): {memory_to_confirm}")
+            if memory_actions.get('surfaced_memory'):
+                print(f"Surfaced memory: {memory_actions['surfaced_memory']} (mode: {memory_actions.get('surfacing_mode')})")
+
+        else:
+            # If no JSON found, use the whole response
+            PARSE_RESULTS.inc('plain')
             conversational_response = bot_response_text
             extracted_data = {}
-        
-        # Prepare Response
-        final_response = {
-            'message': conversational_response,
-            'extracted_data': extracted_data,
-            'memory_actions': memory_actions,
-            'memory_to_confirm': memory_to_confirm,  # Non-null = Double Mention Rule fired
-            'timestamp': datetime.now().isoformat()
+
+    except json.JSONDecodeError as e:
+        PARSE_RESULTS.inc('error')
+        print(f"JSON parsing error: {e}")
+        print(f"Response text: {bot_response_text}")
+        conversational_response = bot_response_text
+        extracted_data = {}
+
+    return conversational_response, extracted_data, memory_actions, memory_to_confirm
+
+# Output token accounting (usageMetadata of every chat turn), per stage:
+# 'reply' is the chat call, 'extraction' the background extraction call
+_usage_lock = threading.Lock()
+usage_totals = {}
+
+def record_usage(session_id, usage, stage='reply'):
+    """Log and accumulate the token counts Gemini reported for one call"""
+    if not usage:
+        return
+    output_tokens = usage.get('candidatesTokenCount', 0)
+    prompt_tokens = usage.get('promptTokenCount', 0)
+    cached_tokens = usage.get('cachedContentTokenCount', 0)
+    OUTPUT_TOKENS.observe(output_tokens, stage)
+    print(f"Output tokens for session {session_id} ({stage}): {output_tokens} "
+          f"(prompt {prompt_tokens}, {cached_tokens} cached)")
+    with _usage_lock:
+        totals = usage_totals.setdefault(stage, {'turns': 0, 'output_tokens': 0, 'prompt_tokens': 0,
+                                                 'cached_prompt_tokens': 0, 'max_output_tokens': 0})
+        totals['turns'] += 1
+        totals['output_tokens'] += output_tokens
+        totals['prompt_tokens'] += prompt_tokens
+        totals['cached_prompt_tokens'] += cached_tokens
+        totals['max_output_tokens'] = max(totals['max_output_tokens'], output_tokens)
+
+def usage_stats():
+    with _usage_lock:
+        stages = {
+            stage: dict(totals, avg_output_tokens=round(totals['output_tokens'] / totals['turns'], 1))
+            for stage, totals in usage_totals.items()
         }
-        
-        # Automatically save this message to chat history
-        # (This implements the "All conversations must be stored in chat.json" requirement)
-        # Each message gets a unique ID so chat-derived memories can reference it.
-        user_msg_id = str(uuid.uuid4())
-        ai_msg_id = str(uuid.uuid4())
+    return dict(stages, structured_output=STRUCTURED_OUTPUT, async_extraction=ASYNC_EXTRACTION,
+                system_instruction=SYSTEM_INSTRUCTION)
+
+def extraction_prompt(window):
+    """Prompt for the extraction call: the latest exchange plus a few earlier turns"""
+    earlier = window.recent[-(2 * EXTRACTION_CONTEXT_TURNS + 2):-2]
+    user_turn, model_turn = window.recent[-2:]
+    # The current message keeps its [REPEATED TOPIC ...] hint, if any
+    current = ' '.join(p.get('text', '') for p in user_turn.get('parts', []))
+    reply = reply_text(' '.join(p.get('text', '') for p in model_turn.get('parts', [])))
+    parts = [] if SYSTEM_INSTRUCTION else [EXTRACTION_SYSTEM_PROMPT]
+    if earlier:
+        parts.append("EARLIER CONVERSATION:\n" + '\n'.join(transcript_lines(earlier)))
+    parts.append(f"CURRENT MESSAGE:\n{current}")
+    parts.append(f"ASSISTANT REPLY:\n{reply}")
+    return '\n\n'.join(parts)
+
+def run_extraction(tenant_id, job_id, session_id, prompt):
+    """
+    Second stage of a turn: extract data from the exchange, merge it into
+    memories and return what the client needs to see
+    """
+    with use_tenant(tenant_id), CHAT_STAGE.time('extraction'):
+        if extraction_results is None:
+            return _run_extraction(session_id, prompt)
+        key = f"{tenant_id}:{job_id}"
         try:
-            full_chat_history = load_chat_history_data()
-            
-            # Add user message with unique ID
-            full_chat_history.append({
+            result = _run_extraction(session_id, prompt)
+        except Exception as e:
+            extraction_results[key] = {'status': 'error', 'error': str(e)}
+            raise
+        extraction_results[key] = {'status': 'done', 'result': result}
+        return result
+
+def shared_extraction(key, wait):
+    """A job's state as recorded by whichever worker runs it, polling up to `wait` seconds"""
+    deadline = time.monotonic() + wait
+    while True:
+        job = extraction_results.get(key)
+        if job is None or job['status'] != 'pending' or time.monotonic() >= deadline:
+            return job
+        time.sleep(0.1)
+
+def _run_extraction(session_id, prompt):
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": 0.2,
+            "maxOutputTokens": 1024,
+            "responseMimeType": "application/json",
+            "responseSchema": EXTRACTION_SCHEMA,
+        }
+    }
+    if SYSTEM_INSTRUCTION:
+        payload["systemInstruction"] = {"parts": [{"text": EXTRACTION_SYSTEM_PROMPT}]}
+    response = gemini.generate_content(payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"Gemini API error: {response.status_code}")
+    response_data = response.json()
+    record_usage(session_id, response_data.get('usageMetadata'), stage='extraction')
+    text = response_data['candidates'][0]['content']['parts'][0]['text']
+    _, extracted_data, _, memory_to_confirm = parse_model_output(text)
+    extraction = mergeable_extraction(extracted_data)
+    if extraction:
+        persist('memories', extraction)
+    return {'extracted_data': extracted_data, 'memory_to_confirm': memory_to_confirm}
+
+def finish_turn(session_id, user_message, bot_response_text):
+    """Record the model's reply, persist the exchange and build the client response"""
+    # Add bot response to history (may fold older turns into the summary).
+    # The session may have been evicted while waiting on Gemini; get() rehydrates it.
+    window = conversation_history.get(session_id)
+    if window is None:
+        window = conversation_history[session_id] = new_conversation_window()
+    if MULTIPROCESS:
+        # Summaries land in the background, after save(); apply them to the stored copy too
+        window.on_summary = lambda previous, batch, summary: conversation_history.update(
+            session_id, lambda latest: latest.apply_summary(previous, batch, summary))
+    window.append({
+        "role": "model",
+        "parts": [{"text": bot_response_text}]
+    })
+    conversation_history.save(session_id)
+
+    # Parse the JSON response from Gemini
+    with CHAT_STAGE.time('parse'):
+        conversational_response, extracted_data, memory_actions, memory_to_confirm = parse_model_output(bot_response_text)
+
+    # Prepare Response
+    final_response = {
+        'message': conversational_response,
+        'extracted_data': extracted_data,
+        'memory_actions': memory_actions,
+        'memory_to_confirm': memory_to_confirm,  # Non-null = Double Mention Rule fired
+        'prompt_tokens': window.last_prompt_tokens,
+        'timestamp': datetime.now().isoformat()
+    }
+
+    # Automatically save this message to chat history
+    # (This implements the "All conversations must be stored" requirement)
+    # Each message gets a unique ID so chat-derived memories can reference it.
+    user_msg_id = str(uuid.uuid4())
+    ai_msg_id = str(uuid.uuid4())
+    try:
+        # Append just this turn; the rest of the history is never rewritten
+        turn_messages = [
+            {
                 'id': user_msg_id,
                 'timestamp': datetime.now().isoformat(),
                 'sender': 'User',
                 'content': user_message
-            })
-            
-            # Add AI message with unique ID
-            full_chat_history.append({
+            },
+            {
                 'id': ai_msg_id,
                 'timestamp': datetime.now().isoformat(),
                 'sender': 'Aegis AI',
                 'content': conversational_response
-            })
-            
-            with open(CHAT_FILE, 'w') as f:
-                json.dump(full_chat_history, f, indent=4)
-        except Exception as e:
-            print(f"Error saving automatic chat history: {e}")
-        
-        # Expose the user message ID in the response so the frontend
-        # can pass it as chatRef when the user confirms saving a memory.
-        final_response['chat_message_id'] = user_msg_id
-            
-        return jsonify(final_response)
-    
+            }
+        ]
+        with CHAT_STAGE.time('persist_enqueue'):
+            persist('chat', turn_messages)
+            extraction = mergeable_extraction(extracted_data)
+            if extraction:
+                persist('memories', extraction)
+    except Exception as e:
+        print(f"Error saving automatic chat history: {e}")
+
+    if ASYNC_EXTRACTION:
+        # The client polls /api/extractions/<chat_message_id> for this
+        prompt = extraction_prompt(window)
+        try:
+            if extraction_results is not None:
+                extraction_results[f"{current_tenant_id()}:{user_msg_id}"] = {'status': 'pending'}
+            extraction_jobs.submit((current_tenant_id(), user_msg_id), run_extraction,
+                                   current_tenant_id(), user_msg_id, session_id, prompt)
+            final_response['extraction_id'] = user_msg_id
+            final_response['extraction_pending'] = True
+        except JobQueueFull as e:
+            print(f"Extraction queue full ({e}); extracting inline")
+            if extraction_results is not None:
+                extraction_results.pop(f"{current_tenant_id()}:{user_msg_id}")
+            try:
+                final_response.update(_run_extraction(session_id, prompt))
+            except Exception as e:
+                print(f"Inline extraction failed: {e}")
+
+    # Expose the user message ID in the response so the frontend
+    # can pass it as chatRef when the user confirms saving a memory.
+    final_response['chat_message_id'] = user_msg_id
+    return final_response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count and time every /api/ request by route pattern (not raw path, to keep labels bounded)"""
+    started = g.get('request_started')
+    if started is not None and request.path.startswith('/api/'):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
+    return response
+
+def request_token():
+    """The tenant access token a request carries (Bearer header, else the login cookie)"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token.strip():
+        return token.strip()
+    return request.cookies.get(TENANT_COOKIE)
+
+@app.before_request
+def resolve_tenant():
+    """Make the tenant the request's access token belongs to current (no token: the default)"""
+    if request.headers.get('X-Tenant-ID') or request.args.get('tenant'):
+        return jsonify({'error': 'Tenants are chosen by access token, not X-Tenant-ID or ?tenant='}), 400
+    token = request_token() if request.path != '/api/login' else None
+    try:
+        tenant_id = tenants.authenticate(token) if token else DEFAULT_TENANT
+        set_current_tenant(tenant_id)
+        if request.path.startswith('/api/'):
+            tenants.current()
+    except InvalidToken as e:
+        return jsonify({'error': str(e)}), 401
+    except UnknownTenant:
+        return jsonify({'error': 'Unknown tenant'}), 404
+
+@app.route('/api/login', methods=['POST'])
+def login():
+    """Exchange a tenant access token for a session cookie, so pages and media requests carry it"""
+    token = (request.get_json(silent=True) or {}).get('token')
+    try:
+        tenant_id = tenants.authenticate(token if isinstance(token, str) else None)
+    except InvalidToken as e:
+        return jsonify({'error': str(e)}), 401
+    response = jsonify({'status': 'success', 'tenant': tenant_id})
+    response.set_cookie(TENANT_COOKIE, token, httponly=True, samesite='Strict', secure=request.is_secure,
+                        max_age=365 * 24 * 3600)
+    return response
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    """Forget the session cookie (back to the default tenant)"""
+    response = jsonify({'status': 'success'})
+    response.delete_cookie(TENANT_COOKIE)
+    return response
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """
+    Handle chat messages and return Gemini AI responses with memory extraction
+    """
+    try:
+        data = request.get_json()
+        user_message = data.get('message', '')
+        try:
+            session_id = session_key(data.get('session_id', 'default'))
+        except InvalidSessionId as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not user_message:
+            return jsonify({'error': 'No message provided'}), 400
+
+        payload, turn = start_turn(session_id, user_message)
+
+        # Send request to Gemini API
+        try:
+            with CHAT_STAGE.time('upstream'):
+                response = generate_reply(payload)
+        except GeminiBusyError:
+            abandon_turn(session_id, turn)
+            return jsonify({'error': 'The assistant is busy, please try again in a moment'}), 503
+        except requests.Timeout:
+            abandon_turn(session_id, turn)
+            return jsonify({'error': 'Gemini API timed out'}), 504
+
+        if response.status_code != 200:
+            print(f"API Error: {response.status_code} - {response.text}")
+            abandon_turn(session_id, turn)
+            return jsonify({'error': f'Gemini API error: {response.status_code}'}), 500
+
+        # Extract the response text
+        response_data = response.json()
+        bot_response_text = response_data['candidates'][0]['content']['parts'][0]['text']
+        record_usage(session_id, response_data.get('usageMetadata'))
+
+        return jsonify(finish_turn(session_id, user_message, bot_response_text))
+
     except Exception as e:
         print(f"Error: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Failed to get response from Gemini: {str(e)}'}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /api/chat (Server-Sent Events).
+    Emits `token` events with the reply text as Gemini generates it, then one
+    `done` event carrying the same body /api/chat would return.
+    """
+    data = request.get_json() or {}
+    user_message = data.get('message', '')
+    try:
+        session_id = session_key(data.get('session_id', 'default'))
+    except InvalidSessionId as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    payload, turn = start_turn(session_id, user_message)
+    tenant_id = current_tenant_id()
+
+    def generate():
+        with use_tenant(tenant_id):
+            yield from _generate()
+
+    def _generate():
+        field_stream = JsonFieldStream('response')
+        chunks = []
+        usage = {}
+        started = time.perf_counter()
+        try:
+            for text in stream_reply(payload, usage):
+                if not chunks:
+                    CHAT_STAGE.observe(time.perf_counter() - started, 'first_token')
+                chunks.append(text)
+                delta = field_stream.feed(text)
+                if delta:
+                    yield sse_event('token', {'text': delta})
+            CHAT_STAGE.observe(time.perf_counter() - started, 'upstream')
+            record_usage(session_id, usage)
+            reply = finish_turn(session_id, user_message, ''.join(chunks))
+            turn['settled'] = True
+            yield sse_event('done', reply)
+        except GeminiBusyError:
+            abandon_turn(session_id, turn)
+            yield sse_event('error', {'error': 'The assistant is busy, please try again in a moment'})
+        except GeminiHTTPError as e:
+            print(f"API Error: {e}")
+            abandon_turn(session_id, turn)
+            yield sse_event('error', {'error': f'Gemini API error: {e.status_code}'})
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            abandon_turn(session_id, turn)
+            yield sse_event('error', {'error': f'Failed to get response from Gemini: {str(e)}'})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # A client that disconnects before `done` (possibly before the stream
+    # started) gets no reply either: undo its turn when the response closes
+    def close():
+        with use_tenant(tenant_id):
+            abandon_turn(session_id, turn)
+    response.call_on_close(close)
+    return response
+
+@app.route('/api/extractions/<extraction_id>', methods=['GET'])
+def get_extraction(extraction_id):
+    """
+    Result of a turn's background extraction: extracted_data and memory_to_confirm.
+    ?wait=<seconds> (up to 30) holds the request until the job finishes.
+    """
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0), 30)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+    job = extraction_jobs.get((current_tenant_id(), extraction_id), wait=wait)
+    if job is None and extraction_results is not None:
+        job = shared_extraction(f"{current_tenant_id()}:{extraction_id}", wait)
+    if job is None:
+        return jsonify({'error': 'Unknown extraction id'}), 404
+    body = {'extraction_id': extraction_id, 'status': job['status']}
+    if job['status'] == 'done':
+        body.update(job['result'])
+    elif job['status'] == 'error':
+        body['error'] = job['error']
+    return jsonify(body)
+
 @app.route('/api/save-chat', methods=['POST'])
 def save_chat():
     try:
         chat_data = request.json
         if not chat_data:
             return jsonify({'error': 'No chat data provided'}), 400
-            
-        with open(CHAT_FILE, 'w') as f:
-            json.dump(chat_data, f, indent=4)
+        if not isinstance(chat_data, list):
+            return jsonify({'error': 'Data must be a list'}), 400
+
+        # Queued turns must land before the history is replaced, not after it
+        write_queue.flush()
+        storage.replace_chat(chat_data)
+        index_chat_messages(chat_data, replace=True)
         return jsonify({'message': 'Chat saved successfully!'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -676,7 +2087,7 @@ def save_chat():
 def save_memory_from_chat():
     """
     Save a structured memory entry to memories.json that was derived from chat.
-    The raw chat message stays in chat.json; only the structured memory entry
+    The raw chat message stays in the chat log; only the structured memory entry
     (with source='chat' and an optional chatRef) is written to memories.json.
     """
     try:
@@ -685,7 +2096,7 @@ def save_memory_from_chat():
             return jsonify({'error': 'No data provided'}), 400
 
         # Build a clean, structured memory entry — no raw chat logs
-        new_memory = {
+        new_memory = stamp_new_item({
             'id': str(uuid.uuid4()),
             'title': data.get('title', 'Untitled Memory'),
             'date': data.get('date', datetime.now().strftime('%Y-%m-%d')),
@@ -693,12 +2104,13 @@ def save_memory_from_chat():
             'mediaPath': data.get('mediaPath', None),
             'source': 'chat',                      # Always 'chat' for this endpoint
             'chatRef': data.get('chatRef', None)   # Optional reference to chat message ID
-        }
+        })
 
-        # Load full memories data and append only to the memories array
-        full_data = load_memories()
-        full_data['memories'].append(new_memory)
-        save_memories(full_data)
+        # Append only to the memories array, under the storage lock
+        def add_memory(full_data):
+            full_data['memories'].append(new_memory)
+            return full_data
+        update_memories(add_memory)
 
         return jsonify({'status': 'success', 'memory': new_memory})
     except Exception as e:
@@ -708,53 +2120,71 @@ def save_memory_from_chat():
 @app.route('/api/notes', methods=['GET', 'POST'])
 def handle_notes():
     """
-    GET  – return the full notes array from notes.json
+    GET  – return the full notes array from notes.json, or a page of it
+           with ?limit/cursor/order/fields/since (see pagination.py)
     POST – add a new note (or replace the full list if given an array)
     """
     try:
-        # Load existing notes
-        notes_list = []
-        if os.path.exists(NOTES_FILE):
-            with open(NOTES_FILE, 'r') as f:
-                data = json.load(f)
-                notes_list = data.get('notes', []) if isinstance(data, dict) else data
-
         if request.method == 'GET':
-            return jsonify(notes_list)
+            if wants_page(request.args):
+                data = storage.load('notes')
+                return jsonify(paginate(_notes_list(data), request.args, 'created_at',
+                                        changed_fields=('updated_at', 'created_at'),
+                                        deleted=tombstones(data)))
+            return _list_response(load_notes())
 
         # POST – save a new note or replace the full list
         body = request.get_json()
         if isinstance(body, list):
             # Replace entire list (bulk sync)
-            with open(NOTES_FILE, 'w') as f:
-                json.dump({'notes': body}, f, indent=2)
-            return jsonify({'status': 'success', 'notes': body})
+            return _list_response(replace_items('notes', body, request.if_match), 'notes')
 
         # Single new note
-        new_note = {
-            'id':         str(uuid.uuid4()),
+        new_note = create_item('notes', {
             'title':      body.get('title', '').strip() or 'Untitled Note',
             'content':    body.get('content', '').strip(),
             'created_at': datetime.now().isoformat()
-        }
-        notes_list.append(new_note)
-        with open(NOTES_FILE, 'w') as f:
-            json.dump({'notes': notes_list}, f, indent=2)
+        })
         return jsonify({'status': 'success', 'note': new_note})
 
+    except PageError as e:
+        return jsonify({'error': str(e)}), 400
+    except VersionConflict as e:
+        return _conflict_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat-history', methods=['GET'])
+def chat_history():
+    """
+    Page through the chat history by timestamp, e.g. ?order=desc&limit=30 for
+    the latest messages and ?since=<timestamp> for new ones (see pagination.py).
+    The log is appended in timestamp order, so a page only reads its own messages.
+    """
+    try:
+        write_queue.flush(timeout=5)
+        return jsonify(paginate_log(storage.chat_count(), storage.chat_range, request.args, 'timestamp'))
+    except PageError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/memories', methods=['GET', 'POST'])
 def handle_memories():
     """
-    Get or update user memories list
+    Get or update user memories list.
+    GET takes ?limit/cursor/order/fields/since for paging by date (see pagination.py).
     """
     if request.method == 'GET':
         try:
             data = load_memories()
+            if wants_page(request.args):
+                return jsonify(paginate(data.get('memories', []), request.args, 'date',
+                                        deleted=tombstones(data)))
             # Return just the memories array for the frontend
-            return jsonify(data.get('memories', []))
+            return _list_response(data.get('memories', []))
+        except PageError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
@@ -764,12 +2194,10 @@ def handle_memories():
             if not isinstance(new_memories_list, list):
                 return jsonify({'error': 'Data must be a list'}), 400
                 
-            # Load existing full data to preserve other keys (interests, etc.)
-            full_data = load_memories()
-            full_data['memories'] = new_memories_list
-            save_memories(full_data)
-            
-            return jsonify({'status': 'success', 'memories': new_memories_list})
+            # The other keys (interests, etc.) are kept from the stored data
+            return _list_response(replace_items('memories', new_memories_list, request.if_match), 'memories')
+        except VersionConflict as e:
+            return _conflict_response(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -801,15 +2229,18 @@ def handle_routines():
     if request.method == 'GET':
         try:
             routines = load_routines()
-            return jsonify(routines)
+            return _list_response(routines)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     elif request.method == 'POST':
         try:
             data = request.get_json()
-            save_routines(data)
-            return jsonify({'status': 'success', 'routines': data})
+            if not isinstance(data, list):
+                return jsonify({'error': 'Data must be a list'}), 400
+            return _list_response(replace_items('routines', data, request.if_match), 'routines')
+        except VersionConflict as e:
+            return _conflict_response(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -821,54 +2252,297 @@ def handle_family():
     if request.method == 'GET':
         try:
             family = load_family()
-            return jsonify(family)
+            return _list_response(family)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     elif request.method == 'POST':
         try:
             data = request.get_json()
-            save_family(data)
-            return jsonify({'status': 'success', 'family': data})
+            if not isinstance(data, list):
+                return jsonify({'error': 'Data must be a list'}), 400
+            return _list_response(replace_items('family', data, request.if_match), 'family')
+        except VersionConflict as e:
+            return _conflict_response(e)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+def _expected_version(body):
+    """Version the client last saw, from the body or an If-Match: "<version>" header"""
+    if isinstance(body, dict) and body.get('version') is not None:
+        return body['version']
+    if_match = request.headers.get('If-Match', '').strip()
+    if if_match and if_match != '*':
+        return if_match.removeprefix('W/').strip('"')
+    return None
+
+def _conflict_response(e):
+    """409 with the stored item (or whole list), so the client can reconcile"""
+    body = {'error': 'conflict', 'message': str(e), 'item': e.item}
+    if isinstance(e, ListConflict):
+        body['items'] = e.items
+    return jsonify(body), 409
+
+def _item_response(item, status=200):
+    response = jsonify({'status': 'success', 'item': item})
+    response.set_etag(str(item.get('version', 1)))
+    return response, status
+
+@app.route('/api/<any(memories, notes, routines, family):collection>/items', methods=['POST'])
+def create_collection_item(collection):
+    """
+    Create one memory / note / routine / family member
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Item must be an object'}), 400
+    try:
+        return _item_response(create_item(collection, body), 201)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/<any(memories, notes, routines, family):collection>/<item_id>', methods=['PATCH', 'DELETE'])
+def handle_collection_item(collection, item_id):
+    """
+    PATCH  – apply {"changes": {...}, "version": n} to one item
+    DELETE – remove one item (optionally only if still at "version")
+    A stale version gets 409 with the stored item so the client can reconcile.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        expected = _expected_version(body)
+        if request.method == 'PATCH':
+            changes = body.get('changes')
+            if not isinstance(changes, dict):
+                return jsonify({'error': 'changes must be an object'}), 400
+            item = patch_item(collection, item_id, changes, expected)
+        else:
+            item = delete_item(collection, item_id, expected)
+        if item is None:
+            return jsonify({'error': 'Item not found'}), 404
+        return _item_response(item)
+    except VersionConflict as e:
+        return _conflict_response(e)
+    except ValueError:
+        return jsonify({'error': 'version must be a number'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    Full-text search: ?q=lake hou[&kinds=chat,memories,notes][&limit=20][&offset=0].
+    Terms match whole words, the last one as a prefix (as typed); results are
+    bm25-ranked with [highlighted] snippets.
+    """
+    if not SEARCH_ENABLED:
+        return jsonify({'error': 'Search is not available on this server'}), 503
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    kinds = [k for k in request.args.get('kinds', '').split(',') if k]
+    if any(k not in SEARCH_KINDS for k in kinds):
+        return jsonify({'error': f"kinds must be among {', '.join(SEARCH_KINDS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be numbers'}), 400
+    try:
+        refresh_search_index()
+        results = search_index.search(query, kinds or None, limit, offset)
+        return jsonify({'query': query, 'results': results, 'took_ms': search_index.last_query_ms})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search-stats', methods=['GET'])
+def search_stats():
+    """
+    Report indexed document counts and query timings
+    """
+    if not SEARCH_ENABLED:
+        return jsonify({'error': 'Search is not available on this server'}), 503
+    return jsonify(search_index.stats())
+
+@app.route('/api/write-stats', methods=['GET'])
+def write_stats():
+    """
+    Report write-behind queue depth, batch sizes and commit latency
+    """
+    return jsonify(write_queue.stats())
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """
+    Report hit/miss counters for the data file cache
+    """
+    return jsonify(dict(file_cache.stats(), context_digest=context_digest.stats()))
+
+@app.route('/api/gemini-stats', methods=['GET'])
+def gemini_stats():
+    """
+    Report latency and retry counters for upstream Gemini calls, plus token usage
+    and context cache counters
+    """
+    return jsonify(dict(gemini.stats(), usage=usage_stats(),
+                        context_cache=context_cache.stats() if context_cache is not None else None))
+
+@app.route('/api/extraction-stats', methods=['GET'])
+def extraction_stats():
+    """
+    Report queue depth and latency of the background extraction jobs
+    """
+    return jsonify(dict(extraction_jobs.stats(), enabled=ASYNC_EXTRACTION))
+
+@app.route('/api/tenant-stats', methods=['GET'])
+def tenant_stats():
+    """
+    Report open tenant partitions and the current tenant
+    """
+    return jsonify(dict(tenants.stats(), current=current_tenant_id()))
+
+# Values kept elsewhere, read when /metrics is scraped
+metrics.callback('gemini_in_flight', 'Gemini calls in progress', 'gauge', lambda: gemini.in_flight)
+metrics.callback('gemini_retries_total', 'Gemini calls retried', 'counter', lambda: gemini.retries)
+metrics.callback('write_queue_depth', 'Writes waiting for the write-behind committer', 'gauge',
+                 lambda: write_queue.stats()['depth'])
+metrics.callback('write_queue_rejected_total', 'Writes done inline because the queue was full', 'counter',
+                 lambda: write_queue.rejected)
+metrics.callback('extraction_jobs_pending', 'Background extractions queued or running', 'gauge',
+                 lambda: extraction_jobs.pending)
+metrics.callback('tenants_open', 'Tenant partitions held open', 'gauge', lambda: tenants.stats()['open'])
+metrics.callback('sessions_active', 'Chat sessions held in memory', 'gauge',
+                 lambda: len(conversation_history))
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint
+    """
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/session-stats', methods=['GET'])
+def session_stats():
+    """
+    Report live session counts, memory held and eviction counters
+    """
+    return jsonify({
+        'conversation': conversation_history.stats(),
+        'mentions': mention_tracker.stats()
+    })
+
+@app.route('/api/static-stats', methods=['GET'])
+def static_stats():
+    """
+    Report fingerprinted asset URLs and their compressed sizes
+    """
+    return jsonify(static_assets.stats())
+
+@app.route('/api/media-stats', methods=['GET'])
+def media_stats():
+    """
+    Report upload refcounts and thumbnail pipeline progress
+    """
+    return jsonify({
+        'store': media_store.stats(),
+        'thumbnails': thumbnails.stats()
+    })
+
 @app.route('/', methods=['GET'])
 def home():
     """
     Serve the main HTML page
     """
-    return send_from_directory('.', 'app.html')
+    return static_assets.response('app.html', request)
 
 @app.route('/<path:path>')
 def serve_static(path):
     """
-    Serve static files (CSS, JS, etc.)
+    Serve the front-end pages and assets (CSS, JS). Nothing else in the
+    working directory is reachable: it holds the data files, databases and
+    every tenant's partition.
     """
-    return send_from_directory('.', path)
+    response = static_assets.response(path, request)
+    if response is not None:
+        return response
+    return jsonify({'error': 'Not found'}), 404
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'File is too large (limit {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)'}), 413
 
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
-    """Handle file uploads"""
+    """Handle file uploads (streamed to disk, hashed, deduplicated)"""
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-        
-    if file:
-        filename = str(uuid.uuid4()) + "_" + file.filename
-        file.save(os.path.join(UPLOAD_FOLDER, filename))
-        return jsonify({'url': f'/uploads/{filename}'})
+
+    ext = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    if ext not in ALLOWED_EXTENSIONS:
+        return jsonify({'error': f'File type .{ext} is not allowed'}), 400
+
+    try:
+        filename = media_store.save_stream(file.stream, file.filename)
+    except UploadTooLarge:
+        return upload_too_large(None)
+    thumbnails.submit(filename)
+    return jsonify({'url': f'/uploads/{filename}'})
+
+def _send_media(folder, name, etag, immutable):
+    """
+    Send a stored file with a strong content ETag. Werkzeug answers Range
+    (206), If-Range, If-None-Match and If-Modified-Since from it, and hands
+    full bodies to the server's wsgi.file_wrapper (sendfile) or to the front
+    proxy when USE_X_SENDFILE is on. Content-addressed names never change,
+    so those are cached as immutable.
+    """
+    # Relative folders are resolved like the media store resolves them (cwd), not from app.root_path
+    response = send_from_directory(os.path.abspath(folder), name, etag=etag, conditional=True,
+                                   max_age=MEDIA_MAX_AGE if immutable else LEGACY_MEDIA_MAX_AGE)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if immutable:
+        response.cache_control.immutable = True
+    return response
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    """
+    Serve uploaded files (legacy names resolve through the media store's aliases).
+    ?w=<pixels> serves a resized variant (a poster frame for videos) when one is
+    ready; until then images fall back to the original.
+    """
+    filename = media_store.resolve(filename)
+    etag = media_store.content_etag(filename)
+    if etag is None:
+        return jsonify({'error': 'Not found'}), 404
+    immutable = is_blob_name(filename)
+    width = request.args.get('w', type=int)
+    if width:
+        derivative = thumbnails.lookup(filename, width)
+        if derivative:
+            variant = derivative.rsplit('_', 1)[-1].replace('.', '')
+            return _send_media(thumbnails.thumb_dir, derivative, f"{etag}-{variant}", immutable)
+        if filename.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+            # No poster yet; never send the whole video in place of an image
+            return jsonify({'error': 'Poster frame not ready'}), 404
+    return _send_media(UPLOAD_FOLDER, filename, etag, immutable)
+
+def _exit_on_sigterm(signum, frame):
+    # Raising SystemExit runs atexit handlers, which flush the write queue
+    raise SystemExit(0)
 
 if __name__ == '__main__':
-    print("🚀 Starting Chat Server...")
+    # Development server (one process). In production run
+    # `gunicorn -c gunicorn.conf.py wsgi:application` instead.
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    print("🚀 Starting Chat Server (development server)...")
     print("📡 Server running on http://127.0.0.1:5001")
     print("💬 Chat endpoint: http://127.0.0.1:5001/api/chat")
-    app.run(debug=True, host='127.0.0.1', port=5001, use_reloader=False)
+    debug = os.environ.get("FLASK_DEBUG", "0").lower() in ("1", "true", "yes")
+    app.run(debug=debug, host='127.0.0.1', port=5001, use_reloader=False)
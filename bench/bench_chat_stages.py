@@ -0,0 +1,102 @@
+"""
+Benchmark for the two-stage chat turn (reply first, extraction in the background).
+
+Runs a series of chat turns against fake_gemini.py, with generation time
+proportional to output tokens, in three configurations:
+
+    legacy       STRUCTURED_OUTPUT=0: one call, full JSON template
+    single       STRUCTURED_OUTPUT=1 ASYNC_EXTRACTION=0: one compact call
+    two-stage    STRUCTURED_OUTPUT=1 ASYNC_EXTRACTION=1: reply call, extraction job
+
+and reports time until the reply is returned (what the user waits for) and,
+for two-stage, until the extraction result can be collected. Each
+configuration runs in its own process and scratch directory.
+
+    python bench/bench_chat_stages.py [--turns 40] [--latency 0.15] [--token-delay 0.004]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    'legacy': {'STRUCTURED_OUTPUT': '0', 'ASYNC_EXTRACTION': '0'},
+    'single': {'STRUCTURED_OUTPUT': '1', 'ASYNC_EXTRACTION': '0'},
+    'two-stage': {'STRUCTURED_OUTPUT': '1', 'ASYNC_EXTRACTION': '1'},
+}
+MESSAGES = [
+    "My granddaughter Lily and I love baking bread on Sundays",
+    "I grew up near the sea, my father Tom was a fisherman",
+    "These days I enjoy gardening, mostly roses and tulips",
+    "My husband Arthur and I used to dance every Saturday",
+    "I still remember the bakery we had, my granddaughter Lily helped there",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_child(turns):
+    """Runs inside the scratch directory with the mode's environment set"""
+    import app
+
+    client = app.app.test_client()
+    reply_ms, extraction_ms = [], []
+    for i in range(turns):
+        started = time.perf_counter()
+        data = client.post('/api/chat', json={'message': MESSAGES[i % len(MESSAGES)],
+                                              'session_id': f"bench-{i % 4}"}).get_json()
+        reply_ms.append((time.perf_counter() - started) * 1000)
+        if data.get('extraction_pending'):
+            result = client.get(f"/api/extractions/{data['extraction_id']}?wait=30").get_json()
+            assert result['status'] == 'done', result
+            extraction_ms.append((time.perf_counter() - started) * 1000)
+    app.write_queue.flush()
+    usage = app.usage_stats()
+    print(json.dumps({'reply_ms': reply_ms, 'extraction_ms': extraction_ms, 'usage': usage}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.15, help="fixed seconds per Gemini call")
+    parser.add_argument("--token-delay", type=float, default=0.004, help="seconds per output token")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.turns)
+
+    from fake_gemini import start_fake_server
+
+    server, base_url = start_fake_server(latency=args.latency, token_delay=args.token_delay, output_tokens=40)
+    print(f"{args.turns} turns, fake Gemini latency {args.latency * 1000:.0f} ms "
+          f"+ {args.token_delay * 1000:.1f} ms/output token")
+    for mode, settings in MODES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, GEMINI_API_BASE=base_url, PYTHONPATH=ROOT, **settings)
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", "--turns", str(args.turns)],
+                cwd=tmp, env=env, capture_output=True, text=True, check=True
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        reply, extraction = result['reply_ms'], result['extraction_ms']
+        tokens = {stage: u['avg_output_tokens'] for stage, u in result['usage'].items() if isinstance(u, dict)}
+        line = (f"  {mode:10} reply p50 {statistics.median(reply):7.1f} ms  p95 {percentile(reply, 0.95):7.1f} ms"
+                f"  output tokens/call {tokens}")
+        if extraction:
+            line += f"  extraction ready p50 {statistics.median(extraction):7.1f} ms"
+        print(line)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
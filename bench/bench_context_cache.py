@@ -0,0 +1,122 @@
+"""
+Benchmark for where the instructions and personal context travel in a chat turn.
+
+Runs a series of chat turns against fake_gemini.py, which charges time per
+prompt token it has to read (cached tokens are free), in three
+configurations:
+
+    contents     SYSTEM_INSTRUCTION=0: first turn of every session's contents
+    instruction  SYSTEM_INSTRUCTION=1: systemInstruction on every request
+    cached       CONTEXT_CACHE=1: cachedContents entry, referenced by name
+
+Halfway through, a routine is added, so the context changes once (a new
+cache entry in cached mode). Reports request bytes per turn, prompt tokens
+the model had to read, and reply latency. Each configuration runs in its
+own process and scratch directory, on data from bench_load.make_dataset.
+
+    python bench/bench_context_cache.py [--turns 40] [--scale 1] [--prompt-token-delay 0.00005]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_load import make_dataset  # noqa: E402
+
+MODES = {
+    'contents': {'SYSTEM_INSTRUCTION': '0', 'CONTEXT_CACHE': '0'},
+    'instruction': {'SYSTEM_INSTRUCTION': '1', 'CONTEXT_CACHE': '0'},
+    'cached': {'SYSTEM_INSTRUCTION': '1', 'CONTEXT_CACHE': '1'},
+}
+MESSAGES = [
+    "My granddaughter Lily and I love baking bread on Sundays",
+    "I grew up near the sea, my father Tom was a fisherman",
+    "These days I enjoy gardening, mostly roses and tulips",
+    "My husband Arthur and I used to dance every Saturday",
+    "I still remember the bakery we had, my granddaughter Lily helped there",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def run_child(turns):
+    """Runs inside the scratch directory with the mode's environment set"""
+    import app
+
+    client = app.app.test_client()
+    reply_ms = []
+    for i in range(turns):
+        if i == turns // 2:
+            client.post('/api/routines/items', json={'title': 'Evening walk', 'time': '18:30',
+                                                     'description': 'Around the park with the dog'})
+        started = time.perf_counter()
+        response = client.post('/api/chat', json={'message': MESSAGES[i % len(MESSAGES)],
+                                                  'session_id': f"bench-{i % 4}"})
+        assert response.status_code == 200, response.get_json()
+        reply_ms.append((time.perf_counter() - started) * 1000)
+    app.extraction_jobs.close()
+    app.write_queue.close()
+    print(json.dumps({
+        'reply_ms': reply_ms,
+        'usage': app.usage_stats()['reply'],
+        'context_cache': app.context_cache.stats() if app.context_cache is not None else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--scale", type=int, default=1, help="data size relative to the sample files")
+    parser.add_argument("--latency", type=float, default=0.05, help="fixed seconds per Gemini call")
+    parser.add_argument("--prompt-token-delay", type=float, default=0.00005,
+                        help="seconds per prompt token read by the model")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run_child(args.turns)
+
+    from fake_gemini import start_fake_server
+
+    server, base_url = start_fake_server(latency=args.latency, prompt_token_delay=args.prompt_token_delay,
+                                         chunk_delay=0)
+    state = server.state
+    print(f"{args.turns} turns, data scale {args.scale}, fake Gemini latency {args.latency * 1000:.0f} ms "
+          f"+ {args.prompt_token_delay * 1e6:.0f} us/uncached prompt token")
+    for mode, settings in MODES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            make_dataset(tmp, args.scale)
+            env = dict(os.environ, GEMINI_API_BASE=base_url, PYTHONPATH=ROOT, **settings)
+            with state.lock:
+                state.prompt_bytes = 0
+                state.requests = 0
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", "--turns", str(args.turns)],
+                cwd=tmp, env=env, capture_output=True, text=True, check=True
+            ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        reply, usage = result['reply_ms'], result['usage']
+        read_tokens = (usage['prompt_tokens'] - usage['cached_prompt_tokens']) / usage['turns']
+        # prompt_bytes covers every generate call (chat, extraction, summaries) of the run
+        line = (f"  {mode:12} request bytes/turn {state.prompt_bytes / args.turns:8.0f}"
+                f"  prompt tokens read/turn {read_tokens:7.0f}"
+                f"  cached/turn {usage['cached_prompt_tokens'] / usage['turns']:6.0f}"
+                f"  reply p50 {statistics.median(reply):6.1f} ms  p95 {percentile(reply, 0.95):6.1f} ms")
+        if result['context_cache']:
+            cache = result['context_cache']
+            line += f"  cache creates {cache['creates']} hits {cache['hits']}"
+        print(line)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Load test: the real server, synthetic data, a fake Gemini upstream.
+
+For each scale factor the harness
+  1. writes synthetic memories.json / chat.json / routines.json / family.json /
+     notes.json at <scale> x the size of the files in the repo today, into a
+     scratch directory,
+  2. starts the Flask app there as a separate threaded HTTP server, pointed at
+     an in-process fake_gemini.py (latency, output size and failure rate are
+     configurable),
+  3. drives a weighted mix of /api/chat, CRUD routes, search and /api/upload
+     from --concurrency client threads for --duration seconds while sampling
+     the server's RSS,
+and reports p50/p95/p99 latency per operation, throughput and RSS. Results
+are written as JSON; pass an earlier result to --compare to see the change.
+
+    python bench/bench_load.py --scales 10 100 1000 --duration 20 --concurrency 16
+    python bench/bench_load.py --scales 100 --out bench/results/after.json \\
+        --compare bench/results/before.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ("garden roses kitchen bread recipe grandson church choir picnic lake house summer winter "
+         "wedding anniversary doctor walk dog birthday cake letter photo school train station market "
+         "river boat fishing holiday beach music piano radio dancing neighbour sister brother").split()
+
+# operation -> weight in the request mix
+MIX = {
+    'chat': 20,
+    'memories_list': 10,
+    'memories_page': 5,
+    'memory_create': 10,
+    'memory_patch': 10,
+    'notes_list': 5,
+    'note_create': 10,
+    'routines_list': 5,
+    'family_list': 5,
+    'chat_history_page': 5,
+    'search': 5,
+    'upload': 5,
+}
+
+
+# -------------------------------------------------------
+# Synthetic data
+# -------------------------------------------------------
+def _sentence(rng, n=8):
+    return ' '.join(rng.choices(WORDS, k=n)).capitalize() + '.'
+
+
+def _load(name):
+    with open(os.path.join(ROOT, name)) as f:
+        return json.load(f)
+
+
+def make_dataset(dest, scale, seed=1):
+    """Write data files `scale` times the size of today's files; returns the record counts"""
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    memories = _load('memories.json')
+    counts = {}
+
+    store = copy.deepcopy(memories)
+    store['memories'] = [
+        {'id': f"mem-{i}", 'title': f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+         'date': (start + timedelta(days=i % 3000)).strftime('%Y-%m-%d'), 'description': _sentence(rng, 14),
+         'mediaPath': None, 'source': 'manual', 'version': 1}
+        for i in range(max(1, len(memories.get('memories', []))) * scale)
+    ]
+    for category, values in memories.items():
+        if category != 'memories' and isinstance(values, list):
+            store[category] = [f"{category} {_sentence(rng, 3)} {i}" for i in range(max(1, len(values)) * scale)]
+    counts['memories'] = len(store['memories'])
+
+    chat = [
+        {'id': f"chat-{i}", 'timestamp': (start + timedelta(minutes=i)).isoformat(),
+         'sender': 'User' if i % 2 == 0 else 'Aegis AI', 'content': _sentence(rng, 16)}
+        for i in range(len(_load('chat.json')) * scale)
+    ]
+    counts['chat'] = len(chat)
+
+    routines = [
+        {'id': f"routine-{i}", 'title': f"{rng.choice(WORDS).title()} {i}", 'description': _sentence(rng),
+         'time': f"{i % 24:02d}:{(i * 7) % 60:02d}", 'days': ['Mon', 'Wed', 'Fri'], 'paused': False,
+         'mediaPath': None, 'version': 1}
+        for i in range(len(_load('routines.json')) * scale)
+    ]
+    family = [
+        {'id': f"family-{i}", 'name': f"{rng.choice(WORDS).title()} {i}", 'relation': rng.choice(['Son', 'Friend']),
+         'birthday': '1990-02-03', 'notes': _sentence(rng), 'version': 1}
+        for i in range(len(_load('family.json')) * scale)
+    ]
+    notes = [
+        {'id': f"note-{i}", 'title': f"Note {i}", 'content': _sentence(rng, 20),
+         'created_at': (start + timedelta(hours=i)).isoformat(), 'version': 1}
+        for i in range(len(_load('notes.json')['notes']) * scale)
+    ]
+    counts.update(routines=len(routines), family=len(family), notes=len(notes))
+
+    for name, value in (('memories.json', store), ('chat.json', chat), ('routines.json', routines),
+                        ('family.json', family), ('notes.json', {'notes': notes}),
+                        ('profile.json', _load('profile.json'))):
+        with open(os.path.join(dest, name), 'w') as f:
+            json.dump(value, f)
+    return counts
+
+
+def tiny_png(seed):
+    """A valid 4x4 PNG whose colour depends on seed (so uploads are not deduplicated)"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    pixel = struct.pack('>I', seed & 0xffffff)[1:]
+    raw = b''.join(b'\x00' + pixel * 4 for _ in range(4))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 4, 4, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+# -------------------------------------------------------
+# Server under test
+# -------------------------------------------------------
+def serve(port):
+    """Child process: run the app from the current (scratch) directory"""
+    from werkzeug.serving import make_server
+    import app
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    print('ready', flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        app.write_queue.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def read_rss_kb(pid):
+    """Resident set size of pid in KiB (Linux /proc), or None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            rss = read_rss_kb(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# -------------------------------------------------------
+# Load driver
+# -------------------------------------------------------
+class Driver:
+    def __init__(self, base, counts, seed):
+        self.base = base
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def pick(self):
+        with self.lock:
+            return self.rng.choices(list(MIX), weights=list(MIX.values()))[0], self.rng.random()
+
+    def run_op(self, op, r):
+        s = self.session()
+        b = self.base
+        if op == 'chat':
+            return s.post(f"{b}/api/chat", json={'message': f"I remember the {WORDS[int(r * len(WORDS))]} by the lake",
+                                                 'session_id': f"load-{int(r * 8)}"})
+        if op == 'memories_list':
+            return s.get(f"{b}/api/memories")
+        if op == 'memories_page':
+            return s.get(f"{b}/api/memories", params={'limit': 50, 'order': 'desc', 'fields': 'title,date'})
+        if op == 'memory_create':
+            return s.post(f"{b}/api/memories/items", json={'title': f"Load {r}", 'description': 'created by load test'})
+        if op == 'memory_patch':
+            item_id = f"mem-{int(r * self.counts['memories'])}"
+            return s.patch(f"{b}/api/memories/{item_id}", json={'changes': {'description': f"edited {r}"}})
+        if op == 'notes_list':
+            return s.get(f"{b}/api/notes")
+        if op == 'note_create':
+            return s.post(f"{b}/api/notes/items", json={'title': f"Load note {r}", 'content': 'load test'})
+        if op == 'routines_list':
+            return s.get(f"{b}/api/routines")
+        if op == 'family_list':
+            return s.get(f"{b}/api/family")
+        if op == 'chat_history_page':
+            return s.get(f"{b}/api/chat-history", params={'limit': 30, 'order': 'desc'})
+        if op == 'search':
+            return s.get(f"{b}/api/search", params={'q': WORDS[int(r * len(WORDS))]})
+        if op == 'upload':
+            png = tiny_png(int(r * 2 ** 24))
+            return s.post(f"{b}/api/upload", files={'file': (f"load-{r}.png", png, 'image/png')})
+        raise ValueError(op)
+
+    def worker(self, deadline, results):
+        while time.monotonic() < deadline:
+            op, r = self.pick()
+            started = time.perf_counter()
+            try:
+                ok = self.run_op(op, r).status_code < 400
+            except requests.RequestException:
+                ok = False
+            results.append((op, (time.perf_counter() - started) * 1000, ok))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 2)
+
+
+def summarize(results, elapsed):
+    ops = {}
+    for op in MIX:
+        latencies = [ms for name, ms, _ in results if name == op]
+        if not latencies:
+            continue
+        ops[op] = {
+            'count': len(latencies),
+            'errors': sum(1 for name, _, ok in results if name == op and not ok),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'mean_ms': round(statistics.mean(latencies), 2),
+        }
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'operations': ops,
+    }
+
+
+def run_scale(scale, args, gemini_base):
+    with tempfile.TemporaryDirectory() as data_dir:
+        started = time.perf_counter()
+        counts = make_dataset(data_dir, scale, seed=args.seed)
+        print(f"\n{scale}x data: {counts} (generated in {time.perf_counter() - started:.1f}s)")
+
+        port = free_port()
+        env = dict(os.environ, GEMINI_API_BASE=gemini_base, PYTHONPATH=ROOT)
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+                                  cwd=data_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            startup = time.perf_counter()
+            if server.stdout.readline().strip() != 'ready':
+                raise RuntimeError("server did not start")
+            base = f"http://127.0.0.1:{port}"
+            requests.get(f"{base}/api/profile", timeout=60)
+            startup_s = time.perf_counter() - startup
+            rss_idle = read_rss_kb(server.pid)
+
+            sampler = RssSampler(server.pid)
+            sampler.start()
+            driver = Driver(base, counts, args.seed)
+            results = []
+            deadline = time.monotonic() + args.duration
+            load_started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                for _ in range(args.concurrency):
+                    pool.submit(driver.worker, deadline, results)
+            elapsed = time.perf_counter() - load_started
+            sampler.stop()
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    summary = summarize(results, elapsed)
+    summary.update(
+        scale=scale, records=counts, startup_s=round(startup_s, 2),
+        rss_mb={'idle': round(rss_idle / 1024, 1) if rss_idle else None,
+                'peak': round(max(sampler.samples) / 1024, 1) if sampler.samples else None},
+    )
+    return summary
+
+
+def print_summary(summary, previous=None):
+    rss = summary['rss_mb']
+    line = (f"  throughput {summary['throughput_rps']} req/s, {summary['requests']} requests, "
+            f"{summary['errors']} errors, startup {summary['startup_s']}s, RSS idle {rss['idle']} MB peak {rss['peak']} MB")
+    if previous:
+        line += f"  (throughput {_delta(previous['throughput_rps'], summary['throughput_rps'])})"
+    print(line)
+    print(f"  {'operation':18} {'count':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for op, stats in summary['operations'].items():
+        row = (f"  {op:18} {stats['count']:6} {stats['errors']:4} {stats['p50_ms']:9.1f} "
+               f"{stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f}")
+        before = (previous or {}).get('operations', {}).get(op)
+        if before:
+            row += (f"   p50 {_delta(before['p50_ms'], stats['p50_ms'])}"
+                    f"  p95 {_delta(before['p95_ms'], stats['p95_ms'])}"
+                    f"  p99 {_delta(before['p99_ms'], stats['p99_ms'])}")
+        print(row)
+
+
+def _delta(before, after):
+    if not before:
+        return 'n/a'
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load per scale")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake Gemini latency (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--output-tokens", type=int, default=60)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="result file (default bench/results/load-<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare against")
+    parser.add_argument("--serve", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve is not None:
+        return serve(args.serve)
+
+    from fake_gemini import start_fake_server
+
+    fake, gemini_base = start_fake_server(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+                                          output_tokens=args.output_tokens)
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {run['scale']: run for run in json.load(f)['runs']}
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('serve', 'out', 'compare')},
+        'runs': [],
+    }
+    print(f"Load: {args.concurrency} clients x {args.duration}s per scale; fake Gemini "
+          f"{args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, fail rate {args.fail_rate}")
+    for scale in args.scales:
+        summary = run_scale(scale, args, gemini_base)
+        print_summary(summary, previous.get(scale))
+        report['runs'].append(summary)
+    fake.shutdown()
+
+    out = args.out or os.path.join(ROOT, 'bench', 'results', f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {out}")
+
+
+if __name__ == "__main__":
+    main()
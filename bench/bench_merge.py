@@ -0,0 +1,96 @@
+"""
+Microbenchmark for merge_extracted_data on large memory stores.
+
+Compares the old list-membership dedup (`item not in list`, O(n) per item)
+with the DedupIndex path, both when the index is rebuilt per merge and when
+it is reused across merges as merge_into_memories() does.
+
+    python bench/bench_merge.py [--sizes 1000 10000 50000] [--new 30]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import DEFAULT_MEMORIES, DedupIndex, merge_extracted_data  # noqa: E402
+
+STRING_CATEGORIES = [c for c, v in DEFAULT_MEMORIES.items()
+                     if isinstance(v, list) and c not in ("memories", "daily_routines", "medications")]
+
+
+def make_store(size):
+    store = copy.deepcopy(DEFAULT_MEMORIES)
+    for category in STRING_CATEGORIES:
+        store[category] = [f"{category} fact number {i}" for i in range(size)]
+    store["memories"] = [{"title": f"Memory {i}", "description": f"Something that happened {i}", "date": None}
+                         for i in range(size)]
+    store["medications"] = [{"name": f"Medication {i}", "note": "morning"} for i in range(size)]
+    store["adaptive_categories"] = {"pets": [f"pet {i}" for i in range(size)]}
+    return store
+
+
+def make_extraction(size, new):
+    # Half duplicates (with different case/spacing), half genuinely new
+    data = {}
+    for category in STRING_CATEGORIES:
+        data[category] = ([f"  {category.upper()} fact number {i}" for i in range(0, size, max(1, size // new))][:new // 2]
+                          + [f"{category} brand new {i}" for i in range(new // 2)])
+    data["memories"] = [{"title": f"memory {i}", "description": f"something that happened {i}"} for i in range(new // 2)]
+    data["adaptive_categories"] = {"pets": [f"Pet {i}" for i in range(new // 2)] + ["a new puppy"]}
+    return data
+
+
+def naive_merge(existing, new_data):
+    """The previous implementation's dedup strategy, for comparison"""
+    for category, items in new_data.items():
+        if category == "adaptive_categories":
+            for key, values in items.items():
+                target = existing["adaptive_categories"].setdefault(key, [])
+                for item in values:
+                    if item not in target:
+                        target.append(item)
+            continue
+        target = existing.setdefault(category, [])
+        for item in items:
+            if item and item not in target:
+                target.append(item)
+    return existing
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--new", type=int, default=30, help="extracted items per category per merge")
+    args = parser.parse_args()
+
+    print(f"{'facts/category':>15} {'naive ms':>10} {'index build+merge ms':>22} {'reused index ms':>16}")
+    for size in args.sizes:
+        store = make_store(size)
+        extraction = make_extraction(size, args.new)
+
+        # deepcopy cost is kept out of every timing
+        naive_store = copy.deepcopy(store)
+        naive = timed(lambda: naive_merge(naive_store, extraction), repeat=1)
+        fresh = [copy.deepcopy(store) for _ in range(5)]
+        build = timed(lambda: merge_extracted_data(fresh.pop(), extraction))
+        reused_store = copy.deepcopy(store)
+        index = DedupIndex(reused_store)
+        reused = timed(lambda: merge_extracted_data(reused_store, extraction, index))
+
+        print(f"{size:>15} {naive:>10.1f} {build:>22.1f} {reused:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for the /api/search index (search_index.SearchIndex).
+
+Builds an FTS5 index over synthetic chat messages plus memories and notes in
+a temporary database, then times a mix of queries (single word, multi-word,
+prefix, rare and common terms) and reports p50/p95/max latency.
+
+    python bench/bench_search.py [--messages 100000] [--queries 500]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex, fts5_available  # noqa: E402
+
+WORDS = (
+    "garden roses tulips kitchen bread recipe grandson granddaughter church choir "
+    "picnic lake house summer winter wedding anniversary doctor appointment pills "
+    "morning walk dog cat birthday cake letter photo album school teacher train "
+    "station market river boat fishing holiday beach mountains snow music piano "
+    "radio dancing neighbour friend sister brother mother father cousin war postcard"
+).split()
+FILLER = "i remember we used to go there every year and it was lovely".split()
+QUERIES = ["lake house", "roses", "gran", "birthday cake", "piano lessons", "pho", "doctor appointment",
+           "fishing boat river", "wedding", "zebra"]
+
+
+def make_message(rng, i):
+    words = rng.choices(WORDS, k=6) + rng.choices(FILLER, k=10)
+    rng.shuffle(words)
+    return (f"msg-{i}", f"2026-01-01T00:00:{i:06d}", rng.choice(["User", "Aegis AI"]), ' '.join(words))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    if not fts5_available():
+        sys.exit("SQLite on this system was built without FTS5")
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(os.path.join(tmp, "search.db"))
+
+        started = time.perf_counter()
+        batch = []
+        for i in range(args.messages):
+            batch.append(make_message(rng, i))
+            if len(batch) == 1000:
+                index.append('chat', batch)
+                batch = []
+        index.append('chat', batch)
+        memories = [(f"m{i}", "2020-05-01", f"{rng.choice(WORDS)} {rng.choice(WORDS)}",
+                     ' '.join(rng.choices(WORDS + FILLER, k=30))) for i in range(2000)]
+        index.sync('memories', 'v1', memories)
+        build_s = time.perf_counter() - started
+        print(f"Indexed {args.messages} messages + {len(memories)} memories in {build_s:.1f}s "
+              f"({args.messages / build_s:,.0f} msg/s)")
+
+        # Incremental cost: one new turn, one edited memory
+        started = time.perf_counter()
+        index.append('chat', [make_message(rng, args.messages), make_message(rng, args.messages + 1)])
+        append_ms = (time.perf_counter() - started) * 1000
+        memories[0] = (memories[0][0], memories[0][1], "lake house", "edited description")
+        started = time.perf_counter()
+        changed = index.sync('memories', 'v2', memories)
+        sync_ms = (time.perf_counter() - started) * 1000
+        print(f"Append one turn: {append_ms:.2f} ms; re-sync memories ({changed} changed): {sync_ms:.2f} ms")
+
+        index.search("warm up")
+        for query in QUERIES:
+            timings = []
+            for _ in range(max(1, args.queries // len(QUERIES))):
+                started = time.perf_counter()
+                results = index.search(query, limit=20)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+            print(f"  {query!r:24} {len(results):3} hits  p50 {statistics.median(timings):7.2f} ms"
+                  f"  p95 {p95:7.2f} ms  max {timings[-1]:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Load test for tenant partitioning.
+
+A fixed pool of client threads issues a write-heavy mix (create a note,
+patch a memory, read memories) through the Flask test client, spread evenly
+over 1, 4, 16 ... tenants. With a single tenant every write queues on the
+same collection lock and file; with more tenants the same load is spread
+over independent locks and files, so throughput should rise with the tenant
+count until the disk or the GIL is the limit.
+
+    python bench/bench_tenants.py [--threads 16] [--ops 2000] [--tenants 1 4 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run_round(app, tenant_ids, threads, ops):
+    client_ops = [ops // threads] * threads
+    memory_ids = {}
+    tokens = {}
+    for tenant_id in tenant_ids:
+        app.tenants.provision(tenant_id)
+        tokens[tenant_id] = app.tenants.issue_token(tenant_id)
+        headers = {'Authorization': f"Bearer {tokens[tenant_id]}"}
+        created = app.app.test_client().post('/api/memories/items', json={'title': 'Seed', 'description': 'x'},
+                                             headers=headers).get_json()
+        memory_ids[tenant_id] = created['item']['id']
+    errors = []
+
+    def worker(n, count):
+        client = app.app.test_client()
+        for i in range(count):
+            tenant_id = tenant_ids[(n + i) % len(tenant_ids)]
+            headers = {'Authorization': f"Bearer {tokens[tenant_id]}"}
+            op = i % 3
+            if op == 0:
+                r = client.post('/api/notes/items', json={'title': f'Note {n}-{i}', 'content': 'text'},
+                                headers=headers)
+            elif op == 1:
+                r = client.patch(f'/api/memories/{memory_ids[tenant_id]}',
+                                 json={'changes': {'description': f'edit {n}-{i}'}}, headers=headers)
+            else:
+                r = client.get('/api/memories', headers=headers)
+            if r.status_code >= 400:
+                errors.append(r.status_code)
+
+    workers = [threading.Thread(target=worker, args=(n, count)) for n, count in enumerate(client_ops)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return sum(client_ops) / elapsed, elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        import app
+
+        print(f"{args.threads} threads, {args.ops} requests per round "
+              f"(create note / patch memory / read memories), storage: {app.STORAGE_BACKEND}")
+        baseline = None
+        for count in args.tenants:
+            tenant_ids = [f"t{count}-{i}" for i in range(count)]
+            throughput, elapsed, errors = run_round(app, tenant_ids, args.threads, args.ops)
+            baseline = baseline or throughput
+            print(f"  {count:4} tenant(s): {throughput:8.0f} req/s  ({elapsed:.2f}s, x{throughput / baseline:.2f})"
+                  + (f"  {len(errors)} errors" if errors else ""))
+        app.write_queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Append-only, segmented chat history log.
+
+Messages are stored one JSON object per line in numbered segment files
+(chat_log/000001.jsonl, ...). Each segment has a sidecar .idx file holding
+the byte offset of every line as a fixed-width 8-byte integer, so the last N
+messages can be read without scanning the whole history. manifest.json lists
+the live segments and is only ever replaced atomically.
+
+With interprocess=True (several worker processes sharing the log) writes
+take a file lock, and every operation re-reads the manifest when another
+process has rotated or replaced the segments.
+"""
+import json
+import os
+import struct
+import threading
+
+from file_lock import InterProcessLock
+
+OFFSET = struct.Struct('<Q')
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over the target"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ChatLog:
+    def __init__(self, directory, legacy_file=None, segment_max_bytes=SEGMENT_MAX_BYTES, fsync=True,
+                 interprocess=False):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync = fsync
+        self.interprocess = interprocess
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        self._manifest_stamp = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = InterProcessLock(os.path.join(directory, '.lock')) if interprocess else threading.RLock()
+        with self._lock:
+            self._open(legacy_file)
+
+    def _open(self, legacy_file):
+        if os.path.exists(self._manifest_path):
+            self._refresh(force=True)
+            self._recover()
+        else:
+            self._segments = []
+            # One-shot migration from the old single-file chat.json
+            if legacy_file and os.path.exists(legacy_file):
+                try:
+                    with open(legacy_file, 'r') as f:
+                        legacy = json.load(f)
+                    if isinstance(legacy, list):
+                        self.replace(legacy)
+                        print(f"Migrated {len(legacy)} chat messages from {legacy_file}")
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"Could not migrate legacy chat file {legacy_file}: {e}")
+            if not self._segments:
+                self._segments = [self._new_segment_name()]
+                self._create_segment(self._segments[0])
+                _write_json_atomic(self._manifest_path, {'segments': self._segments})
+
+    # -------------------------------------------------------
+    # Paths / helpers
+    # -------------------------------------------------------
+    def _data_path(self, name):
+        return os.path.join(self.directory, name + '.jsonl')
+
+    def _idx_path(self, name):
+        return os.path.join(self.directory, name + '.idx')
+
+    def _refresh(self, force=False):
+        """Re-read the manifest if another process has changed it"""
+        if not (self.interprocess or force):
+            return
+        try:
+            st = os.stat(self._manifest_path)
+        except OSError:
+            return
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if force or stamp != self._manifest_stamp:
+            with open(self._manifest_path, 'r') as f:
+                self._segments = json.load(f).get('segments', [])
+            self._manifest_stamp = stamp
+
+    def _read(self, fn, *args):
+        """Run a read, retrying once if another process replaced the segments mid-read"""
+        self._refresh()
+        try:
+            return fn(*args)
+        except FileNotFoundError:
+            if not self.interprocess:
+                raise
+            self._refresh(force=True)
+            return fn(*args)
+
+    def _new_segment_name(self):
+        return '%06d' % (max([int(n) for n in self._segments] or [0]) + 1)
+
+    def _touch_segment(self, name):
+        open(self._data_path(name), 'ab').close()
+        open(self._idx_path(name), 'ab').close()
+
+    def _create_segment(self, name):
+        """Start a segment from empty files, in case a crashed replace() left one behind"""
+        open(self._data_path(name), 'wb').close()
+        open(self._idx_path(name), 'wb').close()
+
+    def _segment_count(self, name):
+        try:
+            return os.path.getsize(self._idx_path(name)) // OFFSET.size
+        except OSError:
+            return 0
+
+    def _recover(self):
+        """Repair the tail segment after a crash mid-append"""
+        if not self._segments:
+            return
+        name = self._segments[-1]
+        self._touch_segment(name)
+        data_path = self._data_path(name)
+
+        with open(data_path, 'rb') as f:
+            data = f.read()
+        # Drop a torn final line (no trailing newline)
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            with open(data_path, 'r+b') as f:
+                f.truncate(end)
+            data = data[:end]
+
+        # Rebuild the offset index if it disagrees with the data file
+        offsets = []
+        pos = 0
+        while pos < len(data):
+            offsets.append(pos)
+            pos = data.index(b'\n', pos) + 1
+        if self._segment_count(name) != len(offsets):
+            with open(self._idx_path(name), 'wb') as f:
+                f.write(b''.join(OFFSET.pack(o) for o in offsets))
+
+    # -------------------------------------------------------
+    # Writes
+    # -------------------------------------------------------
+    def _append_to_segment(self, name, lines):
+        data_path = self._data_path(name)
+        with open(data_path, 'ab') as data_f, open(self._idx_path(name), 'ab') as idx_f:
+            offset = data_f.tell()
+            offsets = []
+            for line in lines:
+                offsets.append(OFFSET.pack(offset))
+                offset += len(line)
+            data_f.write(b''.join(lines))
+            data_f.flush()
+            idx_f.write(b''.join(offsets))
+            idx_f.flush()
+            if self.fsync:
+                os.fsync(data_f.fileno())
+                os.fsync(idx_f.fileno())
+
+    def append(self, messages):
+        """Append a list of message dicts to the end of the log"""
+        lines = [(json.dumps(m, ensure_ascii=False) + '\n').encode('utf-8') for m in messages]
+        if not lines:
+            return
+        with self._lock:
+            self._refresh()
+            name = self._segments[-1]
+            if os.path.getsize(self._data_path(name)) >= self.segment_max_bytes:
+                name = self._new_segment_name()
+                self._create_segment(name)
+                self._segments.append(name)
+                _write_json_atomic(self._manifest_path, {'segments': self._segments})
+            self._append_to_segment(name, lines)
+
+    def replace(self, messages):
+        """Atomically replace the whole history (used by /api/save-chat)"""
+        with self._lock:
+            self._refresh()
+            old_segments = list(self._segments)
+            new_segments = []
+            batch, batch_bytes = [], 0
+            last_num = max([int(n) for n in old_segments] or [0])
+
+            def flush_batch():
+                nonlocal last_num
+                last_num += 1
+                name = '%06d' % last_num
+                self._create_segment(name)
+                self._append_to_segment(name, batch)
+                new_segments.append(name)
+
+            for m in messages:
+                line = (json.dumps(m, ensure_ascii=False) + '\n').encode('utf-8')
+                batch.append(line)
+                batch_bytes += len(line)
+                if batch_bytes >= self.segment_max_bytes:
+                    flush_batch()
+                    batch, batch_bytes = [], 0
+            if batch or not new_segments:
+                flush_batch()
+
+            _write_json_atomic(self._manifest_path, {'segments': new_segments})
+            self._segments = new_segments
+
+            for name in old_segments:
+                for path in (self._data_path(name), self._idx_path(name)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    # -------------------------------------------------------
+    # Reads
+    # -------------------------------------------------------
+    def stamp(self):
+        """Changes whenever messages are appended or the history is replaced"""
+        self._refresh()
+        segments = tuple(self._segments)
+        return (segments, self._segment_count(segments[-1]) if segments else 0)
+
+    def __len__(self):
+        self._refresh()
+        return sum(self._segment_count(name) for name in list(self._segments))
+
+    def read_all(self):
+        """Return every message in order"""
+        return self._read(self._read_all)
+
+    def _read_all(self):
+        messages = []
+        for name in list(self._segments):
+            with open(self._data_path(name), 'rb') as f:
+                for line in f:
+                    if line.endswith(b'\n'):
+                        messages.append(json.loads(line))
+        return messages
+
+    def read_range(self, start, stop):
+        """Return the messages at log positions start..stop-1, reading only the segments that hold them"""
+        if stop <= start:
+            return []
+        return self._read(self._read_range, start, stop)
+
+    def _read_range(self, start, stop):
+        result = []
+        base = 0
+        for name in list(self._segments):
+            if base >= stop:
+                break
+            count = self._segment_count(name)
+            lo, hi = max(start - base, 0), min(stop - base, count)
+            base += count
+            if lo >= hi:
+                continue
+            # Offsets of the wanted lines plus the one after them, if any
+            with open(self._idx_path(name), 'rb') as idx_f:
+                idx_f.seek(lo * OFFSET.size)
+                offsets = idx_f.read((hi - lo + 1) * OFFSET.size)
+            begin = OFFSET.unpack_from(offsets, 0)[0]
+            with open(self._data_path(name), 'rb') as data_f:
+                data_f.seek(begin)
+                if len(offsets) > (hi - lo) * OFFSET.size:
+                    chunk = data_f.read(OFFSET.unpack_from(offsets, (hi - lo) * OFFSET.size)[0] - begin)
+                else:
+                    chunk = data_f.read()
+            lines = [l for l in chunk.split(b'\n') if l][:hi - lo]
+            result.extend(json.loads(l) for l in lines)
+        return result
+
+    def tail(self, n=10):
+        """Return the last n messages, reading only the segments needed"""
+        if n <= 0:
+            return []
+        return self._read(self._tail, n)
+
+    def _tail(self, n):
+        result = []
+        for name in reversed(list(self._segments)):
+            needed = n - len(result)
+            if needed <= 0:
+                break
+            count = self._segment_count(name)
+            if count == 0:
+                continue
+            take = min(needed, count)
+            with open(self._idx_path(name), 'rb') as idx_f:
+                idx_f.seek((count - take) * OFFSET.size)
+                start = OFFSET.unpack(idx_f.read(OFFSET.size))[0]
+            with open(self._data_path(name), 'rb') as data_f:
+                data_f.seek(start)
+                chunk = data_f.read()
+            lines = [l for l in chunk.split(b'\n') if l][:take]
+            result = [json.loads(l) for l in lines] + result
+        return result
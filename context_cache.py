@@ -0,0 +1,135 @@
+"""
+Upstream context caching for the per-user prompt prefix.
+
+The system instruction (chat instructions plus the user's personal context)
+is identical on every turn until that user's data changes. ContextCache
+registers it once per (key, context version) with the Gemini cachedContents
+API and hands out the entry's name; requests then send `cachedContent` in
+place of the text, and the model does not re-read those tokens.
+
+A new context version creates a new entry and deletes the old one in the
+background. Entries are renewed shortly before their TTL runs out. When an
+entry cannot be created (e.g. the prefix is below the model's minimum
+cacheable size, or the API is not v1beta) get() returns None and that key
+is not retried for retry_after seconds, so the caller sends the plain
+systemInstruction instead. invalidate() drops an entry upstream rejected.
+
+Entries are per process: with several workers each registers its own.
+
+    cache = ContextCache(gemini, ttl=3600)
+    name = cache.get(tenant_id, version, system_text)   # None: send the text
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ContextCache:
+    def __init__(self, client, ttl=3600, renew_before=120, max_entries=256, retry_after=300, stripes=16):
+        self.client = client
+        self.ttl = ttl
+        self.renew_before = min(renew_before, ttl / 2)
+        self.max_entries = max_entries
+        self.retry_after = retry_after
+        # key -> {'version', 'name', 'expires'}; name is None after a failed create
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Creates for one key are serialized, different keys rarely wait on each other
+        self._create_locks = [threading.Lock() for _ in range(stripes)]
+        self.hits = 0
+        self.creates = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.invalidations = 0
+        self.deletes = 0
+
+    def _usable(self, entry, version, now):
+        """'hit', 'failed' (backing off) or None (needs a create)"""
+        if entry is None or entry['version'] != version:
+            return None
+        if entry['name'] is None:
+            return 'failed' if entry['expires'] > now else None
+        return 'hit' if entry['expires'] - self.renew_before > now else None
+
+    def get(self, key, version, system_text):
+        """Name of a cache entry holding system_text for this version, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            state = self._usable(entry, version, time.monotonic())
+            if state == 'hit':
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry['name']
+            if state == 'failed':
+                self.fallbacks += 1
+                return None
+
+        with self._create_locks[hash(key) % len(self._create_locks)]:
+            # Another request may have created it while we waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if self._usable(entry, version, time.monotonic()) == 'hit':
+                    self.hits += 1
+                    return entry['name']
+            name = self._create(system_text)
+            now = time.monotonic()
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if name:
+                    self.creates += 1
+                    self._entries[key] = {'version': version, 'name': name, 'expires': now + self.ttl}
+                else:
+                    self.failures += 1
+                    self.fallbacks += 1
+                    self._entries[key] = {'version': version, 'name': None, 'expires': now + self.retry_after}
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+            stale = [e['name'] for e in [old] + evicted if e and e['name'] and e['name'] != name]
+            if stale:
+                threading.Thread(target=self._delete, args=(stale,), daemon=True).start()
+            return name
+
+    def invalidate(self, key, name):
+        """Forget an entry upstream no longer accepts (expired or deleted)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['name'] == name:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def _create(self, system_text):
+        try:
+            response = self.client.create_cached_content({
+                'systemInstruction': {'parts': [{'text': system_text}]},
+                'ttl': f"{int(self.ttl)}s",
+            })
+        except Exception as e:
+            print(f"Could not create context cache: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Could not create context cache: {response.status_code} - {response.text[:200]}")
+            return None
+        return response.json().get('name')
+
+    def _delete(self, names):
+        for name in names:
+            try:
+                self.client.delete_cached_content(name)
+                with self._lock:
+                    self.deletes += 1
+            except Exception as e:
+                print(f"Could not delete context cache {name}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': sum(1 for e in self._entries.values() if e['name']),
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'creates': self.creates,
+                'failures': self.failures,
+                'fallbacks': self.fallbacks,
+                'invalidations': self.invalidations,
+                'deletes': self.deletes,
+            }
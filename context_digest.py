@@ -0,0 +1,73 @@
+"""
+Per-user context digest: the personal context pinned to every chat session,
+kept as separately rendered sections.
+
+Each section (profile, routines, memories, family, recap) is rendered from
+one stored collection and remembered together with that collection's
+storage stamp. Saving a collection re-renders just its own section
+(refresh(name)); a read re-renders a section only when its stamp has moved
+since, e.g. after a write from another worker process. Starting a session
+therefore no longer reloads and re-formats every file.
+
+`version` is a short hash of the rendered text, so the same content has the
+same version in every process. Sessions remember the version their pinned
+context was built from and swap in the new text on their next turn when it
+differs. The recap is only read when a session starts (a live session
+already has those turns), so it is left out of the version.
+
+    digest = ContextDigest({'profile': render_profile, ...}, stamp=lambda name: ...)
+    digest.refresh('routines')           # right after routines are saved
+    sections, version = digest.context() # every turn
+    digest.section('recap')              # when a session starts
+"""
+import hashlib
+import threading
+
+
+class ContextDigest:
+    def __init__(self, builders, stamp, unversioned=('recap',)):
+        self.builders = builders          # section name -> fn() -> text ('' when empty)
+        self.stamp = stamp                # fn(section name) -> stamp of its source collection
+        self.unversioned = set(unversioned)
+        self._sections = {}               # name -> (stamp, text)
+        self._version = (None, None)      # (section texts, version)
+        self._lock = threading.Lock()
+        self.rebuilds = dict.fromkeys(builders, 0)
+        self.hits = 0
+
+    def refresh(self, name):
+        """Re-render one section now"""
+        # Stamp first: a write landing while we render leaves a stale stamp,
+        # so the next read renders again rather than keeping old text
+        stamp = self.stamp(name)
+        text = self.builders[name]()
+        with self._lock:
+            self._sections[name] = (stamp, text)
+            self.rebuilds[name] += 1
+        return text
+
+    def section(self, name):
+        """One section's text, re-rendered only if its collection changed"""
+        entry = self._sections.get(name)
+        if entry is None or entry[0] != self.stamp(name):
+            return self.refresh(name)
+        self.hits += 1
+        return entry[1]
+
+    def context(self):
+        """([section texts], version) of the versioned sections, in builder order"""
+        texts = tuple(self.section(name) for name in self.builders if name not in self.unversioned)
+        cached_texts, version = self._version
+        if texts != cached_texts:
+            version = hashlib.sha1('\0'.join(texts).encode('utf-8')).hexdigest()[:12]
+            self._version = (texts, version)
+        return [t for t in texts if t], version
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version[1],
+                'sections': {name: len(text) for name, (_, text) in self._sections.items()},
+                'rebuilds': dict(self.rebuilds),
+                'hits': self.hits,
+            }
@@ -0,0 +1,219 @@
+"""
+Token-budgeted conversation window for a chat session.
+
+The Gemini payload for a session is:
+
+    pinned turns      system prompt + personal context (always sent); the
+                      leading context turns are swapped for newer ones with
+                      replace_context() when the user's data changes
+                      (or left out when they travel in systemInstruction,
+                      whose size is then set as system_tokens)
+    summary turns     running summary of everything folded so far
+    recent turns      the last `keep_recent` exchanges, verbatim
+
+Older turns are folded into the summary by a background summarizer, so the
+request path never waits on it. While a fold is in progress the turns being
+folded are still sent verbatim; they are dropped once the new summary lands.
+When the window is also stored elsewhere (several worker processes),
+on_summary is told about each summary so it can be applied to the stored
+copy with apply_summary().
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CHARS_PER_TOKEN = 4
+
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summarizer')
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def turn_tokens(turn):
+    return sum(estimate_tokens(p.get('text', '')) for p in turn.get('parts', []))
+
+
+def extractive_summary(previous_summary, turns, max_chars=1200):
+    """Fallback summary used when no model summarizer is available or it fails"""
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        text = ' '.join(p.get('text', '') for p in turn.get('parts', [])).strip().split('\n')[0]
+        speaker = 'User' if turn.get('role') == 'user' else 'Assistant'
+        lines.append(f"{speaker}: {text[:160]}")
+    summary = '\n'.join(lines)
+    return summary[-max_chars:]
+
+
+class ConversationWindow:
+    def __init__(self, pinned_turns, max_tokens=12000, keep_recent=6, summarize=None):
+        self.pinned = list(pinned_turns)
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent     # exchanges (user + model turn pairs)
+        self.summarize = summarize         # fn(previous_summary, turns) -> str
+        self.on_summary = None             # fn(previous_summary, turns, summary) after each fold (not stored)
+        self.summary = ''
+        self.folding = []                  # turns handed to the summarizer, still sent verbatim
+        self.recent = []
+        self.summaries_done = 0
+        self.context_version = None        # version of the context the pinned turns start with
+        self.system_tokens = 0             # sent outside contents (systemInstruction), counts to the budget
+        self.last_prompt_tokens = 0
+        self._pending = False
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------
+    # Turns
+    # -------------------------------------------------------
+    def append(self, turn):
+        with self._lock:
+            self.recent.append(turn)
+            if turn.get('role') == 'model':
+                self._maybe_fold()
+
+    def replace_context(self, turns, version, replaced=None):
+        """Swap the leading `replaced` pinned turns (default: as many as given) for an updated context"""
+        with self._lock:
+            self.pinned = list(turns) + self.pinned[len(turns) if replaced is None else replaced:]
+            self.context_version = version
+
+    def pop_user_turn(self):
+        """Drop the trailing user turn (e.g. after an upstream failure)"""
+        with self._lock:
+            if self.recent and self.recent[-1].get('role') == 'user':
+                self.recent.pop()
+
+    def contents(self):
+        """The `contents` list for the next Gemini request"""
+        with self._lock:
+            return self.pinned + self._summary_turns() + self.folding + self.recent
+
+    def prompt_tokens(self):
+        self.last_prompt_tokens = self.system_tokens + sum(turn_tokens(t) for t in self.contents())
+        return self.last_prompt_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pinned_tokens': sum(turn_tokens(t) for t in self.pinned),
+                'system_tokens': self.system_tokens,
+                'summary_tokens': estimate_tokens(self.summary),
+                'recent_turns': len(self.recent),
+                'folding_turns': len(self.folding),
+                'summaries_done': self.summaries_done,
+                'last_prompt_tokens': self.last_prompt_tokens,
+            }
+
+    def to_dict(self):
+        """Plain-JSON snapshot (used when a session is spilled to disk)"""
+        with self._lock:
+            return {
+                'pinned': self.pinned,
+                'max_tokens': self.max_tokens,
+                'keep_recent': self.keep_recent,
+                'summary': self.summary,
+                'folding': self.folding,
+                'recent': self.recent,
+                'summaries_done': self.summaries_done,
+                'context_version': self.context_version,
+                'system_tokens': self.system_tokens,
+            }
+
+    def apply_summary(self, previous, batch, summary):
+        """
+        Apply a summary computed on another copy of this window. Returns False
+        if this copy no longer starts its folding with that batch.
+        """
+        with self._lock:
+            if self.summary == summary:
+                return True
+            if self.summary != previous or self.folding[:len(batch)] != batch:
+                return False
+            self.summary = summary
+            self.folding = self.folding[len(batch):]
+            self.summaries_done += 1
+            return True
+
+    @classmethod
+    def from_dict(cls, data, summarize=None, resume=True):
+        window = cls(data['pinned'], max_tokens=data['max_tokens'],
+                     keep_recent=data['keep_recent'], summarize=summarize)
+        window.summary = data.get('summary', '')
+        window.recent = data.get('recent', [])
+        window.summaries_done = data.get('summaries_done', 0)
+        window.context_version = data.get('context_version')
+        window.system_tokens = data.get('system_tokens', 0)
+        # A fold that was still in flight when the session was spilled is restarted.
+        # Without resume (copies shared between processes, where the process that
+        # started it may still finish it) the next fold picks it up instead.
+        window.folding = data.get('folding', [])
+        if window.folding and resume:
+            window._pending = True
+            _summary_executor.submit(window._run_summary)
+        return window
+
+    def _summary_turns(self):
+        if not self.summary:
+            return []
+        return [
+            {"role": "user", "parts": [{"text": "SUMMARY OF EARLIER CONVERSATION IN THIS SESSION:\n" + self.summary}]},
+            {"role": "model", "parts": [{"text": "Thank you, I remember our conversation so far."}]}
+        ]
+
+    # -------------------------------------------------------
+    # Folding
+    # -------------------------------------------------------
+    def _over_budget(self):
+        # Turns already queued for folding are left out: they are about to be
+        # replaced by the summary, and folding more recent turns cannot shrink them.
+        total = self.system_tokens + sum(turn_tokens(t) for t in self.pinned + self._summary_turns() + self.recent)
+        return total > self.max_tokens
+
+    def _maybe_fold(self):
+        """Hand whole exchanges to the summarizer once they fall out of the window"""
+        fold = []
+        # Keep at most keep_recent exchanges verbatim
+        while len(self.recent) > 2 * self.keep_recent:
+            fold.extend(self.recent[:2])
+            self.recent = self.recent[2:]
+        # Fold further while over budget, always keeping the latest exchange
+        while len(self.recent) > 2 and self._over_budget():
+            fold.extend(self.recent[:2])
+            self.recent = self.recent[2:]
+        self.folding.extend(fold)
+        if self.folding and not self._pending:
+            self._pending = True
+            _summary_executor.submit(self._run_summary)
+
+    def _run_summary(self):
+        while True:
+            with self._lock:
+                batch = list(self.folding)
+                previous = self.summary
+            if not batch:
+                with self._lock:
+                    self._pending = False
+                return
+            summary = None
+            if self.summarize:
+                try:
+                    summary = self.summarize(previous, batch)
+                except Exception as e:
+                    print(f"Conversation summary failed, using extractive fallback: {e}")
+            if not summary:
+                summary = extractive_summary(previous, batch)
+            with self._lock:
+                self.summary = summary
+                self.folding = self.folding[len(batch):]
+                self.summaries_done += 1
+                done = not self.folding
+                if done:
+                    self._pending = False
+            if self.on_summary:
+                try:
+                    self.on_summary(previous, batch, summary)
+                except Exception as e:
+                    print(f"Could not store conversation summary: {e}")
+            if done:
+                return
@@ -0,0 +1,315 @@
+"""
+Local stand-in for the Gemini generateContent / streamGenerateContent and
+cachedContents endpoints.
+
+Used to exercise the app and gemini_client.py offline. Latency (fixed, per
+prompt token the model has to read, and per output token, as generation time
+grows with the reply), output size and failure rate are configurable.
+Prompt tokens held in a cachedContents entry are reported as
+cachedContentTokenCount and cost no prompt-token delay; requests naming an
+unknown or expired entry get a 404, as upstream.
+
+    python fake_gemini.py --port 8089 --latency 0.3 --token-delay 0.01 --fail-rate 0.05
+    GEMINI_API_BASE=http://127.0.0.1:8089/v1 python app.py
+
+or in-process:
+
+    server, base_url = start_fake_server(latency=0.1)
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGeminiState:
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, fail_status=503, output_tokens=40,
+                 chunk_chars=24, chunk_delay=0.02, token_delay=0.0, prompt_token_delay=0.0,
+                 min_cache_tokens=0, raw_utf8=False):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.prompt_token_delay = prompt_token_delay
+        self.min_cache_tokens = min_cache_tokens
+        self.raw_utf8 = raw_utf8       # send non-ASCII as UTF-8 bytes rather than \uXXXX escapes
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.output_tokens = output_tokens
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.last_payload = None
+        self.prompt_bytes = 0          # request bodies of generate calls
+        self.caches = {}               # name -> (tokens, expires), as monotonic time
+        self.cache_creates = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def _tokens(body):
+    return len(json.dumps(body)) // 4
+
+
+def _ttl_seconds(ttl):
+    try:
+        return float(str(ttl or '3600s').rstrip('s'))
+    except ValueError:
+        return None
+
+
+def _last_user_text(payload):
+    for turn in reversed(payload.get('contents') or []):
+        if turn.get('role') == 'user':
+            return ' '.join(p.get('text', '') for p in turn.get('parts', []))
+    return ''
+
+
+EXTRACTED_CATEGORIES = (
+    'memories', 'interests', 'preferences', 'people', 'places', 'life_roles', 'daily_routines',
+    'values_beliefs', 'emotional_patterns', 'achievements', 'challenges', 'historical_events',
+    'identity_details', 'health_context', 'medications',
+)
+
+
+LIKES_RE = re.compile(r"\b(?:love|like|enjoy)s?\s+(\w+)", re.IGNORECASE)
+NAME_RE = re.compile(r"(?<=[a-z,] )[A-Z][a-z]+")   # capitalised words mid-sentence
+
+
+def _current_turn(text):
+    """The user's turn: the CURRENT MESSAGE section of an extraction prompt, else the whole text"""
+    if 'CURRENT MESSAGE:\n' in text:
+        text = text.split('CURRENT MESSAGE:\n', 1)[1].split('\n\nASSISTANT REPLY:', 1)[0]
+    return text
+
+
+def build_reply(state, payload):
+    """
+    Build the model text: the JSON envelope the app's system prompt asks for.
+    With a responseSchema (structured output) only the fields the schema has
+    are returned, empty ones omitted, as bare JSON; otherwise the full
+    template comes back in a ```json fence, as the model tends to write it.
+    A schema without "response" is the app's extraction call.
+    """
+    turn_text = _current_turn(_last_user_text(payload))
+    user_text = turn_text.split('\n')[0][:200]
+    config = payload.get('generationConfig') or {}
+    structured = 'responseSchema' in config
+    fields = set(config['responseSchema'].get('properties', {})) if structured else None
+    envelope = {}
+    if not structured or 'response' in fields:
+        filler = ' '.join(['lovely'] * max(0, state.output_tokens - len(user_text.split()) - 3))
+        envelope['response'] = f"You said: {user_text} {filler}".strip()
+    if not structured:
+        envelope['extracted_data'] = {c: [] for c in EXTRACTED_CATEGORIES}
+        envelope['extracted_data']['adaptive_categories'] = {}
+        envelope['memory_actions'] = {'surfaced_memory': '', 'surfacing_mode': '', 'reason_for_surfacing': ''}
+        envelope['memory_to_confirm'] = None
+    if not structured or 'extracted_data' in fields:
+        found = {
+            'interests': LIKES_RE.findall(user_text),
+            'people': NAME_RE.findall(user_text),
+        }
+        found = {category: items for category, items in found.items() if items}
+        if found:
+            envelope['extracted_data'] = found
+    if '[REPEATED TOPIC' in turn_text and (not structured or 'memory_to_confirm' in fields):
+        envelope['memory_to_confirm'] = {
+            'title': 'A repeated topic',
+            'description': user_text,
+            'date': None,
+        }
+    if structured:
+        return json.dumps(envelope, separators=(',', ':'), ensure_ascii=not state.raw_utf8)
+    return "```json\n" + json.dumps(envelope, indent=2, ensure_ascii=not state.raw_utf8) + "\n```"
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=not self.state.raw_utf8).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_sse(self, text, usage):
+        """Stream text as SSE chunks using chunked transfer encoding"""
+        state = self.state
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [text[i:i + state.chunk_chars] for i in range(0, len(text), state.chunk_chars)]
+        for i, piece in enumerate(pieces):
+            chunk = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': piece}]}}]}
+            if i == len(pieces) - 1:
+                chunk['candidates'][0]['finishReason'] = 'STOP'
+                chunk['usageMetadata'] = usage
+            event = f"data: {json.dumps(chunk, ensure_ascii=not state.raw_utf8)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+            if state.chunk_delay and i < len(pieces) - 1:
+                time.sleep(state.chunk_delay)
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _create_cache(self, payload):
+        state = self.state
+        if not str(payload.get('model', '')).startswith('models/'):
+            return self._send_json(400, {'error': {'message': 'model is required', 'status': 'INVALID_ARGUMENT'}})
+        ttl = _ttl_seconds(payload.get('ttl'))
+        if ttl is None:
+            return self._send_json(400, {'error': {'message': 'invalid ttl', 'status': 'INVALID_ARGUMENT'}})
+        tokens = _tokens({k: payload.get(k) for k in ('systemInstruction', 'contents')})
+        if tokens < state.min_cache_tokens:
+            return self._send_json(400, {'error': {
+                'message': f'Cached content is too small. total_token_count={tokens}, '
+                           f'min_total_token_count={state.min_cache_tokens}',
+                'status': 'INVALID_ARGUMENT'}})
+        with state.lock:
+            state.cache_creates += 1
+            name = f"cachedContents/fake{state.cache_creates:06d}"
+            state.caches[name] = (tokens, time.monotonic() + ttl)
+        expire = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + ttl))
+        return self._send_json(200, {'name': name, 'model': payload['model'], 'expireTime': expire,
+                                     'usageMetadata': {'totalTokenCount': tokens}})
+
+    def _cached_tokens(self, name):
+        """Token count of a live cache entry, or None"""
+        state = self.state
+        with state.lock:
+            entry = state.caches.get(name)
+            if entry and entry[1] <= time.monotonic():
+                del state.caches[name]
+                entry = None
+            if entry is None:
+                state.cache_misses += 1
+                return None
+            state.cache_hits += 1
+            return entry[0]
+
+    def do_DELETE(self):
+        state = self.state
+        name = 'cachedContents/' + self.path.split('?')[0].rsplit('/', 1)[-1]
+        with state.lock:
+            found = state.caches.pop(name, None)
+        if found is None:
+            return self._send_json(404, {'error': {'message': f'{name} not found', 'status': 'NOT_FOUND'}})
+        self._send_json(200, {})
+
+    def do_POST(self):
+        state = self.state
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return self._send_json(400, {'error': {'message': 'invalid JSON'}})
+
+        path = self.path.split('?')[0]
+        with state.lock:
+            state.requests += 1
+            state.last_payload = payload
+            if not path.endswith('/cachedContents'):
+                state.prompt_bytes += length
+            fail = random.random() < state.fail_rate
+            if fail:
+                state.failures += 1
+
+        delay = state.latency + random.uniform(0, state.jitter)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            return self._send_json(state.fail_status, {'error': {'message': 'simulated failure'}})
+
+        if path.endswith('/cachedContents'):
+            return self._create_cache(payload)
+        method = path.rsplit(':', 1)[-1]
+        if method in ('generateContent', 'streamGenerateContent'):
+            cached_tokens = 0
+            if payload.get('cachedContent'):
+                if payload.get('systemInstruction'):
+                    return self._send_json(400, {'error': {
+                        'message': 'CachedContent can not be used with GenerateContent request setting '
+                                   'system_instruction', 'status': 'INVALID_ARGUMENT'}})
+                cached_tokens = self._cached_tokens(payload['cachedContent'])
+                if cached_tokens is None:
+                    return self._send_json(404, {'error': {
+                        'message': f"CachedContent not found: {payload['cachedContent']}", 'status': 'NOT_FOUND'}})
+            text = build_reply(state, payload)
+            new_tokens = _tokens(payload)
+            usage = {
+                'promptTokenCount': new_tokens + cached_tokens,
+                'candidatesTokenCount': len(text) // 4,
+            }
+            if cached_tokens:
+                usage['cachedContentTokenCount'] = cached_tokens
+            if state.prompt_token_delay:
+                time.sleep(state.prompt_token_delay * new_tokens)
+            if method == 'streamGenerateContent':
+                return self._send_sse(text, usage)
+            if state.token_delay:
+                time.sleep(state.token_delay * usage['candidatesTokenCount'])
+            return self._send_json(200, {
+                'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'finishReason': 'STOP'}],
+                'usageMetadata': usage,
+            })
+        self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+
+def start_fake_server(host='127.0.0.1', port=0, **options):
+    """Start the fake server on a background thread; returns (server, base_url)"""
+    state = FakeGeminiState(**options)
+    handler = type('BoundFakeGeminiHandler', (FakeGeminiHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Gemini API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency (seconds)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--output-tokens', type=int, default=40, help='approximate words per reply')
+    parser.add_argument('--chunk-delay', type=float, default=0.02, help='seconds between streamed chunks')
+    parser.add_argument('--token-delay', type=float, default=0.0,
+                        help='generation seconds per output token (non-streamed replies)')
+    parser.add_argument('--prompt-token-delay', type=float, default=0.0,
+                        help='seconds per prompt token not served from a cachedContents entry')
+    parser.add_argument('--min-cache-tokens', type=int, default=0,
+                        help='smallest cachedContents entry accepted, in tokens')
+    parser.add_argument('--raw-utf8', action='store_true',
+                        help='send non-ASCII text as raw UTF-8 instead of \\u escapes')
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(
+        args.host, args.port, latency=args.latency, jitter=args.jitter,
+        fail_rate=args.fail_rate, fail_status=args.fail_status, output_tokens=args.output_tokens,
+        chunk_delay=args.chunk_delay, token_delay=args.token_delay,
+        prompt_token_delay=args.prompt_token_delay, min_cache_tokens=args.min_cache_tokens,
+        raw_utf8=args.raw_utf8
+    )
+    print(f"Fake Gemini listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
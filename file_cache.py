@@ -0,0 +1,113 @@
+"""
+Read-through cache for the stored data collections.
+
+Each entry is validated on every read against a cheap stamp supplied by the
+storage backend: the file's stat stamp for JSON files, or a version
+counter for SQLite. Edits made by another process or by hand are therefore
+still picked up. Cached values are frozen: FrozenDict / FrozenList raise
+TypeError on any mutation, and callers that need to modify the data take a
+thaw()ed copy.
+"""
+import os
+import threading
+
+
+def _readonly(*args, **kwargs):
+    raise TypeError("cached data is read-only; use thaw() to get a mutable copy")
+
+
+class FrozenDict(dict):
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = _readonly
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+    __iadd__ = __imul__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(value):
+    """Recursively convert dicts/lists into their read-only counterparts"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Recursively copy frozen (or plain) containers into mutable dicts/lists"""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+
+def stat_stamp(st):
+    """
+    Stamp of one version of a file. The inode changes when the file is
+    replaced by a rename, and ctime on every write even if the mtime is
+    restored afterwards, so a same-size rewrite is still noticed.
+    """
+    return (st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+
+
+def file_stamp(path):
+    """Return the stamp used to validate a cache entry (None if the file is missing)"""
+    try:
+        return stat_stamp(os.stat(path))
+    except OSError:
+        return None
+
+
+class FileCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, stamp, loader):
+        """Return the frozen result of loader() for key, reloading only if the stamp changed"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        value = freeze(loader())
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (stamp, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
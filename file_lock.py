@@ -0,0 +1,63 @@
+"""
+A lock that holds across worker processes as well as threads.
+
+Under a multi-process server (gunicorn with several workers) the thread
+locks around the data files only serialize the threads of one worker.
+InterProcessLock adds an flock() on a sidecar lock file, so a
+read-modify-write of a JSON collection, a chat log append or a media
+refcount update in one worker cannot interleave with another's. Like the
+RLocks it replaces it is reentrant within a thread. Where fcntl is missing
+(Windows) it is a plain thread lock.
+
+    lock = InterProcessLock('memories.json.lock')
+    with lock:
+        ...
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class InterProcessLock:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # flock() belongs to the open file, which a forked child would share:
+        # every process opens its own
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                fcntl.flock(self._file(), fcntl.LOCK_EX)
+            except OSError:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,219 @@
+"""
+Pooled HTTP client for the Gemini API.
+
+One requests.Session is shared by every request thread so TCP/TLS
+connections are reused. Calls have connect/read timeouts, are retried with
+jittered exponential backoff on 429/5xx and connection errors, and are
+capped by a semaphore so a slow upstream cannot tie up every worker.
+
+create_cached_content() / delete_cached_content() manage entries of the
+cachedContents API (a prompt prefix stored upstream and referenced by name
+from generateContent); it is only served under v1beta.
+"""
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiBusyError(Exception):
+    """Raised when no upstream slot frees up within queue_timeout"""
+
+
+class GeminiHTTPError(Exception):
+    """Non-200 response from a streaming call"""
+
+    def __init__(self, status_code, text=''):
+        super().__init__(f"{status_code} - {text[:200]}")
+        self.status_code = status_code
+
+
+class GeminiClient:
+    def __init__(self, base_url, api_key, model,
+                 connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=2, backoff=0.5, max_backoff=8.0,
+                 max_concurrency=8, queue_timeout=30.0, on_call=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue_timeout = queue_timeout
+        self.on_call = on_call    # fn(method, status, seconds) after every call, e.g. for metrics
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.status_counts = {}
+
+    def url(self, method):
+        return f"{self.base_url}/models/{self.model}:{method}"
+
+    def _backoff_delay(self, attempt, response=None):
+        """Full-jitter exponential backoff, honouring Retry-After when given"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.max_backoff)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise GeminiBusyError("Too many in-flight Gemini requests")
+        with self._stats_lock:
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def _release(self, started, status, method):
+        self._slots.release()
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.calls += 1
+            self._latencies.append(elapsed)
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if self.on_call:
+            self.on_call(method, status, elapsed)
+
+    def _send(self, method, payload, stream=False, params=None, url=None):
+        """POST with retries; non-retryable statuses are returned unchanged"""
+        query = {'key': self.api_key}
+        if params:
+            query.update(params)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url or self.url(method), params=query, json=payload,
+                                             timeout=self.timeout, stream=stream)
+            except requests.ConnectionError:
+                # Connection refused/reset: the request never reached the model, safe to retry
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+            attempt += 1
+            with self._stats_lock:
+                self.retries += 1
+            time.sleep(self._backoff_delay(attempt, response))
+
+    def post(self, method, payload, params=None, url=None):
+        """POST payload to models/<model>:<method> (or url) and return the final Response"""
+        started = self._acquire()
+        status = 'error'
+        try:
+            response = self._send(method, payload, params=params, url=url)
+            status = response.status_code
+            return response
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._release(started, status, method)
+
+    def generate_content(self, payload):
+        return self.post('generateContent', payload)
+
+    def create_cached_content(self, body):
+        """
+        Store a prompt prefix upstream (body: systemInstruction and/or contents,
+        ttl). The Response JSON carries the entry's `name` for `cachedContent`.
+        """
+        return self.post('createCachedContent', dict(body, model=f"models/{self.model}"),
+                         url=f"{self.base_url}/cachedContents")
+
+    def delete_cached_content(self, name):
+        """Delete a cachedContents entry by name ('cachedContents/...')"""
+        started = self._acquire()
+        status = 'error'
+        try:
+            response = self.session.delete(f"{self.base_url}/{name}", params={'key': self.api_key},
+                                           timeout=self.timeout)
+            status = response.status_code
+            return response
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._release(started, status, 'deleteCachedContent')
+
+    def stream_generate_content(self, payload, usage=None):
+        """
+        Call streamGenerateContent (SSE) and yield text chunks as they arrive.
+        The concurrency slot is held until the stream is fully consumed.
+        If a usage dict is given it is updated with the stream's usageMetadata.
+        """
+        started = self._acquire()
+        status = 'error'
+        try:
+            response = self._send('streamGenerateContent', payload, stream=True, params={'alt': 'sse'})
+            status = response.status_code
+            if status != 200:
+                raise GeminiHTTPError(status, response.text)
+            # text/event-stream is UTF-8, but without a charset requests would decode it as Latin-1
+            response.encoding = 'utf-8'
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    chunk = json.loads(line[5:])
+                    if usage is not None and chunk.get('usageMetadata'):
+                        usage.update(chunk['usageMetadata'])
+                    for candidate in chunk.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            if part.get('text'):
+                                yield part['text']
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._release(started, status, 'streamGenerateContent')
+
+    def stats(self):
+        """Latency percentiles (ms) over the last 1000 calls plus counters"""
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            result = {
+                'calls': self.calls,
+                'retries': self.retries,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'max_concurrency': self.max_concurrency,
+                'status_counts': {str(k): v for k, v in self.status_counts.items()},
+            }
+        if latencies:
+            def pct(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+            result.update({
+                'p50_ms': pct(0.50),
+                'p95_ms': pct(0.95),
+                'p99_ms': pct(0.99),
+                'max_ms': round(latencies[-1] * 1000, 1),
+            })
+        return result
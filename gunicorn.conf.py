@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+Workers are processes, so chat turns (prompt building, JSON parsing) use
+every core; each worker runs SERVER_THREADS request threads, which keeps
+slow Gemini calls, streamed replies and extraction long-polls from holding
+up other requests. Every value can be overridden from the environment.
+Note that GEMINI_MAX_CONCURRENCY and the queue sizes apply per worker, and
+/metrics reports the worker that answered the scrape.
+"""
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get("SERVER_BIND", "127.0.0.1:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("SERVER_THREADS", 8))
+worker_class = "gthread"
+
+# Streamed replies and ?wait= long-polls hold a request for up to a minute
+timeout = int(os.environ.get("SERVER_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# The app starts background threads at import (write-behind queue,
+# extraction and thumbnail pools); threads do not survive fork, so each
+# worker imports it after forking.
+preload_app = False
+
+accesslog = os.environ.get("SERVER_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def worker_exit(server, worker):
+    """Let running extractions finish and flush queued writes before the worker goes"""
+    app = sys.modules.get("app")
+    if app is not None:
+        app.extraction_jobs.close()
+        app.write_queue.close()
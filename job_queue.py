@@ -0,0 +1,118 @@
+"""
+Background jobs whose results the client collects later.
+
+Used for memory extraction: /api/chat answers as soon as the short reply is
+generated and hands back a job id; the extraction call runs here and the
+client polls /api/extractions/<id> (optionally long-polling with ?wait=)
+for the extracted data and any memory to confirm.
+
+    jobs = JobQueue(workers=2)
+    jobs.submit(job_id, fn, arg)     # raises JobQueueFull when max_pending are waiting
+    jobs.get(job_id, wait=10)        # {'status': 'pending'|'running'|'done'|'error', ...}
+    jobs.close()                     # let queued jobs finish (registered with atexit by the app)
+
+Finished jobs are kept for the last `keep` ids, then forgotten.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 3)
+
+
+class JobQueue:
+    def __init__(self, workers=2, max_pending=200, keep=1000, name='jobs'):
+        self.max_pending = max_pending
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()        # job id -> record
+        self._lock = threading.Lock()
+        self._closed = False
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._run_ms = []                 # recent job durations
+        self._total_ms = []               # recent submit -> result latencies
+
+    def submit(self, job_id, fn, *args):
+        with self._lock:
+            if self._closed or self.pending >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFull(f"{self.pending} jobs pending")
+            self.pending += 1
+            self._jobs[job_id] = {'status': 'pending', 'submitted': time.monotonic(), 'done': threading.Event()}
+            while len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job_id, fn, args)
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job['status'] = 'running'
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = fn(*args)
+        except Exception as e:
+            error = str(e)
+            print(f"Background job {job_id} failed: {e}")
+        finished = time.monotonic()
+        with self._lock:
+            self.pending -= 1
+            if error:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self._run_ms = (self._run_ms + [(finished - started) * 1000])[-1000:]
+            if job:
+                self._total_ms = (self._total_ms + [(finished - job['submitted']) * 1000])[-1000:]
+                job.update(status='error' if error else 'done', result=result, error=error)
+        if job:
+            job['done'].set()
+
+    def get(self, job_id, wait=0):
+        """Public view of a job, waiting up to `wait` seconds for it to finish; None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait and job['status'] in ('pending', 'running'):
+            job['done'].wait(wait)
+        with self._lock:
+            view = {'status': job['status']}
+            if job['status'] == 'done':
+                view['result'] = job['result']
+            elif job['status'] == 'error':
+                view['error'] = job['error']
+            return view
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'run_ms_p50': _percentile(self._run_ms, 0.50),
+                'run_ms_p95': _percentile(self._run_ms, 0.95),
+                'submit_to_result_ms_p50': _percentile(self._total_ms, 0.50),
+                'submit_to_result_ms_p95': _percentile(self._total_ms, 0.95),
+            }
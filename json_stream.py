@@ -0,0 +1,111 @@
+"""
+Incremental extraction of one top-level string field from a JSON document
+that arrives in pieces (e.g. the model's streamed JSON envelope).
+
+    stream = JsonFieldStream('response')
+    for chunk in chunks:
+        text = stream.feed(chunk)   # newly decoded characters of "response"
+
+Anything before the first '{' (such as a ```json fence) is ignored. The
+parser only tracks nesting and string state, so it never needs the full
+document in memory and never re-scans what it has already seen.
+"""
+
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class JsonFieldStream:
+    def __init__(self, field):
+        self.field = field
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_buf = []
+        self.expect_key = False   # next string at depth 1 is an object key
+        self.last_key = None
+        self.awaiting_value = False  # saw `"field":`, waiting for the opening quote
+        self.in_value = False
+        self.done = False
+        self.pending_escape = ''  # partial \uXXXX sequence split across chunks
+        self.high_surrogate = None
+
+    def feed(self, chunk):
+        """Consume the next piece of the document; return newly decoded field text"""
+        if self.done:
+            return ''
+        out = []
+        for ch in chunk:
+            if self.in_value:
+                if self._value_char(ch, out):
+                    self.done = True
+                    break
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if self.depth == 1 and self.expect_key:
+                        self.string_buf.append(ch)
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.expect_key:
+                        self.last_key = ''.join(self.string_buf)
+                        self.expect_key = False
+                else:
+                    if self.depth == 1 and self.expect_key:
+                        self.string_buf.append(ch)
+                continue
+
+            if ch == '"':
+                if self.awaiting_value:
+                    self.awaiting_value = False
+                    self.in_value = True
+                    continue
+                self.in_string = True
+                self.string_buf = []
+            elif ch in '{[':
+                self.depth += 1
+                self.awaiting_value = False
+                if ch == '{' and self.depth == 1:
+                    self.expect_key = True
+            elif ch in '}]':
+                self.depth -= 1
+            elif ch == ':' and self.depth == 1:
+                self.awaiting_value = self.last_key == self.field
+            elif ch == ',' and self.depth == 1:
+                self.expect_key = True
+                self.awaiting_value = False
+            elif not ch.isspace():
+                # A non-string value (number, null, ...) for the field
+                self.awaiting_value = False
+        return ''.join(out)
+
+    def _value_char(self, ch, out):
+        """Decode one character inside the field's string value; True at the closing quote"""
+        if self.pending_escape:
+            self.pending_escape += ch
+            if self.pending_escape[1] != 'u':
+                out.append(ESCAPES.get(ch, ch))
+                self.pending_escape = ''
+            elif len(self.pending_escape) == 6:
+                self._emit_codepoint(int(self.pending_escape[2:], 16), out)
+                self.pending_escape = ''
+            return False
+        if ch == '\\':
+            self.pending_escape = '\\'
+            return False
+        if ch == '"':
+            return True
+        out.append(ch)
+        return False
+
+    def _emit_codepoint(self, code, out):
+        if 0xD800 <= code <= 0xDBFF:
+            self.high_surrogate = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self.high_surrogate is not None:
+            code = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self.high_surrogate = None
+        out.append(chr(code))
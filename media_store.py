@@ -0,0 +1,259 @@
+"""
+Content-addressed store for uploaded media.
+
+Uploads are streamed to a temp file in fixed-size chunks while being hashed
+(SHA-256), then renamed to `<sha256>.<ext>` inside the upload folder. The
+same bytes uploaded twice land on the same blob. Blobs are reference counted
+by the records that point at them (memories, routines, family photos) and
+removed when the last reference goes away. Each upload also takes a pending
+hold on its blob until a record first points at it, so a blob returned for
+a duplicate upload cannot be removed before that record is saved.
+
+Files saved before this store existed keep their names. `python
+media_store.py dedupe` folds byte-identical legacy files into one blob and
+records aliases so their old /uploads/<filename> URLs still resolve.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+
+from file_cache import file_stamp, stat_stamp
+from file_lock import InterProcessLock
+from storage import write_json_atomic
+
+BLOB_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def is_blob_name(filename):
+    """True for content-addressed names (<sha256>.<ext>), whose bytes never change"""
+    return bool(BLOB_RE.match(filename))
+
+
+def media_name(url):
+    """Filename part of an /uploads/<filename> URL, or None for anything else"""
+    if isinstance(url, str) and url.startswith('/uploads/'):
+        return url[len('/uploads/'):].split('?')[0]
+    return None
+
+
+class MediaStore:
+    def __init__(self, folder, max_bytes, chunk_size=CHUNK_SIZE, on_remove=None, interprocess=False):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.on_remove = on_remove  # fn(blob_name), e.g. to drop thumbnails
+        # interprocess: other worker processes update the same refcounts, so
+        # state is re-read under a file lock before every change
+        self.interprocess = interprocess
+        self._etags = {}  # legacy filename -> (file stamp, sha256)
+        self._state_path = os.path.join(folder, '.media.json')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._lock = InterProcessLock(self._state_path + '.lock') if interprocess else threading.Lock()
+        self._state = self._load_state()
+        # sha256 -> blob filename, so dedup lookups do not list the folder
+        self._blobs = {}
+        for name in os.listdir(folder):
+            if BLOB_RE.match(name):
+                self._blobs.setdefault(name.split('.')[0], name)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            state = {}
+        state.setdefault('refs', {})
+        state.setdefault('aliases', {})
+        state.setdefault('pending', {})  # blob -> uploads not yet referenced by a record
+        return state
+
+    def _save_state(self):
+        write_json_atomic(self._state_path, self._state)
+
+    # -------------------------------------------------------
+    # Writes
+    # -------------------------------------------------------
+    def save_stream(self, stream, filename):
+        """Hash and store an upload stream; returns the blob filename"""
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'bin'
+        tmp_path = os.path.join(self.folder, f".upload-{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as out:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+
+            sha = digest.hexdigest()
+            with self._lock:
+                if self.interprocess:
+                    self._state = self._load_state()
+                blob = self._find_blob(sha, ext)
+                if not blob:
+                    blob = f"{sha}.{ext}"
+                    os.replace(tmp_path, os.path.join(self.folder, blob))
+                    self._blobs[sha] = blob
+                # Held under the same lock update_refs removes blobs with
+                pending = self._state['pending']
+                pending[blob] = pending.get(blob, 0) + 1
+                self._save_state()
+                return blob
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _find_blob(self, sha, ext=None):
+        """Existing blob holding these bytes, or None"""
+        name = self._blobs.get(sha)
+        if name is None and ext:
+            # Another worker may have stored it since the index was built
+            name = f"{sha}.{ext}"
+        if name and os.path.exists(os.path.join(self.folder, name)):
+            self._blobs[sha] = name
+            return name
+        self._blobs.pop(sha, None)
+        return None
+
+    def update_refs(self, old_urls, new_urls):
+        """Adjust refcounts for a record set changing from old_urls to new_urls"""
+        old = [self.resolve(n) for n in map(media_name, old_urls) if n]
+        new = [self.resolve(n) for n in map(media_name, new_urls) if n]
+        old = [n for n in old if BLOB_RE.match(n)]
+        new = [n for n in new if BLOB_RE.match(n)]
+        if sorted(old) == sorted(new):
+            return
+        with self._lock:
+            if self.interprocess:
+                self._state = self._load_state()
+            refs = self._state['refs']
+            pending = self._state['pending']
+            for name in new:
+                refs[name] = refs.get(name, 0) + 1
+                # The first record pointing at an upload takes over its hold
+                if pending.get(name):
+                    pending[name] -= 1
+                    if not pending[name]:
+                        del pending[name]
+            for name in old:
+                refs[name] = refs.get(name, 0) - 1
+                if refs[name] <= 0:
+                    del refs[name]
+                    if not pending.get(name):
+                        self._remove_blob(name)
+            self._save_state()
+
+    def _remove_blob(self, name):
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except OSError:
+            pass
+        self._blobs.pop(name.split('.')[0], None)
+        if self.on_remove:
+            self.on_remove(name)
+        for alias in [a for a, target in self._state['aliases'].items() if target == name]:
+            del self._state['aliases'][alias]
+
+    # -------------------------------------------------------
+    # Reads
+    # -------------------------------------------------------
+    def content_etag(self, filename):
+        """
+        Strong ETag for a stored file: blob names already are the SHA-256;
+        legacy files are hashed once and remembered by their file stamp.
+        """
+        if BLOB_RE.match(filename):
+            return filename.split('.')[0]
+        path = os.path.join(self.folder, filename)
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        cached = self._etags.get(filename)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                # Stamp the file actually hashed, in case it was replaced since the stat
+                stamp = stat_stamp(os.fstat(f.fileno()))
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                # Written to while being hashed: serve this hash, but do not remember it
+                if stat_stamp(os.fstat(f.fileno())) != stamp:
+                    return digest.hexdigest()
+        except FileNotFoundError:
+            return None
+        self._etags[filename] = (stamp, digest.hexdigest())
+        return digest.hexdigest()
+
+    def resolve(self, filename):
+        """Map a requested filename (possibly a legacy alias) to the file on disk"""
+        return self._state['aliases'].get(filename, filename)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'referenced_blobs': len(self._state['refs']),
+                'references': sum(self._state['refs'].values()),
+                'aliases': len(self._state['aliases']),
+                'pending_uploads': sum(self._state['pending'].values()),
+            }
+
+    # -------------------------------------------------------
+    # Legacy migration
+    # -------------------------------------------------------
+    def dedupe_legacy(self):
+        """Fold byte-identical legacy uploads into blobs, keeping their URLs as aliases"""
+        saved = 0
+        with self._lock:
+            if self.interprocess:
+                self._state = self._load_state()
+            for name in sorted(os.listdir(self.folder)):
+                path = os.path.join(self.folder, name)
+                if name.startswith('.') or BLOB_RE.match(name) or not os.path.isfile(path):
+                    continue
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        digest.update(chunk)
+                ext = name.rsplit('.', 1)[-1].lower() if '.' in name else 'bin'
+                blob = self._find_blob(digest.hexdigest())
+                if blob:
+                    saved += os.path.getsize(path)
+                    os.remove(path)
+                else:
+                    blob = f"{digest.hexdigest()}.{ext}"
+                    os.replace(path, os.path.join(self.folder, blob))
+                    self._blobs[digest.hexdigest()] = blob
+                self._state['aliases'][name] = blob
+                # Legacy files are referenced by URL from records we have not counted;
+                # pin them so they are never garbage collected.
+                self._state['refs'][blob] = self._state['refs'].get(blob, 0) + 1
+            self._save_state()
+        return saved
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'dedupe':
+        print("Usage: python media_store.py dedupe [upload_folder]")
+        sys.exit(1)
+    store = MediaStore(sys.argv[2] if len(sys.argv) > 2 else 'uploads', max_bytes=0)
+    print(f"Reclaimed {store.dedupe_legacy()} bytes")
@@ -0,0 +1,164 @@
+"""
+Cursor pagination, field projection and change queries for list endpoints.
+
+Items are ordered by (sort field, id), which stays stable as items are added
+or removed, so a cursor -- the (value, id) of the last item returned -- always
+resumes at the right place. Cursors are opaque URL-safe strings.
+
+    ?limit=50             page size (default 50, max 500)
+    ?cursor=<next_cursor> continue after the previous page
+    ?order=desc           newest first
+    ?fields=id,title      only these keys (id and version are always kept)
+    ?since=<iso time>     only items changed after this time (items with no
+                          timestamp always count as changed), and in
+                          'deleted' the ids deleted after it
+
+paginate_log() serves the same parameters from an append-only log without
+loading it: the log is already in sort order, and its cursors also carry
+the position of the last entry returned.
+"""
+import base64
+import json
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+PAGE_PARAMS = ('limit', 'cursor', 'fields', 'since', 'order')
+ALWAYS_KEPT = ('id', 'version')
+
+
+class PageError(ValueError):
+    pass
+
+
+def encode_cursor(value, item_id):
+    raw = json.dumps([value, item_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        return str(value), str(item_id)
+    except (ValueError, TypeError):
+        raise PageError('Invalid cursor')
+
+
+def wants_page(args):
+    """True if the request used any paging parameter (otherwise serve the legacy full list)"""
+    return any(name in args for name in PAGE_PARAMS)
+
+
+def _limit_and_order(args):
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise PageError('limit must be a number')
+    order = args.get('order', 'asc')
+    if order not in ('asc', 'desc'):
+        raise PageError('order must be asc or desc')
+    return limit, order
+
+
+def _project(page, args):
+    fields = args.get('fields')
+    if not fields:
+        return page
+    wanted = set(f.strip() for f in fields.split(',') if f.strip()) | set(ALWAYS_KEPT)
+    return [{k: v for k, v in item.items() if k in wanted} for item in page]
+
+
+def paginate(items, args, sort_field, changed_fields=('updated_at',), deleted=None):
+    """
+    Apply the query parameters in args to a list of dict items.
+    changed_fields: item keys checked, in order, for `since` (the first one present is used).
+    deleted: the collection's [{id, deleted_at}] tombstones, reported for `since`.
+    Returns {'items', 'next_cursor', 'total'}; total counts items after `since` filtering.
+    With `since`, also 'deleted': ids deleted after it (on every page).
+    """
+    limit, order = _limit_and_order(args)
+
+    def key(item):
+        return (str(item.get(sort_field) or ''), str(item.get('id') or ''))
+
+    rows = [i for i in items if isinstance(i, dict)]
+    since = args.get('since')
+    if since:
+        def changed_at(item):
+            for field in changed_fields:
+                if item.get(field):
+                    return str(item[field])
+            return None
+        # Items stored before they carried a timestamp cannot be placed in time
+        rows = [i for i in rows if changed_at(i) is None or changed_at(i) > since]
+    total = len(rows)
+
+    rows.sort(key=key, reverse=(order == 'desc'))
+    cursor = args.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor)
+        if order == 'asc':
+            rows = [i for i in rows if key(i) > after]
+        else:
+            rows = [i for i in rows if key(i) < after]
+
+    page = rows[:limit]
+    next_cursor = encode_cursor(*key(page[-1])) if len(rows) > limit else None
+    result = {'items': _project(page, args), 'next_cursor': next_cursor, 'total': total}
+    if since:
+        result['deleted'] = [t['id'] for t in deleted or []
+                             if isinstance(t, dict) and str(t.get('deleted_at') or '') > since]
+    return result
+
+
+def paginate_log(count, read_range, args, sort_field):
+    """
+    paginate() for a log of count dict entries kept in sort_field order (the
+    chat history), where read_range(start, stop) returns the entries at those
+    positions. Only the page itself is read: a cursor's position is checked
+    against its value and used directly, and `since` (or a cursor whose
+    position no longer holds its value, e.g. after the log was replaced) is
+    found by bisecting on sort_field.
+    """
+    limit, order = _limit_and_order(args)
+
+    def value_at(position):
+        return str(read_range(position, position + 1)[0].get(sort_field) or '')
+
+    def bisect(value, right):
+        """First position whose value is > value (right) or >= value"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = value_at(mid)
+            if found < value or (right and found == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    first = bisect(args['since'], right=True) if args.get('since') else 0
+    start, stop = first, count
+    cursor = args.get('cursor')
+    if cursor:
+        value, position = decode_cursor(cursor)
+        if position.isdigit() and int(position) < count and value_at(int(position)) == value:
+            start, stop = (int(position) + 1, count) if order == 'asc' else (first, int(position))
+        elif order == 'asc':
+            start = bisect(value, right=True)
+        else:
+            stop = bisect(value, right=False)
+        start = max(start, first)
+
+    if order == 'asc':
+        end = min(start + limit, stop)
+        page = read_range(start, end)
+        last, more = end - 1, end < stop
+    else:
+        begin = max(stop - limit, start)
+        page = read_range(begin, stop)[::-1]
+        last, more = begin, begin > start
+    next_cursor = None
+    if page and more:
+        next_cursor = encode_cursor(str(page[-1].get(sort_field) or ''), str(last))
+    return {'items': _project(page, args), 'next_cursor': next_cursor, 'total': count - first}
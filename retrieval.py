@@ -0,0 +1,146 @@
+"""
+Offline BM25 retrieval over the user's memories, routines and family.
+
+The index is an in-memory inverted index (term -> {doc_key: term frequency}).
+sync() diffs a collection against what is already indexed by content hash,
+so a save only re-indexes the records that actually changed. search() scores
+candidate documents with BM25 and returns the best matches that fit in a
+character budget.
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'do', 'for', 'from',
+    'had', 'has', 'have', 'he', 'her', 'his', 'i', 'if', 'in', 'is', 'it', 'its',
+    'me', 'my', 'of', 'on', 'or', 'our', 'she', 'so', 'that', 'the', 'their',
+    'them', 'there', 'they', 'this', 'to', 'was', 'we', 'were', 'what', 'when',
+    'which', 'who', 'will', 'with', 'you', 'your', 'about', 'just', 'then',
+    'than', 'some', 'also', 'would', 'could', 'should', 'been', 'am', 'did',
+    'can', 'how', 'today', 'yes', 'no', 'not'
+}
+
+
+def _stem(word):
+    """Very light suffix stripping so 'roses'/'rose' and 'gardening'/'garden' meet"""
+    if len(word) > 5 and word.endswith('ing'):
+        return word[:-3]
+    if len(word) > 4 and word.endswith('ed'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [_stem(t) for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+class RetrievalIndex:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}      # doc_key -> {'kind', 'length', 'hash', 'display', 'terms'}
+        self.postings = {}  # term -> {doc_key: tf}
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    # -------------------------------------------------------
+    # Updates
+    # -------------------------------------------------------
+    def _remove(self, doc_key):
+        doc = self.docs.pop(doc_key, None)
+        if doc is None:
+            return
+        self.total_length -= doc['length']
+        for term in doc['terms']:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_key, None)
+                if not posting:
+                    del self.postings[term]
+
+    def _add(self, doc_key, kind, text, display, digest):
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.docs[doc_key] = {'kind': kind, 'length': length, 'hash': digest,
+                              'display': display, 'terms': list(counts)}
+        self.total_length += length
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_key] = tf
+
+    def sync(self, kind, records):
+        """
+        Make the index match records for one kind.
+        records: iterable of (doc_id, searchable_text, display_text).
+        Returns the number of documents added, changed or removed.
+        """
+        changed = 0
+        with self._lock:
+            seen = set()
+            for doc_id, text, display in records:
+                doc_key = f"{kind}:{doc_id}"
+                seen.add(doc_key)
+                digest = hashlib.sha1((text + '\0' + display).encode('utf-8')).hexdigest()
+                existing = self.docs.get(doc_key)
+                if existing is not None and existing['hash'] == digest:
+                    continue
+                self._remove(doc_key)
+                self._add(doc_key, kind, text, display, digest)
+                changed += 1
+            for doc_key in [k for k, d in self.docs.items() if d['kind'] == kind and k not in seen]:
+                self._remove(doc_key)
+                changed += 1
+        return changed
+
+    # -------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------
+    def search(self, query, limits=None, budget_chars=2000):
+        """
+        Rank documents for query with BM25.
+        limits: optional {kind: max results}. Returns [(score, kind, display)] best first,
+        trimmed so the combined display text stays within budget_chars.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = len(self.docs)
+            if not n_docs:
+                return []
+            avg_len = self.total_length / n_docs or 1
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_key, tf in posting.items():
+                    length = self.docs[doc_key]['length']
+                    norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+                    scores[doc_key] = scores.get(doc_key, 0.0) + idf * norm
+            ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+            results = []
+            used = Counter()
+            spent = 0
+            for doc_key, score in ranked:
+                doc = self.docs[doc_key]
+                kind = doc['kind']
+                if limits is not None and used[kind] >= limits.get(kind, 0):
+                    continue
+                if spent + len(doc['display']) > budget_chars:
+                    continue
+                used[kind] += 1
+                spent += len(doc['display'])
+                results.append((round(score, 4), kind, doc['display']))
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {'documents': len(self.docs), 'terms': len(self.postings)}
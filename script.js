@@ -8,6 +8,31 @@ let currentRoutineView = 'today';
 let currentMemoryFilter = 'all';
 let themeAnimRAF = null; // requestAnimationFrame handle for theme animations
 
+// ── Tenant ──────────────────────────────────────────────────
+// Whose data this page shows is decided by the server from an access token
+// (`python tenants.py create <id>` prints one). Open the page once with
+// ?token=<token>: it is exchanged for a session cookie, which every later
+// request (including images and videos) carries, and dropped from the URL.
+(() => {
+    const params = new URLSearchParams(window.location.search);
+    const token = params.get('token');
+    if (!token) return;
+    params.delete('token');
+    const query = params.toString();
+    history.replaceState(null, '', window.location.pathname + (query ? `?${query}` : '') + window.location.hash);
+    fetch('/api/login', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ token })
+    }).then(response => {
+        if (response.ok) {
+            window.location.reload();
+        } else {
+            console.error('Login with the access token failed');
+        }
+    });
+})();
+
 // ── i18n state ──────────────────────────────────────────────
 let currentAppLang = 'en';       // active language code
 let selectedSpokenLangs = [];    // array of language name strings
@@ -451,12 +476,80 @@ function generateUUID() {
     });
 }
 
+// ===================================
+// ITEM SYNC
+// ===================================
+// Each memory / routine / family member / note is saved on its own: only the
+// changed fields are sent, guarded by the version the item was loaded at.
+async function itemRequest(collection, method, path, body) {
+    const response = await fetch(`/api/${collection}/${path}`, {
+        method,
+        headers: { 'Content-Type': 'application/json' },
+        body: body ? JSON.stringify(body) : undefined
+    });
+    const data = await response.json().catch(() => ({}));
+    return { ok: response.ok, status: response.status, data };
+}
+
+function itemChanges(oldItem, newItem) {
+    const changes = {};
+    for (const [key, value] of Object.entries(newItem)) {
+        if (key === 'version' || key === 'updated_at') continue;
+        if (JSON.stringify(oldItem[key]) !== JSON.stringify(value)) changes[key] = value;
+    }
+    return changes;
+}
+
+// Create (no stored item with that id), update, or delete (newItem === null)
+// one item, then update `list` with what the server stored. On a version
+// conflict the local copy is replaced with the server's and false is returned.
+async function syncItem(collection, list, id, newItem) {
+    const index = id ? list.findIndex(i => i.id === id) : -1;
+    const existing = index === -1 ? null : list[index];
+    let result;
+    if (newItem === null) {
+        if (!existing) return true;
+        result = await itemRequest(collection, 'DELETE', encodeURIComponent(id), { version: existing.version });
+    } else if (!existing) {
+        result = await itemRequest(collection, 'POST', 'items', newItem);
+    } else {
+        const changes = itemChanges(existing, newItem);
+        if (Object.keys(changes).length === 0) return true;
+        result = await itemRequest(collection, 'PATCH', encodeURIComponent(id), { changes, version: existing.version });
+    }
+
+    if (result.status === 409 && result.data.item) {
+        if (index === -1) list.push(result.data.item);
+        else list[index] = result.data.item;
+        showToast('This was changed on another device. Showing the latest version.', 'info', 4000);
+        return false;
+    }
+    if (result.status === 404 && existing) {
+        list.splice(index, 1);
+        return false;
+    }
+    if (!result.ok) throw new Error(result.data.error || `HTTP ${result.status}`);
+
+    if (newItem === null) list.splice(index, 1);
+    else if (existing) list[index] = result.data.item;
+    else list.push(result.data.item);
+    return true;
+}
+
 function escapeHtml(text) {
     const div = document.createElement('div');
     div.textContent = text;
     return div.innerHTML;
 }
 
+// Resized variant of an uploaded photo (or a video's poster frame); the server
+// falls back to the original while the variant is still being generated.
+function thumbUrl(url, width) {
+    if (!url || !url.startsWith('/uploads/')) return url;
+    const scaled = Math.round(width * (window.devicePixelRatio || 1));
+    return `${url}?w=${scaled}`;
+}
+
 function formatTime(time) {
     const [hours, minutes] = time.split(':');
     const hour = parseInt(hours);
@@ -546,7 +639,7 @@ function renderHomeRecentMemories() {
     container.innerHTML = recentMemories.map(memory => `
         <div class="home-memory-item">
             ${memory.mediaPath ?
-            `<img src="${escapeHtml(memory.mediaPath)}" alt="${escapeHtml(memory.title)}" class="home-memory-thumbnail">` :
+            `<img src="${escapeHtml(thumbUrl(memory.mediaPath, 80))}" alt="${escapeHtml(memory.title)}" class="home-memory-thumbnail" loading="lazy">` :
             '<div class="home-memory-thumbnail"></div>'
         }
             <div class="home-memory-info">
@@ -572,7 +665,7 @@ function renderHomeFamilyUpdates() {
     container.innerHTML = familyMembers.map(member => `
         <div class="home-family-item">
             ${member.photoUrl ?
-            `<img src="${escapeHtml(member.photoUrl)}" alt="${escapeHtml(member.name)}" class="home-family-photo">` :
+            `<img src="${escapeHtml(thumbUrl(member.photoUrl, 80))}" alt="${escapeHtml(member.name)}" class="home-family-photo" loading="lazy">` :
             '<div class="home-family-photo">👤</div>'
         }
             <div class="home-family-info">
@@ -681,9 +774,9 @@ function createRoutineBox(routine) {
     if (routine.mediaPath) {
         const ext = routine.mediaPath.split('.').pop().toLowerCase();
         if (['mp4', 'mov', 'webm'].includes(ext)) {
-            mediaHtml = `<div class="item-media"><video src="${routine.mediaPath}" controls></video></div>`;
+            mediaHtml = `<div class="item-media"><video src="${routine.mediaPath}" poster="${thumbUrl(routine.mediaPath, 640)}" preload="none" controls></video></div>`;
         } else {
-            mediaHtml = `<div class="item-media"><img src="${routine.mediaPath}" alt="Routine Media"></div>`;
+            mediaHtml = `<div class="item-media"><img src="${thumbUrl(routine.mediaPath, 640)}" alt="Routine Media" loading="lazy"></div>`;
         }
     }
 
@@ -848,14 +941,11 @@ async function saveRoutine() {
         lastCompleted: id ? (routines.find(r => r.id === id)?.lastCompleted || null) : null
     };
 
-    if (id) {
-        const index = routines.findIndex(r => r.id === id);
-        if (index !== -1) routines[index] = newRoutine;
-    } else {
-        routines.push(newRoutine);
+    try {
+        await syncItem('routines', routines, id, newRoutine);
+    } catch (error) {
+        console.error('Error saving routine:', error);
     }
-
-    await syncRoutines();
     closeRoutineModal();
     renderRoutines();
 }
@@ -864,8 +954,11 @@ function deleteRoutine(id) {
     const routine = routines.find(r => r.id === id);
     const label = routine ? `"${routine.title || 'this routine'}"` : 'this routine';
     openDeleteEntryModal(label, async () => {
-        routines = routines.filter(r => r.id !== id);
-        await syncRoutines();
+        try {
+            await syncItem('routines', routines, id, null);
+        } catch (error) {
+            console.error('Error deleting routine:', error);
+        }
         renderRoutines();
         showToast(t('msg_deleted', currentAppLang), 'info');
     });
@@ -880,9 +973,13 @@ async function toggleRoutineComplete(id) {
     if (!routine) return;
 
     const today = new Date().toISOString().split('T')[0];
-    routine.lastCompleted = routine.lastCompleted === today ? null : today;
+    const lastCompleted = routine.lastCompleted === today ? null : today;
 
-    await syncRoutines();
+    try {
+        await syncItem('routines', routines, id, { ...routine, lastCompleted });
+    } catch (error) {
+        console.error('Error updating routine:', error);
+    }
     renderRoutines();
 }
 
@@ -890,21 +987,12 @@ async function toggleRoutinePause(id) {
     const routine = routines.find(r => r.id === id);
     if (!routine) return;
 
-    routine.paused = !routine.paused;
-    await syncRoutines();
-    renderRoutines();
-}
-
-async function syncRoutines() {
     try {
-        await fetch('/api/routines', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(routines)
-        });
+        await syncItem('routines', routines, id, { ...routine, paused: !routine.paused });
     } catch (error) {
-        console.error('Error syncing routines:', error);
+        console.error('Error updating routine:', error);
     }
+    renderRoutines();
 }
 
 // ===================================
@@ -968,9 +1056,9 @@ function createMemoryBox(memory) {
     if (memory.mediaPath) {
         const ext = memory.mediaPath.split('.').pop().toLowerCase();
         if (['mp4', 'mov', 'webm'].includes(ext)) {
-            mediaHtml = `<div class="item-media"><video src="${memory.mediaPath}" controls></video></div>`;
+            mediaHtml = `<div class="item-media"><video src="${memory.mediaPath}" poster="${thumbUrl(memory.mediaPath, 640)}" preload="none" controls></video></div>`;
         } else {
-            mediaHtml = `<div class="item-media"><img src="${memory.mediaPath}" alt="Memory"></div>`;
+            mediaHtml = `<div class="item-media"><img src="${thumbUrl(memory.mediaPath, 640)}" alt="Memory" loading="lazy"></div>`;
         }
     }
 
@@ -1106,14 +1194,11 @@ async function saveMemory() {
         source: id ? (memories.find(m => m.id === id)?.source || 'manual') : 'manual'
     };
 
-    if (id) {
-        const index = memories.findIndex(m => m.id === id);
-        if (index !== -1) memories[index] = newMemory;
-    } else {
-        memories.push(newMemory);
+    try {
+        await syncItem('memories', memories, id, newMemory);
+    } catch (error) {
+        console.error('Error saving memory:', error);
     }
-
-    await syncMemories();
     closeMemoryModal();
     renderMemories();
 }
@@ -1122,8 +1207,11 @@ function deleteMemory(id) {
     const memory = memories.find(m => m.id === id);
     const label = memory ? `"${memory.title || 'this memory'}"` : 'this memory';
     openDeleteEntryModal(label, async () => {
-        memories = memories.filter(m => m.id !== id);
-        await syncMemories();
+        try {
+            await syncItem('memories', memories, id, null);
+        } catch (error) {
+            console.error('Error deleting memory:', error);
+        }
         renderMemories();
         showToast(t('msg_deleted', currentAppLang), 'info');
     });
@@ -1133,18 +1221,6 @@ function editMemory(id) {
     openMemoryModal(id);
 }
 
-async function syncMemories() {
-    try {
-        await fetch('/api/memories', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(memories)
-        });
-    } catch (error) {
-        console.error('Error syncing memories:', error);
-    }
-}
-
 // ===================================
 // FAMILY MODULE
 // ===================================
@@ -1182,7 +1258,7 @@ function createFamilyBox(member) {
 
     const photoUrl = member.photo || '';
     const photoHtml = photoUrl
-        ? `<img src="${photoUrl}" alt="${escapeHtml(member.name)}" class="family-photo">`
+        ? `<img src="${thumbUrl(photoUrl, 160)}" alt="${escapeHtml(member.name)}" class="family-photo" loading="lazy">`
         : `<div class="family-photo placeholder">👤</div>`;
 
     box.innerHTML = `
@@ -1334,14 +1410,11 @@ async function saveFamily() {
         importantDates
     };
 
-    if (id) {
-        const index = family.findIndex(f => f.id === id);
-        if (index !== -1) family[index] = newMember;
-    } else {
-        family.push(newMember);
+    try {
+        await syncItem('family', family, id, newMember);
+    } catch (error) {
+        console.error('Error saving family member:', error);
     }
-
-    await syncFamily();
     closeFamilyModal();
     renderFamily();
 }
@@ -1350,8 +1423,11 @@ function deleteFamily(id) {
     const member = family.find(f => f.id === id);
     const label = member ? `"${member.name || 'this family member'}"` : 'this family member';
     openDeleteEntryModal(label, async () => {
-        family = family.filter(f => f.id !== id);
-        await syncFamily();
+        try {
+            await syncItem('family', family, id, null);
+        } catch (error) {
+            console.error('Error deleting family member:', error);
+        }
         renderFamily();
         showToast(t('msg_deleted', currentAppLang), 'info');
     });
@@ -1361,18 +1437,6 @@ function editFamily(id) {
     openFamilyModal(id);
 }
 
-async function syncFamily() {
-    try {
-        await fetch('/api/family', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(family)
-        });
-    } catch (error) {
-        console.error('Error syncing family:', error);
-    }
-}
-
 // ===================================
 // CHAT MODULE
 // ===================================
@@ -1461,44 +1525,34 @@ async function sendMessage() {
     input.value = '';
 
     try {
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ message })
-        });
-
-        if (!response.ok) {
-            throw new Error('Failed to get response');
-        }
-
-        const data = await response.json();
-
-        // Store the user chat message ID so it can be used as chatRef if the user
-        // confirms saving a memory derived from this conversation exchange.
-        if (data.chat_message_id) {
-            lastChatMessageId = data.chat_message_id;
+        // Prefer the streaming endpoint so the reply appears word by word;
+        // fall back to the buffered endpoint if streaming is unavailable.
+        let data = null;
+        try {
+            data = await streamChatResponse(message);
+        } catch (streamError) {
+            console.warn('Streaming chat failed, falling back:', streamError);
         }
 
-        setTimeout(() => {
-            addChatMessage(data.message, 'ai');
+        if (data) {
+            handleChatResult(data);
+        } else {
+            const response = await fetch('/api/chat', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ message })
+            });
 
-            // Show a subtle indicator in chat when the AI resurfaces a stored memory
-            if (data.memory_actions && data.memory_actions.surfaced_memory) {
-                addMemorySurfacedIndicator(data.memory_actions.surfaced_memory, data.memory_actions.surfacing_mode);
+            if (!response.ok) {
+                throw new Error('Failed to get response');
             }
 
-            // Double Mention Rule: AI detected a repeated topic and suggests saving it
-            if (data.memory_to_confirm && data.memory_to_confirm.title) {
-                // Small delay so the AI message is visible first before the modal appears
-                setTimeout(() => openMemoryConfirmModal(data.memory_to_confirm), 800);
-            } else if (data.extracted_data && data.extracted_data.memories && data.extracted_data.memories.length > 0) {
-                // Fallback: extracted memories from AI (legacy path)
-                const memory = data.extracted_data.memories[0];
-                if (typeof memory === 'object' && memory.title) {
-                    setTimeout(() => openMemoryConfirmModal(memory), 800);
-                }
-            }
-        }, 500);
+            data = await response.json();
+            setTimeout(() => {
+                addChatMessage(data.message, 'ai');
+                handleChatResult(data);
+            }, 500);
+        }
 
     } catch (error) {
         console.error('Error:', error);
@@ -1512,6 +1566,144 @@ async function sendMessage() {
     }
 }
 
+/**
+ * Read /api/chat/stream (Server-Sent Events) and render the AI reply as it arrives.
+ * Resolves with the final `done` payload, or null if the browser cannot stream
+ * (in which case nothing has been rendered yet).
+ */
+async function streamChatResponse(message) {
+    const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message })
+    });
+
+    if (!response.ok || !response.body || !window.TextDecoder) {
+        return null;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let messageText = null;
+    let streamedText = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let eventData = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+            });
+            if (!eventData) continue;
+            const payload = JSON.parse(eventData);
+
+            if (eventName === 'token') {
+                streamedText += payload.text;
+                if (!messageText) {
+                    messageText = addChatMessage(streamedText, 'ai');
+                } else {
+                    messageText.textContent = streamedText;
+                    const messagesContainer = document.getElementById('chat-messages');
+                    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                }
+            } else if (eventName === 'done') {
+                // The final message is authoritative (e.g. if the model skipped the JSON envelope)
+                if (!messageText) {
+                    addChatMessage(payload.message, 'ai');
+                } else {
+                    messageText.textContent = payload.message;
+                }
+                return payload;
+            } else if (eventName === 'error') {
+                if (messageText) {
+                    messageText.textContent = 'Sorry, I encountered an error. Please try again.';
+                    return { message: messageText.textContent };
+                }
+                throw new Error(payload.error || 'Streaming error');
+            }
+        }
+    }
+    if (messageText) {
+        // Connection dropped after part of the reply was shown; keep what we have
+        return { message: streamedText };
+    }
+    throw new Error('Stream ended unexpectedly');
+}
+
+/**
+ * Apply the non-text parts of a chat reply: surfaced memory indicator and
+ * the Double Mention memory confirmation.
+ */
+function handleChatResult(data) {
+    // Store the user chat message ID so it can be used as chatRef if the user
+    // confirms saving a memory derived from this conversation exchange.
+    if (data.chat_message_id) {
+        lastChatMessageId = data.chat_message_id;
+    }
+
+    // Show a subtle indicator in chat when the AI resurfaces a stored memory
+    if (data.memory_actions && data.memory_actions.surfaced_memory) {
+        addMemorySurfacedIndicator(data.memory_actions.surfaced_memory, data.memory_actions.surfacing_mode);
+    }
+
+    // Extraction runs after the reply; its result (and any memory to confirm) arrives later
+    if (data.extraction_pending && data.extraction_id) {
+        pollExtraction(data.extraction_id);
+        return;
+    }
+    handleExtraction(data);
+}
+
+/**
+ * Long-poll /api/extractions/<id> until the background extraction for a turn
+ * has finished, then apply its result.
+ */
+async function pollExtraction(extractionId, attempts = 3) {
+    for (let i = 0; i < attempts; i++) {
+        try {
+            const response = await fetch(`/api/extractions/${encodeURIComponent(extractionId)}?wait=20`);
+            if (!response.ok) return;
+            const result = await response.json();
+            if (result.status === 'done') {
+                handleExtraction(result);
+                return;
+            }
+            if (result.status === 'error') return;
+        } catch (error) {
+            console.warn('Extraction poll failed:', error);
+            return;
+        }
+    }
+}
+
+/**
+ * Apply a turn's extraction result: the Double Mention memory confirmation.
+ */
+function handleExtraction(data) {
+    // Double Mention Rule: AI detected a repeated topic and suggests saving it
+    if (data.memory_to_confirm && data.memory_to_confirm.title) {
+        // Small delay so the AI message is visible first before the modal appears
+        setTimeout(() => openMemoryConfirmModal(data.memory_to_confirm), 800);
+    } else if (data.extracted_data && data.extracted_data.memories && data.extracted_data.memories.length > 0) {
+        // Fallback: extracted memories from AI (legacy path)
+        const memory = data.extracted_data.memories[0];
+        if (typeof memory === 'object' && memory.title) {
+            setTimeout(() => openMemoryConfirmModal(memory), 800);
+        }
+    }
+}
+
 function addChatMessage(text, sender) {
     const messagesContainer = document.getElementById('chat-messages');
     const messageDiv = document.createElement('div');
@@ -1539,6 +1731,7 @@ function addChatMessage(text, sender) {
 
     messagesContainer.appendChild(messageDiv);
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageText;
 }
 
 /**
@@ -1617,16 +1810,14 @@ async function confirmSaveMemory(memory) {
             // Add saved memory to local state
             memories.push(data.memory);
         } else {
-            // Fallback: add locally and sync via generic endpoint
-            memories.push({
-                id: generateUUID(),
+            // Fallback: create it through the generic item endpoint
+            await syncItem('memories', memories, null, {
                 title: memory.title,
                 date: memory.date || new Date().toISOString().split('T')[0],
                 description: memory.description || '',
                 source: 'chat',
                 chatRef: lastChatMessageId
             });
-            await syncMemories();
         }
     } catch (err) {
         console.error('Error saving chat-derived memory:', err);
@@ -2154,17 +2345,11 @@ async function saveNoteFromEditor() {
 
     try {
         if (id) {
-            // EDIT: update locally then bulk-sync
-            const idx = notes.findIndex(n => n.id === id);
-            if (idx !== -1) {
-                notes[idx] = { ...notes[idx], title, content };
+            // EDIT: send only the changed fields
+            const note = notes.find(n => n.id === id);
+            if (await syncItem('notes', notes, id, { ...note, title, content })) {
+                showToast('Note updated!', 'success');
             }
-            await fetch('/api/notes', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(notes)   // bulk replace
-            });
-            showToast('Note updated!', 'success');
         } else {
             // CREATE
             const resp = await fetch('/api/notes', {
@@ -2191,14 +2376,10 @@ function deleteNote(noteId) {
     const note = notes.find(n => n.id === noteId);
     const label = note ? `"${note.title || 'Untitled Note'}"` : 'this note';
     openDeleteEntryModal(label, async () => {
-        notes = notes.filter(n => n.id !== noteId);
         try {
-            await fetch('/api/notes', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(notes)   // bulk replace
-            });
-            showToast('Note deleted.', 'info');
+            if (await syncItem('notes', notes, noteId, null)) {
+                showToast('Note deleted.', 'info');
+            }
         } catch (e) {
             console.error('Error deleting note:', e);
         }
@@ -0,0 +1,254 @@
+"""
+Full-text search over chat messages, memories and notes (SQLite FTS5).
+
+Each kind has its own FTS5 table in a separate database file, maintained
+incrementally:
+
+    chat        append-only; new messages are added as they are logged and a
+                rewrite of the history (save-chat) re-syncs the chat table
+    memories,   diffed by content hash per record when the collection's
+    notes       storage stamp changes, so a save touches only changed rows
+
+Queries match whole terms, with the last term as a prefix so results follow
+the user's typing ("lake hou" finds "lake house"). Matches are ranked with
+bm25 (titles weigh more). For very common terms only the most recent
+RANK_WINDOW matches of a kind are ranked, which keeps a query over 100k chat
+messages to a few milliseconds. Snippets are cut from the stored text.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+KINDS = ('chat', 'memories', 'notes')
+RANK_WINDOW = 2000
+SNIPPET_WORDS = 14
+STEM_MIN_LENGTH = 3  # terms this short only match whole words
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS fts_{kind} USING fts5(
+    title, body, tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3 4'
+);
+"""
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doc_meta (
+    kind TEXT NOT NULL, doc_id TEXT NOT NULL, fts_rowid INTEGER NOT NULL,
+    date TEXT, hash TEXT NOT NULL,
+    PRIMARY KEY (kind, doc_id)
+);
+CREATE INDEX IF NOT EXISTS doc_meta_rowid ON doc_meta(kind, fts_rowid);
+CREATE TABLE IF NOT EXISTS sync_state (kind TEXT PRIMARY KEY, stamp TEXT, count INTEGER);
+"""
+
+# bm25 column weights: title, body
+BM25_WEIGHTS = '4.0, 1.0'
+
+
+def fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE t USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def query_terms(query):
+    return TERM_RE.findall(query.lower())
+
+
+def build_match(terms):
+    """FTS5 MATCH expression: quoted terms, the last one as a prefix"""
+    if not terms:
+        return ''
+    return ' '.join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def _stem(term):
+    """Drop one plural 's'; None for terms too short to stem (matched whole only)"""
+    if len(term) <= STEM_MIN_LENGTH:
+        return None
+    return term[:-1] if term.endswith('s') else term
+
+
+def _term_matches(word, terms):
+    """Whole-term match (allowing a stemmed plural), or a prefix match for the last term"""
+    word = word.lower()
+    for term in terms[:-1]:
+        stem = _stem(term)
+        if word == term or (stem and word.startswith(stem)):
+            return True
+    return bool(terms and terms[-1]) and word.startswith(terms[-1])
+
+
+def make_snippet(text, terms, words=SNIPPET_WORDS):
+    """A window of text around the first matching word, with matches in [brackets]"""
+    tokens = text.split()
+    hits = [i for i, tok in enumerate(tokens) if _term_matches(tok.strip('.,!?;:"\'()[]'), terms)]
+    start = max(0, hits[0] - words // 3) if hits else 0
+    window = tokens[start:start + words]
+    marked = [f"[{tok}]" if start + i in hits else tok for i, tok in enumerate(window)]
+    return ('…' if start > 0 else '') + ' '.join(marked) + ('…' if start + words < len(tokens) else '')
+
+
+def _hash(title, body, date):
+    return hashlib.sha1(f"{title}\0{body}\0{date}".encode('utf-8')).hexdigest()
+
+
+class SearchIndex:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.queries = 0
+        self.indexed = 0
+        self.last_query_ms = None
+        with self._write_lock:
+            conn = self._conn()
+            conn.executescript(META_SCHEMA)
+            for kind in KINDS:
+                conn.executescript(FTS_SCHEMA.format(kind=kind))
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------------------------------
+    # Maintenance
+    # -------------------------------------------------------
+    def _insert(self, conn, kind, doc_id, date, title, body, digest):
+        cursor = conn.execute(f'INSERT INTO fts_{kind} (title, body) VALUES (?, ?)', (title, body))
+        conn.execute('INSERT OR REPLACE INTO doc_meta (kind, doc_id, fts_rowid, date, hash) VALUES (?, ?, ?, ?, ?)',
+                     (kind, doc_id, cursor.lastrowid, date, digest))
+
+    def _delete(self, conn, kind, doc_id):
+        """Remove a document; True if it was indexed"""
+        row = conn.execute('SELECT fts_rowid FROM doc_meta WHERE kind = ? AND doc_id = ?',
+                           (kind, doc_id)).fetchone()
+        if row:
+            conn.execute(f'DELETE FROM fts_{kind} WHERE rowid = ?', (row[0],))
+            conn.execute('DELETE FROM doc_meta WHERE kind = ? AND doc_id = ?', (kind, doc_id))
+        return row is not None
+
+    def _state(self, conn, kind):
+        row = conn.execute('SELECT stamp, count FROM sync_state WHERE kind = ?', (kind,)).fetchone()
+        return row if row else (None, 0)
+
+    def _set_state(self, conn, kind, stamp, count):
+        conn.execute('INSERT OR REPLACE INTO sync_state (kind, stamp, count) VALUES (?, ?, ?)',
+                     (kind, None if stamp is None else str(stamp), count))
+
+    def sync(self, kind, stamp, records):
+        """
+        Make one kind match records [(doc_id, date, title, body)] unless the
+        stored stamp is unchanged. records may be a callable (only called when needed).
+        Returns the number of rows added, changed or removed.
+        """
+        with self._write_lock:
+            conn = self._conn()
+            if stamp is not None and self._state(conn, kind)[0] == str(stamp):
+                return 0
+            if callable(records):
+                records = records()
+            existing = dict(conn.execute('SELECT doc_id, hash FROM doc_meta WHERE kind = ?', (kind,)))
+            changed = 0
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                seen = set()
+                for doc_id, date, title, body in records:
+                    doc_id = str(doc_id)
+                    seen.add(doc_id)
+                    digest = _hash(title, body, date)
+                    if existing.get(doc_id) == digest:
+                        continue
+                    self._delete(conn, kind, doc_id)
+                    self._insert(conn, kind, doc_id, date, title, body, digest)
+                    changed += 1
+                for doc_id in set(existing) - seen:
+                    self._delete(conn, kind, doc_id)
+                    changed += 1
+                self._set_state(conn, kind, stamp, len(seen))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.indexed += changed
+            return changed
+
+    def append(self, kind, records):
+        """Add records to an append-only kind (chat) without diffing the rest"""
+        records = list(records)
+        if not records:
+            return
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                added = 0
+                for doc_id, date, title, body in records:
+                    # A doc_id already indexed is replaced, not counted again
+                    if not self._delete(conn, kind, str(doc_id)):
+                        added += 1
+                    self._insert(conn, kind, str(doc_id), date, title, body, _hash(title, body, date))
+                stamp, count = self._state(conn, kind)
+                self._set_state(conn, kind, stamp, count + added)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.indexed += len(records)
+
+    def count(self, kind):
+        with self._write_lock:
+            return self._state(self._conn(), kind)[1]
+
+    # -------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------
+    def _rank(self, conn, kind, match, limit):
+        """[(score, rowid)] best first, among the latest RANK_WINDOW matches"""
+        row = conn.execute(f'SELECT rowid FROM fts_{kind} WHERE fts_{kind} MATCH ?'
+                           f' ORDER BY rowid DESC LIMIT 1 OFFSET ?', (match, RANK_WINDOW - 1)).fetchone()
+        floor = row[0] if row else 0
+        return conn.execute(
+            f'SELECT bm25(fts_{kind}, {BM25_WEIGHTS}) AS score, rowid FROM fts_{kind}'
+            f' WHERE fts_{kind} MATCH ? AND rowid >= ? ORDER BY score LIMIT ?',
+            (match, floor, limit)
+        ).fetchall()
+
+    def search(self, query, kinds=None, limit=20, offset=0):
+        """Ranked matches: [{'kind', 'id', 'date', 'title', 'snippet', 'score'}]"""
+        terms = query_terms(query)
+        match = build_match(terms)
+        if not match:
+            return []
+        started = time.perf_counter()
+        conn = self._conn()
+        ranked = []
+        for kind in (kinds or KINDS):
+            ranked.extend((score, kind, rowid) for score, rowid in self._rank(conn, kind, match, offset + limit))
+        ranked.sort()
+        results = []
+        for score, kind, rowid in ranked[offset:offset + limit]:
+            title, body = conn.execute(f'SELECT title, body FROM fts_{kind} WHERE rowid = ?', (rowid,)).fetchone()
+            meta = conn.execute('SELECT doc_id, date FROM doc_meta WHERE kind = ? AND fts_rowid = ?',
+                                (kind, rowid)).fetchone() or (None, None)
+            results.append({
+                'kind': kind, 'id': meta[0], 'date': meta[1],
+                'title': title, 'snippet': make_snippet(body, terms), 'score': round(-score, 4),
+            })
+        self.queries += 1
+        self.last_query_ms = round((time.perf_counter() - started) * 1000, 3)
+        return results
+
+    def stats(self):
+        conn = self._conn()
+        counts = dict(conn.execute('SELECT kind, COUNT(*) FROM doc_meta GROUP BY kind'))
+        return {'documents': counts, 'queries': self.queries, 'indexed': self.indexed,
+                'rank_window': RANK_WINDOW, 'last_query_ms': self.last_query_ms}
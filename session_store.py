@@ -0,0 +1,325 @@
+"""
+Bounded in-memory store for per-session state (conversation windows, the
+Double Mention tracker).
+
+Entries are evicted least-recently-used once max_entries is reached, and
+after ttl_seconds without access. With a spill_db, evicted entries are
+written to SQLite and transparently rehydrated the next time that session
+is used. Spilled rows older than spill_ttl_seconds are purged periodically,
+and beyond spill_max_rows the least recently written ones are dropped, so
+the database stays bounded however many session ids clients invent.
+
+With shared=True (several worker processes) the database is the source of
+truth instead: every write goes through to it, and every read compares the
+row's version with the cached one, so a session continues on whichever
+worker its next request lands on and memory only saves re-parsing. Values
+modified in place must then be written back with save(key). Two requests
+for the same session on different workers at the same moment: the last
+write wins. update(key, fn) instead re-applies fn to the latest stored value
+until its write is not overtaken (for changes made in the background).
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _identity(value):
+    return value
+
+
+class SessionStore:
+    def __init__(self, name, max_entries=500, ttl_seconds=2 * 3600, spill_db=None,
+                 spill_ttl_seconds=7 * 24 * 3600, spill_max_rows=20000, serialize=_identity,
+                 deserialize=_identity, shared=False):
+        if shared and not spill_db:
+            raise ValueError("a shared session store needs a spill_db")
+        self.name = name
+        self.shared = shared
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.spill_db = spill_db
+        self.spill_ttl_seconds = spill_ttl_seconds
+        self.spill_max_rows = spill_max_rows
+        self.serialize = serialize
+        self.deserialize = deserialize
+
+        self._entries = OrderedDict()  # key -> (last_access, value), oldest first
+        self._versions = {}            # shared: key -> version of the cached value
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self.evictions = 0
+        self.expirations = 0
+        self.rehydrations = 0
+        self.spill_writes = 0
+        self.shared_reloads = 0
+        self.spill_trimmed = 0
+        self._spill_rows = 0           # estimate of this store's rows, recounted by _trim_spill
+        self._last_sweep = time.monotonic()
+        self._last_trim = time.monotonic()
+
+        if spill_db:
+            conn = self._conn()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                ' store TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL,'
+                ' version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (store, key))'
+            )
+            if 'version' not in [row[1] for row in conn.execute('PRAGMA table_info(sessions)')]:
+                try:
+                    conn.execute('ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+                except sqlite3.OperationalError:
+                    pass  # another worker added it first
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated)')
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_store_updated ON sessions(store, updated)')
+            self._trim_spill()
+
+    # -------------------------------------------------------
+    # Spill storage
+    # -------------------------------------------------------
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.spill_db, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _spill(self, key, value):
+        if not self.spill_db or self.shared:
+            return
+        try:
+            self._conn().execute(
+                'INSERT OR REPLACE INTO sessions (store, key, data, updated) VALUES (?, ?, ?, ?)',
+                (self.name, key, json.dumps(self.serialize(value)), time.time())
+            )
+            self.spill_writes += 1
+            self._row_added()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Could not spill session {key} from {self.name}: {e}")
+
+    def _row_added(self):
+        self._spill_rows += 1
+        if self._spill_rows > self.spill_max_rows:
+            self._trim_spill()
+
+    def _trim_spill(self):
+        """Purge expired rows, then the least recently written beyond spill_max_rows"""
+        conn = self._conn()
+        cursor = conn.execute('DELETE FROM sessions WHERE store = ? AND updated < ?',
+                              (self.name, time.time() - self.spill_ttl_seconds))
+        trimmed = cursor.rowcount
+        cursor = conn.execute(
+            'DELETE FROM sessions WHERE store = ? AND key IN (SELECT key FROM sessions WHERE store = ?'
+            ' ORDER BY updated DESC LIMIT -1 OFFSET ?)', (self.name, self.name, self.spill_max_rows)
+        )
+        self.spill_trimmed += trimmed + cursor.rowcount
+        self._spill_rows = conn.execute('SELECT COUNT(*) FROM sessions WHERE store = ?', (self.name,)).fetchone()[0]
+        self._last_trim = time.monotonic()
+
+    def _rehydrate(self, key):
+        if not self.spill_db:
+            return None
+        row = self._conn().execute(
+            'SELECT data FROM sessions WHERE store = ? AND key = ?', (self.name, key)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn().execute('DELETE FROM sessions WHERE store = ? AND key = ?', (self.name, key))
+        self.rehydrations += 1
+        return self.deserialize(json.loads(row[0]))
+
+    # -------------------------------------------------------
+    # Shared storage
+    # -------------------------------------------------------
+    def _write_through(self, key, value):
+        rows = self._conn().execute(
+            'INSERT INTO sessions (store, key, data, updated, version) VALUES (?, ?, ?, ?, 1)'
+            ' ON CONFLICT(store, key) DO UPDATE SET data = excluded.data, updated = excluded.updated,'
+            ' version = version + 1 RETURNING version',
+            (self.name, key, json.dumps(self.serialize(value)), time.time())
+        ).fetchall()
+        self._versions[key] = rows[0][0]
+        if rows[0][0] == 1:
+            self._row_added()
+
+    def _write_if_version(self, key, value, version):
+        """Write only if the row is still at version; False if another worker wrote first"""
+        rows = self._conn().execute(
+            'UPDATE sessions SET data = ?, updated = ?, version = version + 1'
+            ' WHERE store = ? AND key = ? AND version = ? RETURNING version',
+            (json.dumps(self.serialize(value)), time.time(), self.name, key, version)
+        ).fetchall()
+        if not rows:
+            return False
+        self._versions[key] = rows[0][0]
+        return True
+
+    def _get_shared(self, key, default):
+        with self._lock:
+            entry = self._entries.get(key)
+            cached_version = self._versions.get(key, -1) if entry is not None else -1
+            # The row's data is only fetched when it differs from the cached value
+            row = self._conn().execute(
+                'SELECT version, CASE WHEN version = ? THEN NULL ELSE data END FROM sessions'
+                ' WHERE store = ? AND key = ?', (cached_version, self.name, key)
+            ).fetchone()
+            if row is None:
+                if entry is not None:
+                    del self._entries[key]
+                    self._versions.pop(key, None)
+                return default
+            version, data = row
+            if data is None:
+                value = entry[1]
+            else:
+                value = self.deserialize(json.loads(data))
+                self._versions[key] = version
+                self.shared_reloads += 1
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            self._maintain()
+            return value
+
+    def save(self, key):
+        """Write back an entry that was modified in place (only needed when shared)"""
+        if not self.shared:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._write_through(key, entry[1])
+
+    def update(self, key, fn, attempts=5):
+        """
+        Apply fn(value) to the latest value of key and store the result; fn
+        returns False to leave it unchanged. When shared, fn is re-applied to
+        the newer value if another worker writes in between. Returns whether
+        the change was stored.
+        """
+        for _ in range(attempts):
+            with self._lock:
+                value = self.get(key)
+                if value is None or fn(value) is False:
+                    return False
+                if not self.shared or self._write_if_version(key, value, self._versions.get(key)):
+                    return True
+                # Overtaken: drop the modified copy so the next get() reloads the row
+                self._entries.pop(key, None)
+                self._versions.pop(key, None)
+        return False
+
+    # -------------------------------------------------------
+    # Eviction
+    # -------------------------------------------------------
+    def _evict_oldest(self):
+        key, (_, value) = self._entries.popitem(last=False)
+        self._versions.pop(key, None)
+        self.evictions += 1
+        self._spill(key, value)
+
+    def _sweep_expired(self, now):
+        """Drop entries idle past the TTL; entries are in access order so stop at the first live one"""
+        self._last_sweep = now
+        while self._entries:
+            key, (last_access, value) = next(iter(self._entries.items()))
+            if now - last_access < self.ttl_seconds:
+                break
+            del self._entries[key]
+            self._versions.pop(key, None)
+            self.expirations += 1
+            self._spill(key, value)
+
+    def _maintain(self):
+        now = time.monotonic()
+        if now - self._last_sweep > min(60, self.ttl_seconds):
+            self._sweep_expired(now)
+        if self.spill_db and now - self._last_trim > min(3600, self.spill_ttl_seconds):
+            self._trim_spill()
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest()
+
+    # -------------------------------------------------------
+    # Mapping interface
+    # -------------------------------------------------------
+    def get(self, key, default=None):
+        if self.shared:
+            return self._get_shared(key, default)
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now - entry[0] >= self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self._spill(key, entry[1])
+                entry = None
+            if entry is None:
+                value = self._rehydrate(key)
+                if value is None:
+                    return default
+                self._entries[key] = (now, value)
+                self._maintain()
+                return value
+            self._entries[key] = (now, entry[1])
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if self.shared:
+                self._write_through(key, value)
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            self._maintain()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            self._versions.pop(key, None)
+            if self.spill_db:
+                self._conn().execute('DELETE FROM sessions WHERE store = ? AND key = ?', (self.name, key))
+            return entry[1] if entry else default
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            self._sweep_expired(time.monotonic())
+            values = [v for _, v in self._entries.values()]
+        bytes_held = 0
+        for value in values:
+            try:
+                bytes_held += len(json.dumps(self.serialize(value)))
+            except (TypeError, ValueError):
+                pass
+        result = {
+            'live_sessions': len(values),
+            'bytes_held': bytes_held,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'rehydrations': self.rehydrations,
+            'spill_writes': self.spill_writes,
+            'spill_trimmed': self.spill_trimmed,
+            'spill_max_rows': self.spill_max_rows,
+            'shared': self.shared,
+        }
+        if self.spill_db:
+            row = self._conn().execute('SELECT COUNT(*) FROM sessions WHERE store = ?', (self.name,)).fetchone()
+            result['stored_sessions' if self.shared else 'spilled_sessions'] = row[0]
+        if self.shared:
+            result['shared_reloads'] = self.shared_reloads
+        return result
@@ -0,0 +1,153 @@
+"""
+Fingerprinted, precompressed serving of the front-end files.
+
+At startup every top-level .js/.css file is hashed and given a fingerprinted
+URL (script.js -> /script.1a2b3c4d5e.js). HTML pages have their local
+script/stylesheet references rewritten to those URLs. Every file is held in
+memory as identity, gzip and (when the optional `brotli` package is
+installed) brotli bodies, and served with a strong ETag per encoding.
+
+Fingerprinted URLs are cached for a year as immutable; HTML and plain
+asset names are revalidated (no-cache + ETag), so a repeat visit costs a few
+304s and no asset bytes. The manifest is built once at startup; with
+reload=True (development) files edited on disk are picked up on the next
+request, at the cost of a directory scan and a stat per file per request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response
+
+from file_cache import file_stamp
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_EXTENSIONS = ('.js', '.css')
+HTML_EXTENSIONS = ('.html',)
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+MIN_COMPRESS_BYTES = 512
+
+# src="script.js?v=3" / href="style.css" -- local references only
+REFERENCE_RE = re.compile(r'\b(src|href)="/?([\w.-]+\.(?:js|css))(?:\?[^"#]*)?"')
+
+
+def _compress(body):
+    variants = {'identity': body}
+    if len(body) < MIN_COMPRESS_BYTES:
+        return variants
+    variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=11)
+    return variants
+
+
+class StaticAssets:
+    def __init__(self, root, reload=False):
+        self.root = root
+        self.reload = reload
+        self.assets = {}       # request path -> entry
+        self.stamps = {}       # source filename -> file stamp
+        self._lock = threading.Lock()
+        self.rebuild()
+
+    # -------------------------------------------------------
+    # Build
+    # -------------------------------------------------------
+    def _scan(self):
+        names = sorted(os.listdir(self.root))
+        return [n for n in names if n.endswith(ASSET_EXTENSIONS + HTML_EXTENSIONS)
+                and os.path.isfile(os.path.join(self.root, n))]
+
+    def _entry(self, name, body, digest, cache_control):
+        return {
+            'name': name,
+            'etag': digest,
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'variants': _compress(body),
+            'cache_control': cache_control,
+        }
+
+    def rebuild(self):
+        assets = {}
+        stamps = {}
+        urls = {}
+        names = self._scan()
+        for name in names:
+            stamps[name] = file_stamp(os.path.join(self.root, name))
+        for name in names:
+            if not name.endswith(ASSET_EXTENSIONS):
+                continue
+            with open(os.path.join(self.root, name), 'rb') as f:
+                body = f.read()
+            digest = hashlib.sha256(body).hexdigest()[:10]
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{digest}{ext}"
+            urls[name] = '/' + fingerprinted
+            assets[fingerprinted] = self._entry(name, body, digest, IMMUTABLE)
+            assets[name] = self._entry(name, body, digest, REVALIDATE)
+        for name in names:
+            if not name.endswith(HTML_EXTENSIONS):
+                continue
+            with open(os.path.join(self.root, name), 'r', encoding='utf-8') as f:
+                html = f.read()
+            html = REFERENCE_RE.sub(
+                lambda m: f'{m.group(1)}="{urls[m.group(2)]}"' if m.group(2) in urls else m.group(0),
+                html
+            )
+            body = html.encode('utf-8')
+            assets[name] = self._entry(name, body, hashlib.sha256(body).hexdigest()[:10], REVALIDATE)
+        with self._lock:
+            self.assets = assets
+            self.stamps = stamps
+            self.urls = urls
+
+    def _check_fresh(self):
+        """Rebuild if any source file was edited, added or removed"""
+        names = self._scan()
+        if names != sorted(self.stamps) or any(
+                file_stamp(os.path.join(self.root, n)) != self.stamps.get(n) for n in names):
+            self.rebuild()
+
+    # -------------------------------------------------------
+    # Serving
+    # -------------------------------------------------------
+    def url_for(self, name):
+        """Fingerprinted URL of a source file (the plain path if it is not an asset)"""
+        return self.urls.get(name, '/' + name)
+
+    def response(self, path, request):
+        """Response for path (HTML page or asset), or None if it is not one of ours"""
+        if self.reload:
+            self._check_fresh()
+        entry = self.assets.get(path)
+        if entry is None:
+            return None
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in entry['variants'] and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+        response = Response(entry['variants'][encoding], mimetype=entry['mimetype'])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = entry['cache_control']
+        response.set_etag(entry['etag'] if encoding == 'identity' else f"{entry['etag']}-{encoding}")
+        return response.make_conditional(request)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'assets': {name: url for name, url in self.urls.items()},
+                'brotli': brotli is not None,
+                'bytes': {path: {enc: len(body) for enc, body in entry['variants'].items()}
+                          for path, entry in self.assets.items() if path == entry['name']},
+            }
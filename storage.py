@@ -0,0 +1,415 @@
+"""
+Storage backends for the per-user data (profile, memories, routines, family,
+notes and chat history).
+
+JsonBackend keeps the original one-file-per-collection layout, but writes go
+through a temp file + fsync + atomic rename under a per-collection lock
+(an inter-process file lock when several worker processes share the files).
+SqliteBackend stores the same data in a single WAL-mode database with one
+indexed table per collection and transactional writes.
+
+Both backends expose the same interface:
+    load(name) / save(name, value) / update(name, fn) / stamp(name)  (name may be 'chat')
+    append_chat(messages) / recent_chat(n) / all_chat() / replace_chat(messages)
+    chat_count() / chat_range(start, stop)  (messages by position in the log)
+
+Run `python storage.py import-json [db_file]` to copy the JSON files in the
+current directory into a SQLite database (default: $SQLITE_DB_FILE or aegis.db).
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+from chat_log import ChatLog
+from file_cache import file_stamp
+from file_lock import InterProcessLock
+
+COLLECTIONS = ('profile', 'memories', 'routines', 'family', 'notes')
+
+# Files of the JSON backend, relative to a tenant's data directory
+DATA_FILES = {
+    'memories': 'memories.json',
+    'profile': 'profile.json',
+    'routines': 'routines.json',
+    'family': 'family.json',
+    'notes': 'notes.json',
+}
+CHAT_LOG_DIR = 'chat_log'
+CHAT_FILE = 'chat.json'  # legacy single-file history, migrated into CHAT_LOG_DIR on first start
+DEFAULT_DB_FILE = 'aegis.db'
+
+
+def write_json_atomic(path, data, indent=2):
+    """Write JSON next to the target and rename it into place"""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, '.%s.%d.%d.tmp' % (os.path.basename(path), os.getpid(), threading.get_ident()))
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class JsonBackend:
+    kind = 'json'
+
+    def __init__(self, files, chat_log_dir, legacy_chat_file=None, interprocess=False):
+        # files: { collection_name: path }
+        self.files = dict(files)
+        if interprocess:
+            self._locks = {name: InterProcessLock(path + '.lock') for name, path in self.files.items()}
+        else:
+            self._locks = {name: threading.RLock() for name in self.files}
+        self.chat_log = ChatLog(chat_log_dir, legacy_file=legacy_chat_file, interprocess=interprocess)
+
+    def load(self, name):
+        """Return the parsed collection, or None if missing/unreadable"""
+        path = self.files[name]
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return None
+
+    def save(self, name, value):
+        with self._locks[name]:
+            write_json_atomic(self.files[name], value)
+
+    def update(self, name, fn):
+        """Load, apply fn, and save while holding the collection lock"""
+        with self._locks[name]:
+            value = fn(self.load(name))
+            self.save(name, value)
+            return value
+
+    def stamp(self, name):
+        if name == 'chat':
+            return self.chat_log.stamp()
+        return file_stamp(self.files[name])
+
+    # Chat history
+    def append_chat(self, messages):
+        self.chat_log.append(messages)
+
+    def recent_chat(self, n):
+        return self.chat_log.tail(n)
+
+    def all_chat(self):
+        return self.chat_log.read_all()
+
+    def chat_count(self):
+        return len(self.chat_log)
+
+    def chat_range(self, start, stop):
+        return self.chat_log.read_range(start, stop)
+
+    def replace_chat(self, messages):
+        self.chat_log.replace(messages)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memories (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    title TEXT,
+    date TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memories_id ON memories(id);
+CREATE INDEX IF NOT EXISTS memories_date ON memories(date);
+CREATE TABLE IF NOT EXISTS routines (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routines_id ON routines(id);
+CREATE TABLE IF NOT EXISTS family (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS family_id ON family(id);
+CREATE TABLE IF NOT EXISTS notes (
+    position INTEGER PRIMARY KEY,
+    id TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_id ON notes(id);
+CREATE INDEX IF NOT EXISTS notes_created_at ON notes(created_at);
+CREATE TABLE IF NOT EXISTS chat (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    timestamp TEXT,
+    sender TEXT,
+    content TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_id ON chat(id);
+CREATE INDEX IF NOT EXISTS chat_timestamp ON chat(timestamp);
+"""
+
+# Indexed columns pulled out of each list item: { table: (field, ...) }
+ITEM_COLUMNS = {
+    'memories': ('id', 'title', 'date'),
+    'routines': ('id', 'time'),
+    'family': ('id', 'name'),
+    'notes': ('id', 'created_at'),
+}
+
+
+class SqliteBackend:
+    kind = 'sqlite'
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        self.created = not os.path.exists(db_file)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        """Context manager for a write transaction that takes the lock up front"""
+        return _Transaction(self._conn())
+
+    # -------------------------------------------------------
+    # Collections
+    # -------------------------------------------------------
+    def _load_items(self, conn, table):
+        rows = conn.execute(f'SELECT data FROM {table} ORDER BY position').fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _save_items(self, conn, table, items):
+        columns = ITEM_COLUMNS[table]
+        conn.execute(f'DELETE FROM {table}')
+        placeholders = ', '.join('?' * (len(columns) + 2))
+        conn.executemany(
+            f'INSERT INTO {table} (position, {", ".join(columns)}, data) VALUES ({placeholders})',
+            [
+                (i,) + tuple(_column_value(item, c) for c in columns) + (json.dumps(item),)
+                for i, item in enumerate(items)
+            ]
+        )
+
+    def _get_document(self, conn, name):
+        row = conn.execute('SELECT data FROM documents WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_document(self, conn, name, value):
+        conn.execute('INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)', (name, json.dumps(value)))
+
+    def _bump(self, conn, name):
+        conn.execute(
+            'INSERT INTO versions (name, version) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+            (name,)
+        )
+
+    def _load(self, conn, name):
+        if name == 'profile':
+            return self._get_document(conn, 'profile')
+        if name == 'memories':
+            doc = self._get_document(conn, 'memories')
+            if doc is None:
+                return None
+            doc['memories'] = self._load_items(conn, 'memories')
+            return doc
+        if name == 'notes':
+            doc = self._get_document(conn, 'notes')
+            if doc is None:
+                return None
+            doc['notes'] = self._load_items(conn, 'notes')
+            return doc
+        if self._get_document(conn, name) is None:
+            return None
+        return self._load_items(conn, name)
+
+    def _save(self, conn, name, value):
+        if name == 'profile':
+            self._set_document(conn, 'profile', value)
+        elif name == 'memories':
+            doc = {k: v for k, v in value.items() if k != 'memories'}
+            self._set_document(conn, 'memories', doc)
+            self._save_items(conn, 'memories', value.get('memories') or [])
+        elif name == 'notes':
+            items = value.get('notes', []) if isinstance(value, dict) else value
+            doc = {k: v for k, v in value.items() if k != 'notes'} if isinstance(value, dict) else {}
+            self._set_document(conn, 'notes', doc)
+            self._save_items(conn, 'notes', items or [])
+        else:
+            # Marker row so an empty list is distinguishable from "never saved"
+            self._set_document(conn, name, {})
+            self._save_items(conn, name, value or [])
+        self._bump(conn, name)
+
+    def load(self, name):
+        return self._load(self._conn(), name)
+
+    def save(self, name, value):
+        with self._write() as conn:
+            self._save(conn, name, value)
+
+    def update(self, name, fn):
+        with self._write() as conn:
+            value = fn(self._load(conn, name))
+            self._save(conn, name, value)
+            return value
+
+    def stamp(self, name):
+        row = self._conn().execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    # -------------------------------------------------------
+    # Chat history
+    # -------------------------------------------------------
+    def _chat_rows(self, messages):
+        return [
+            (m.get('id'), m.get('timestamp'), m.get('sender'), m.get('content'), json.dumps(m))
+            for m in messages
+        ]
+
+    def append_chat(self, messages):
+        with self._write() as conn:
+            conn.executemany(
+                'INSERT INTO chat (id, timestamp, sender, content, data) VALUES (?, ?, ?, ?, ?)',
+                self._chat_rows(messages)
+            )
+            self._bump(conn, 'chat')
+
+    def recent_chat(self, n):
+        rows = self._conn().execute('SELECT data FROM chat ORDER BY seq DESC LIMIT ?', (n,)).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def all_chat(self):
+        rows = self._conn().execute('SELECT data FROM chat ORDER BY seq').fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def chat_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM chat').fetchone()[0]
+
+    def chat_range(self, start, stop):
+        if stop <= start:
+            return []
+        rows = self._conn().execute('SELECT data FROM chat ORDER BY seq LIMIT ? OFFSET ?',
+                                    (stop - start, start)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def replace_chat(self, messages):
+        with self._write() as conn:
+            conn.execute('DELETE FROM chat')
+            conn.executemany(
+                'INSERT INTO chat (id, timestamp, sender, content, data) VALUES (?, ?, ?, ?, ?)',
+                self._chat_rows(messages)
+            )
+            self._bump(conn, 'chat')
+
+    # -------------------------------------------------------
+    # Import
+    # -------------------------------------------------------
+    def import_from(self, source):
+        """Copy every collection and the chat history from another backend in one transaction"""
+        counts = {}
+        with self._write() as conn:
+            for name in COLLECTIONS:
+                value = source.load(name)
+                if value is None:
+                    continue
+                if name == 'routines' or name == 'family':
+                    if not isinstance(value, list):
+                        continue
+                    counts[name] = len(value)
+                elif name == 'memories':
+                    if isinstance(value, list):
+                        # The oldest memories.json held the bare list of memories
+                        value = {'memories': value}
+                    elif not isinstance(value, dict):
+                        continue
+                    counts[name] = len(value.get('memories') or [])
+                elif name == 'notes':
+                    if not isinstance(value, (dict, list)):
+                        continue
+                    counts[name] = len(value.get('notes', []) if isinstance(value, dict) else value)
+                self._save(conn, name, value)
+            chat = source.all_chat()
+            conn.execute('DELETE FROM chat')
+            conn.executemany(
+                'INSERT INTO chat (id, timestamp, sender, content, data) VALUES (?, ?, ?, ?, ?)',
+                self._chat_rows(chat)
+            )
+            self._bump(conn, 'chat')
+            counts['chat'] = len(chat)
+        return counts
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
+
+
+def _column_value(item, column):
+    value = item.get(column) if isinstance(item, dict) else None
+    return value if isinstance(value, (str, int, float)) or value is None else json.dumps(value)
+
+
+def open_storage(kind, files, chat_log_dir, legacy_chat_file=None, db_file=None, interprocess=False):
+    """
+    Create the configured backend; a new SQLite database is seeded from the
+    JSON files. interprocess: other worker processes write the same data
+    (SQLite coordinates that itself; the JSON backend takes file locks).
+    """
+    if kind == 'sqlite':
+        backend = SqliteBackend(db_file)
+        if backend.created:
+            counts = backend.import_from(JsonBackend(files, chat_log_dir, legacy_chat_file, interprocess))
+            print(f"Imported JSON data into {db_file}: {counts}")
+        return backend
+    if kind != 'json':
+        raise ValueError(f"Unknown storage backend: {kind}")
+    return JsonBackend(files, chat_log_dir, legacy_chat_file, interprocess)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'import-json':
+        print("Usage: python storage.py import-json [db_file]")
+        sys.exit(1)
+    target = SqliteBackend(sys.argv[2] if len(sys.argv) > 2 else os.environ.get('SQLITE_DB_FILE', DEFAULT_DB_FILE))
+    source = JsonBackend(DATA_FILES, CHAT_LOG_DIR, CHAT_FILE)
+    print(f"Imported: {target.import_from(source)}")
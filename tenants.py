@@ -0,0 +1,226 @@
+"""
+Per-tenant data partitions, so one server can host many people.
+
+Every tenant (the person being cared for) has its own data directory,
+<TENANTS_DIR>/<tenant id>/, with the same layout the app always used
+(memories.json, chat_log/, ... or aegis.db), plus its own storage locks,
+read cache, retrieval index and search database. Requests for different
+tenants therefore never wait on each other's files or locks. The "default"
+tenant keeps using the files in the working directory, so a single-user
+deployment is unchanged.
+
+Tenants are provisioned explicitly (provision(), or
+`python tenants.py create <id>`); an id without a data directory is
+unknown, unless the registry was made with auto_create=True. Ids are
+checked against TENANT_RE before any path is built from them.
+
+A request never names its tenant. Each provisioned tenant has an access
+token, "<tenant id>.<secret>", issued by issue_token() (`python tenants.py
+create <id>` or `token <id>` to replace it); only a SHA-256 of the secret
+is kept, in the tenant's directory. authenticate() maps a token back to its
+tenant. The tenant is then held in a context variable; background work
+(write queue, extraction jobs) carries the tenant id with it and re-enters
+it with use_tenant().
+
+    registry = TenantRegistry('tenants', open_partition, max_open=256)
+    token = registry.issue_token('alice')
+    with use_tenant(registry.authenticate(token)):
+        registry.current().storage.load('memories')
+"""
+import argparse
+import contextvars
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+DEFAULT_TENANT = 'default'
+TENANT_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+TOKEN_FILE = '.access_token'  # SHA-256 of the tenant's token secret
+
+_current = contextvars.ContextVar('tenant', default=DEFAULT_TENANT)
+
+
+class TenantError(ValueError):
+    pass
+
+
+class UnknownTenant(LookupError):
+    pass
+
+
+class InvalidToken(LookupError):
+    pass
+
+
+def _token_digest(secret):
+    return hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+
+def validate_tenant_id(tenant_id):
+    if not isinstance(tenant_id, str) or not TENANT_RE.match(tenant_id):
+        raise TenantError('Tenant id must be 1-64 letters, digits, "-" or "_"')
+    return tenant_id
+
+
+def current_tenant_id():
+    return _current.get()
+
+
+def set_current_tenant(tenant_id):
+    """Make tenant_id current for the rest of this context (one request)"""
+    return _current.set(validate_tenant_id(tenant_id))
+
+
+@contextmanager
+def use_tenant(tenant_id):
+    """Run a block (e.g. a background job) as tenant_id"""
+    token = _current.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def group_by_tenant(entries):
+    """[(tenant_id, payload)] -> OrderedDict tenant_id -> [payload], keeping order"""
+    groups = OrderedDict()
+    for tenant_id, payload in entries:
+        groups.setdefault(tenant_id, []).append(payload)
+    return groups
+
+
+class TenantRegistry:
+    """
+    Opens tenant partitions on first use and keeps the most recently used
+    max_open of them. A partition dropped from the LRU while still in use
+    (e.g. by a queued write) is re-adopted rather than opened twice, so each
+    tenant only ever has one set of locks.
+    """
+    def __init__(self, root, open_partition, max_open=256, auto_create=False):
+        self.root = root
+        self.open_partition = open_partition   # fn(tenant_id, data_dir) -> partition
+        self.max_open = max_open
+        self.auto_create = auto_create
+        self._open = OrderedDict()
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def data_dir(self, tenant_id):
+        if tenant_id == DEFAULT_TENANT:
+            return '.'
+        return os.path.join(self.root, tenant_id)
+
+    def exists(self, tenant_id):
+        return tenant_id == DEFAULT_TENANT or os.path.isdir(self.data_dir(validate_tenant_id(tenant_id)))
+
+    def provision(self, tenant_id):
+        """Create a tenant's data directory; returns True if it is new"""
+        if self.exists(tenant_id):
+            return False
+        os.makedirs(self.data_dir(tenant_id), exist_ok=True)
+        return True
+
+    def issue_token(self, tenant_id):
+        """New access token for a provisioned tenant; any earlier token stops working"""
+        if tenant_id == DEFAULT_TENANT:
+            raise TenantError('The default tenant is not reached with a token')
+        if not self.exists(tenant_id):
+            raise UnknownTenant(tenant_id)
+        secret = secrets.token_urlsafe(32)
+        path = os.path.join(self.data_dir(tenant_id), TOKEN_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(_token_digest(secret))
+        os.replace(tmp_path, path)
+        return f"{tenant_id}.{secret}"
+
+    def authenticate(self, token):
+        """Tenant id an access token was issued for; raises InvalidToken"""
+        tenant_id, _, secret = (token or '').partition('.')
+        if not secret or tenant_id == DEFAULT_TENANT or not TENANT_RE.match(tenant_id):
+            raise InvalidToken('Malformed access token')
+        try:
+            with open(os.path.join(self.data_dir(tenant_id), TOKEN_FILE), 'r') as f:
+                stored = f.read().strip()
+        except OSError:
+            raise InvalidToken('Invalid access token')
+        if not hmac.compare_digest(stored, _token_digest(secret)):
+            raise InvalidToken('Invalid access token')
+        return tenant_id
+
+    def get(self, tenant_id):
+        partition = self._open.get(tenant_id)
+        if partition is not None:
+            with self._lock:
+                if tenant_id in self._open:
+                    self._open.move_to_end(tenant_id)
+            return partition
+        with self._lock:
+            partition = self._open.get(tenant_id) or self._live.get(tenant_id)
+            if partition is None:
+                if not self.exists(tenant_id):
+                    if not self.auto_create:
+                        raise UnknownTenant(tenant_id)
+                    os.makedirs(self.data_dir(tenant_id), exist_ok=True)
+                partition = self.open_partition(tenant_id, self.data_dir(tenant_id))
+                self.opened += 1
+            self._open[tenant_id] = partition
+            self._live[tenant_id] = partition
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+                self.evicted += 1
+            return partition
+
+    def current(self):
+        return self.get(current_tenant_id())
+
+    def ids(self):
+        """Every tenant with a data directory (plus the default one)"""
+        found = [DEFAULT_TENANT]
+        if os.path.isdir(self.root):
+            found += sorted(n for n in os.listdir(self.root)
+                            if TENANT_RE.match(n) and os.path.isdir(os.path.join(self.root, n)))
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': len(self._open),
+                'max_open': self.max_open,
+                'opened': self.opened,
+                'evicted': self.evicted,
+                'auto_create': self.auto_create,
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision tenant data directories and access tokens')
+    parser.add_argument('--root', default=os.environ.get("TENANTS_DIR", "tenants"))
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list provisioned tenants')
+    create = commands.add_parser('create', help='provision a tenant and print its access token')
+    create.add_argument('tenant_id')
+    token = commands.add_parser('token', help='replace a tenant\'s access token')
+    token.add_argument('tenant_id')
+    args = parser.parse_args()
+
+    registry = TenantRegistry(args.root, open_partition=None)
+    if args.command == 'list':
+        print('\n'.join(registry.ids()))
+    else:
+        try:
+            if args.command == 'create' and not registry.provision(args.tenant_id):
+                parser.error(f"Already exists: {registry.data_dir(args.tenant_id)} (use `token` for a new token)")
+            print(f"Access token for {args.tenant_id} (shown once): {registry.issue_token(args.tenant_id)}")
+        except TenantError as e:
+            parser.error(str(e))
+        except UnknownTenant:
+            parser.error(f"Unknown tenant: {args.tenant_id}")
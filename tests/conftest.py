@@ -0,0 +1,38 @@
+"""
+Shared fixtures. The app is imported once per test session, inside a scratch
+data directory and pointed at fake_gemini.py, so tests never touch the
+checked-in data files or the network.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def fake_gemini():
+    from fake_gemini import start_fake_server
+    server, base_url = start_fake_server(chunk_delay=0)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory, fake_gemini):
+    workdir = tmp_path_factory.mktemp('data')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ['GEMINI_API_BASE'] = f"http://127.0.0.1:{fake_gemini.server_address[1]}/v1"
+    import app
+    yield app
+    app.extraction_jobs.close()
+    app.write_queue.close()
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
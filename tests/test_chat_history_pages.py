@@ -0,0 +1,110 @@
+"""Chat history pages are read from the segmented log by position, not by parsing it all."""
+import json
+
+import pytest
+
+from chat_log import ChatLog
+from pagination import paginate, paginate_log
+
+
+def message(i):
+    return {'timestamp': f"2026-01-01T00:{i:04d}", 'sender': 'user' if i % 2 == 0 else 'ai',
+            'content': f"message {i} " + 'x' * 40}
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = ChatLog(str(tmp_path / 'chat_log'), segment_max_bytes=1024, fsync=False)
+    for i in range(0, 200, 2):
+        log.append([message(i), message(i + 1)])
+    assert len(log._segments) > 5
+    return log
+
+
+def no_full_read(log, monkeypatch):
+    def read_all():
+        raise AssertionError('page parsed the whole log')
+    monkeypatch.setattr(log, 'read_all', read_all)
+
+
+def pages(log, args):
+    items, cursor = [], None
+    while True:
+        page = paginate_log(len(log), log.read_range, dict(args, cursor=cursor) if cursor else args, 'timestamp')
+        items.extend(page['items'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return items, page['total']
+
+
+def test_read_range_crosses_segments(log):
+    everything = log.read_all()
+    assert log.read_range(0, 200) == everything
+    assert log.read_range(17, 93) == everything[17:93]
+    assert log.read_range(195, 300) == everything[195:]
+    assert log.read_range(50, 50) == []
+
+
+@pytest.mark.parametrize('args', [
+    {'limit': '30'},
+    {'limit': '30', 'order': 'desc'},
+    {'limit': '7', 'since': '2026-01-01T00:0081'},
+    {'limit': '7', 'order': 'desc', 'since': '2026-01-01T00:0081'},
+    {'limit': '500', 'fields': 'content'},
+])
+def test_pages_match_the_list_paginator(log, monkeypatch, args):
+    expected = paginate(log.read_all(), args, 'timestamp', changed_fields=('timestamp',))
+    expected_all = paginate(log.read_all(), dict(args, limit='500'), 'timestamp', changed_fields=('timestamp',))
+    no_full_read(log, monkeypatch)
+
+    first = paginate_log(len(log), log.read_range, args, 'timestamp')
+    assert first['items'] == expected['items']
+    assert first['total'] == expected['total']
+    items, total = pages(log, args)
+    assert items == expected_all['items']
+    assert total == expected_all['total']
+
+
+def test_equal_timestamps_page_in_log_order(tmp_path):
+    log = ChatLog(str(tmp_path / 'chat_log'), segment_max_bytes=256, fsync=False)
+    for i in range(0, 40, 2):
+        # A turn and its reply logged within the same timestamp
+        log.append([dict(message(i), timestamp=f"t{i:03d}"), dict(message(i + 1), timestamp=f"t{i:03d}")])
+    forward, _ = pages(log, {'limit': '3'})
+    backward, _ = pages(log, {'limit': '3', 'order': 'desc'})
+    assert forward == log.read_all()
+    assert backward == forward[::-1]
+
+
+def test_cursor_survives_a_replaced_history(log):
+    page = paginate_log(len(log), log.read_range, {'limit': '10'}, 'timestamp')
+    # The history is rewritten with the first messages dropped: positions shift
+    log.replace(log.read_all()[4:])
+    following = paginate_log(len(log), log.read_range, {'limit': '10', 'cursor': page['next_cursor']},
+                             'timestamp')
+    assert following['items'][0] == message(10)
+
+
+def test_chat_history_endpoint_pages_the_log(client):
+    for i in range(3):
+        assert client.post('/api/chat', json={'message': f"Page test {i}", 'session_id': 'pages'}).status_code == 200
+    everything = client.get('/api/chat-history?limit=500').get_json()['items']
+    latest = client.get('/api/chat-history?order=desc&limit=2').get_json()
+    assert latest['items'] == everything[::-1][:2]
+    older = client.get(f"/api/chat-history?order=desc&limit=500&cursor={latest['next_cursor']}").get_json()
+    assert latest['items'] + older['items'] == everything[::-1]
+
+
+def test_rotation_overwrites_a_stale_segment(tmp_path):
+    log = ChatLog(str(tmp_path / 'chat_log'), segment_max_bytes=256, fsync=False)
+    log.append([message(0), message(1)])
+    # Files a crashed replace() left under the name the next segment will take
+    stale = log._new_segment_name()
+    with open(log._data_path(stale), 'wb') as f:
+        f.write((json.dumps(message(99)) + '\n').encode('utf-8'))
+    with open(log._idx_path(stale), 'wb') as f:
+        f.write(b'\0' * 8)
+    for i in range(2, 10, 2):
+        log.append([message(i), message(i + 1)])
+    assert stale in log._segments
+    assert log.read_all() == [message(i) for i in range(10)]
@@ -0,0 +1,63 @@
+"""A turn that gets no reply leaves nothing behind: no user turn, no mention counts."""
+import pytest
+
+MESSAGE = 'We planted tulips in the garden yesterday'
+
+
+@pytest.fixture
+def failing_upstream(fake_gemini):
+    state = fake_gemini.state
+    saved = state.fail_rate, state.fail_status
+    state.fail_rate, state.fail_status = 1.0, 500
+    yield
+    state.fail_rate, state.fail_status = saved
+
+
+def user_texts(app_module, session):
+    window = app_module.conversation_history.get(f"default:{session}")
+    return [p['text'] for turn in window.recent if turn['role'] == 'user' for p in turn['parts']] if window else []
+
+
+def mention_counts(app_module, session):
+    mentions = app_module.mention_tracker.get(f"default:{session}") or {}
+    return {kw: entry['count'] for kw, entry in mentions.items()}
+
+
+def test_failed_stream_undoes_the_turn(client, app_module, failing_upstream):
+    response = client.post('/api/chat/stream', json={'message': MESSAGE, 'session_id': 'fallback'})
+    assert b'event: error' in response.data
+    assert user_texts(app_module, 'fallback') == []
+    assert mention_counts(app_module, 'fallback') == {}
+
+
+def test_fallback_after_failed_stream(client, app_module, fake_gemini):
+    state = fake_gemini.state
+    saved = state.fail_rate, state.fail_status
+    state.fail_rate, state.fail_status = 1.0, 500
+    try:
+        client.post('/api/chat/stream', json={'message': MESSAGE, 'session_id': 'retry'}).get_data()
+    finally:
+        state.fail_rate, state.fail_status = saved
+    body = client.post('/api/chat', json={'message': MESSAGE, 'session_id': 'retry'}).get_json()
+    assert body.get('memory_to_confirm') is None
+    assert set(mention_counts(app_module, 'retry').values()) == {1}
+    assert not any('REPEATED TOPIC' in text for text in user_texts(app_module, 'retry'))
+
+
+@pytest.mark.parametrize('events_read', [0, 1])
+def test_client_disconnect_drops_the_turn(client, app_module, events_read):
+    session = f"gone-{events_read}"
+    response = client.post('/api/chat/stream', json={'message': MESSAGE, 'session_id': session}, buffered=False)
+    chunks = response.response
+    for _ in range(events_read):
+        assert b'event: token' in next(iter(chunks))
+    response.close()
+    assert user_texts(app_module, session) == []
+    assert mention_counts(app_module, session) == {}
+
+
+def test_completed_stream_keeps_the_turn(client, app_module):
+    response = client.post('/api/chat/stream', json={'message': MESSAGE, 'session_id': 'kept'})
+    assert b'event: done' in response.data
+    assert user_texts(app_module, 'kept') == [MESSAGE]
+    assert set(mention_counts(app_module, 'kept').values()) == {1}
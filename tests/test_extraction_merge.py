@@ -0,0 +1,58 @@
+"""Model output that follows RESPONSE_SCHEMA must survive merge_extracted_data."""
+import json
+
+
+def conforms(value, schema):
+    """Minimal check of a value against the Gemini schema subset the app uses"""
+    if value is None:
+        return schema.get('nullable', False)
+    kind = schema['type']
+    if kind == 'STRING':
+        return isinstance(value, str) and value in schema.get('enum', [value])
+    if kind == 'ARRAY':
+        return isinstance(value, list) and all(conforms(v, schema['items']) for v in value)
+    if kind == 'OBJECT':
+        properties = schema.get('properties', {})
+        return (isinstance(value, dict)
+                and all(k in value for k in schema.get('required', []))
+                and all(k in properties and conforms(v, properties[k]) for k, v in value.items()))
+    raise AssertionError(f"unexpected schema type {kind}")
+
+
+SCHEMA_VALID_REPLY = {
+    'response': 'That sounds lovely.',
+    'extracted_data': {
+        'memories': [{'title': 'Baking with Lily', 'description': 'Sunday bread', 'date': None}],
+        'daily_routines': [{'title': 'Morning walk', 'time': '08:00', 'description': 'Around the park'}],
+        'medications': [{'name': 'Tylenol', 'notes': 'for headaches'}],
+        'interests': ['baking'],
+        'adaptive_categories': [{'category': 'pets', 'items': ['a cat called Bo']}],
+    },
+}
+
+
+def test_sample_reply_follows_the_schema(app_module):
+    assert conforms(SCHEMA_VALID_REPLY, app_module.RESPONSE_SCHEMA)
+
+
+def test_schema_valid_reply_is_merged(app_module):
+    _, extracted, _, _ = app_module.parse_model_output(json.dumps(SCHEMA_VALID_REPLY))
+    merged = app_module.merge_extracted_data({}, extracted)
+    assert merged['medications'] == [{'name': 'Tylenol', 'notes': 'for headaches'}]
+    assert merged['daily_routines'] == [{'title': 'Morning walk', 'time': '08:00', 'description': 'Around the park'}]
+    assert merged['memories'][0]['title'] == 'Baking with Lily'
+    assert merged['interests'] == ['baking']
+    assert merged['adaptive_categories'] == {'pets': ['a cat called Bo']}
+
+
+def test_extraction_schema_matches_merge(app_module):
+    reply = {'extracted_data': {'medications': [{'name': 'Lisinopril'}]}}
+    assert conforms(reply, app_module.EXTRACTION_SCHEMA)
+    merged = app_module.merge_extracted_data({}, reply['extracted_data'])
+    assert merged['medications'] == [{'name': 'Lisinopril'}]
+
+
+def test_plain_strings_in_dict_categories_are_kept(app_module):
+    merged = app_module.merge_extracted_data({}, {'medications': ['Tylenol'], 'daily_routines': ['Tea at 4']})
+    assert merged['medications'] == [{'name': 'Tylenol'}]
+    assert merged['daily_routines'] == [{'title': 'Tea at 4'}]
@@ -0,0 +1,30 @@
+"""GeminiClient against fake_gemini.py."""
+import pytest
+
+from fake_gemini import start_fake_server
+from gemini_client import GeminiClient
+
+TEXT = "Café crème, piñata, 東京 and 🌷"
+
+
+@pytest.fixture
+def utf8_server():
+    server, base_url = start_fake_server(chunk_delay=0, chunk_chars=5, raw_utf8=True)
+    yield GeminiClient(base_url, 'test-key', 'fake-model')
+    server.shutdown()
+
+
+def payload(text):
+    return {'contents': [{'role': 'user', 'parts': [{'text': text}]}]}
+
+
+def test_stream_decodes_raw_utf8(utf8_server):
+    usage = {}
+    streamed = ''.join(utf8_server.stream_generate_content(payload(TEXT), usage=usage))
+    assert TEXT in streamed
+    assert usage['candidatesTokenCount'] > 0
+
+
+def test_generate_decodes_raw_utf8(utf8_server):
+    response = utf8_server.generate_content(payload(TEXT))
+    assert TEXT in response.json()['candidates'][0]['content']['parts'][0]['text']
@@ -0,0 +1,95 @@
+"""Item-level and whole-list saves share one lock and one version check."""
+import pytest
+
+
+@pytest.mark.parametrize('collection', ['notes', 'routines', 'family', 'memories'])
+def test_created_items_are_stamped(client, collection):
+    item = client.post(f'/api/{collection}/items', json={'title': 'One'}).get_json()['item']
+    assert item['version'] == 1
+    assert item['created_at'] and item['updated_at']
+
+
+@pytest.mark.parametrize('collection', ['notes', 'routines', 'family', 'memories'])
+def test_stale_whole_list_save_does_not_undo_an_item_edit(client, collection):
+    item = client.post(f'/api/{collection}/items', json={'title': 'Before'}).get_json()['item']
+    listed = client.get(f'/api/{collection}').get_json()
+    patched = client.patch(f"/api/{collection}/{item['id']}",
+                           json={'changes': {'title': 'Patched'}, 'version': 1}).get_json()['item']
+    assert patched['version'] == 2
+
+    # A client still holding version 1 saves the whole list
+    stale = [dict(i, title='Overwrite') if i['id'] == item['id'] else i for i in listed]
+    response = client.post(f'/api/{collection}', json=stale)
+    assert response.status_code == 409
+    assert response.get_json()['item']['title'] == 'Patched'
+    stored = {i['id']: i for i in client.get(f'/api/{collection}').get_json()}
+    assert stored[item['id']]['title'] == 'Patched'
+
+
+def test_whole_list_save_returns_new_versions(client):
+    item = client.post('/api/routines/items', json={'title': 'Walk'}).get_json()['item']
+    listed = client.get('/api/routines').get_json()
+    edited = [dict(i, title='Long walk') if i['id'] == item['id'] else i for i in listed]
+    saved = client.post('/api/routines', json=edited).get_json()['routines']
+    saved_item = next(i for i in saved if i['id'] == item['id'])
+    assert saved_item['version'] == 2
+    # Saving again from what the server returned is not a conflict
+    assert client.post('/api/routines', json=saved).status_code == 200
+
+
+def test_whole_list_save_does_not_drop_items_added_elsewhere(client):
+    listed = client.get('/api/family').get_json()
+    added = client.post('/api/family/items', json={'name': 'Added elsewhere'}).get_json()['item']
+    response = client.post('/api/family', json=listed)
+    assert response.status_code == 409
+    assert added['id'] in [i['id'] for i in response.get_json()['items']]
+    assert added['id'] in [i['id'] for i in client.get('/api/family').get_json()]
+
+
+def test_whole_list_save_does_not_bring_back_deleted_items(client):
+    item = client.post('/api/family/items', json={'name': 'Deleted elsewhere'}).get_json()['item']
+    listed = client.get('/api/family').get_json()
+    assert client.delete(f"/api/family/{item['id']}", json={'version': 1}).status_code == 200
+    response = client.post('/api/family', json=listed, headers={'If-Match': '*'})
+    assert response.status_code == 409
+    assert item['id'] not in [i['id'] for i in client.get('/api/family').get_json()]
+
+
+def test_whole_list_save_removes_items_with_if_match(client):
+    item = client.post('/api/notes/items', json={'title': 'To remove'}).get_json()['item']
+    loaded = client.get('/api/notes')
+    remaining = [i for i in loaded.get_json() if i['id'] != item['id']]
+    saved = client.post('/api/notes', json=remaining, headers={'If-Match': loaded.headers['ETag']})
+    assert saved.status_code == 200
+    assert item['id'] not in [i['id'] for i in saved.get_json()['notes']]
+
+    # The ETag is now stale: the list changed after it was loaded
+    client.post('/api/notes/items', json={'title': 'Meanwhile'})
+    stale = client.post('/api/notes', json=remaining, headers={'If-Match': saved.headers['ETag']})
+    assert stale.status_code == 409
+
+
+@pytest.mark.parametrize('collection', ['notes', 'memories'])
+def test_changes_since_report_deletions(client, collection):
+    kept = client.post(f'/api/{collection}/items', json={'title': 'Kept'}).get_json()['item']
+    gone = client.post(f'/api/{collection}/items', json={'title': 'Gone'}).get_json()['item']
+    dropped = client.post(f'/api/{collection}/items', json={'title': 'Dropped'}).get_json()['item']
+    since = dropped['updated_at']
+    assert client.delete(f"/api/{collection}/{gone['id']}", json={'version': 1}).status_code == 200
+    loaded = client.get(f'/api/{collection}')
+    remaining = [i for i in loaded.get_json() if i['id'] != dropped['id']]
+    assert client.post(f'/api/{collection}', json=remaining, headers={'If-Match': loaded.headers['ETag']}).status_code == 200
+
+    changes = client.get(f'/api/{collection}?since={since}').get_json()
+    assert {gone['id'], dropped['id']} <= set(changes['deleted'])
+    assert kept['id'] not in changes['deleted']
+    assert client.get(f'/api/{collection}?since=9999').get_json()['deleted'] == []
+
+
+def test_items_without_timestamps_count_as_changed():
+    from pagination import paginate
+    items = [{'id': 'legacy', 'title': 'Stored before timestamps'},
+             {'id': 'old', 'updated_at': '2020-01-01T00:00:00'},
+             {'id': 'new', 'updated_at': '2026-01-01T00:00:00'}]
+    page = paginate(items, {'since': '2025-01-01T00:00:00'}, 'id')
+    assert [i['id'] for i in page['items']] == ['legacy', 'new']
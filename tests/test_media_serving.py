@@ -0,0 +1,136 @@
+"""
+/uploads serving: Range/206 partial reads of large files, conditional
+requests, and the ETag cache of legacy files while they are being rewritten.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+
+LARGE = bytes(range(256)) * (3 * 4096)   # 3 MiB
+
+
+@pytest.fixture
+def blob_url(client):
+    response = client.post('/api/upload', data={'file': (io.BytesIO(LARGE), 'clip.mp4')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    return response.get_json()['url']
+
+
+@pytest.fixture
+def legacy_file(app_module):
+    path = os.path.join(app_module.UPLOAD_FOLDER, 'legacy-clip.mp4')
+    with open(path, 'wb') as f:
+        f.write(b'a' * 4096)
+    yield path
+    os.remove(path)
+
+
+def etag_of(response):
+    return response.headers['ETag'].strip('"')
+
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=1048576-2097151', 1048576, 2097151),
+    ('bytes=-500', len(LARGE) - 500, len(LARGE) - 1),
+    ('bytes=3145000-', 3145000, len(LARGE) - 1),
+])
+def test_range_reads_of_large_file(client, blob_url, header, start, end):
+    response = client.get(blob_url, headers={'Range': header})
+    assert response.status_code == 206
+    assert response.data == LARGE[start:end + 1]
+    assert response.headers['Content-Range'] == f"bytes {start}-{end}/{len(LARGE)}"
+
+
+def test_unsatisfiable_range(client, blob_url):
+    response = client.get(blob_url, headers={'Range': f"bytes={len(LARGE)}-"})
+    assert response.status_code == 416
+
+
+def test_full_read_and_conditionals(client, blob_url):
+    response = client.get(blob_url)
+    assert response.status_code == 200 and response.data == LARGE
+    assert etag_of(response) == hashlib.sha256(LARGE).hexdigest()
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get(blob_url, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get(blob_url, headers={'If-Modified-Since': response.headers['Last-Modified']}).status_code == 304
+    # If-Range with a stale validator sends the whole file instead of a slice of it
+    stale = client.get(blob_url, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200 and len(stale.data) == len(LARGE)
+    fresh = client.get(blob_url, headers={'Range': 'bytes=0-9', 'If-Range': response.headers['ETag']})
+    assert fresh.status_code == 206 and fresh.data == LARGE[:10]
+
+
+def test_rewrite_with_unchanged_mtime_gets_new_etag(client, legacy_file):
+    before = client.get('/uploads/legacy-clip.mp4')
+    st = os.stat(legacy_file)
+    with open(legacy_file, 'r+b') as f:
+        f.write(b'b' * 4096)
+    os.utime(legacy_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+    after = client.get('/uploads/legacy-clip.mp4')
+    assert after.data == b'b' * 4096
+    assert etag_of(after) == hashlib.sha256(after.data).hexdigest() != etag_of(before)
+    # The old validator must not produce a 304 for the new bytes
+    assert client.get('/uploads/legacy-clip.mp4', headers={'If-None-Match': before.headers['ETag']}).status_code == 200
+
+
+def test_replaced_by_rename_gets_new_etag(client, legacy_file):
+    before = client.get('/uploads/legacy-clip.mp4')
+    st = os.stat(legacy_file)
+    tmp = legacy_file + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(b'c' * 4096)
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, legacy_file)
+    after = client.get('/uploads/legacy-clip.mp4')
+    assert after.data == b'c' * 4096
+    assert etag_of(after) == hashlib.sha256(after.data).hexdigest() != etag_of(before)
+
+
+def test_renamed_between_stat_and_hash(client, app_module, legacy_file, monkeypatch):
+    """A rename landing after the stat is hashed and stamped as the new file"""
+    real_open = open
+    tmp = legacy_file + '.tmp'
+
+    def open_after_rename(path, *args, **kwargs):
+        if path == legacy_file and not os.path.exists(tmp + '.done'):
+            with real_open(tmp, 'wb') as f:
+                f.write(b'd' * 4096)
+            os.replace(tmp, legacy_file)
+            real_open(tmp + '.done', 'w').close()
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', open_after_rename)
+    etag = app_module.media_store.content_etag('legacy-clip.mp4')
+    monkeypatch.undo()
+    os.remove(tmp + '.done')
+    assert etag == hashlib.sha256(b'd' * 4096).hexdigest()
+    assert app_module.media_store.content_etag('legacy-clip.mp4') == etag
+
+
+def test_truncated_file(client, legacy_file):
+    client.get('/uploads/legacy-clip.mp4')
+    with open(legacy_file, 'r+b') as f:
+        f.truncate(1000)
+    response = client.get('/uploads/legacy-clip.mp4', headers={'Range': 'bytes=0-4095'})
+    assert response.status_code == 206
+    assert response.data == b'a' * 1000
+    assert response.headers['Content-Range'] == 'bytes 0-999/1000'
+    assert etag_of(response) == hashlib.sha256(b'a' * 1000).hexdigest()
+    assert client.get('/uploads/legacy-clip.mp4', headers={'Range': 'bytes=2000-'}).status_code == 416
+
+
+def test_cached_collection_sees_same_size_rewrite(client, app_module):
+    client.post('/api/profile', json={'name': 'Ann'})
+    assert client.get('/api/profile').get_json()['name'] == 'Ann'
+    path = app_module.DATA_FILES['profile']
+    st = os.stat(path)
+    with open(path) as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text.replace('"Ann"', '"Bea"'))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert client.get('/api/profile').get_json()['name'] == 'Bea'
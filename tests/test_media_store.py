@@ -0,0 +1,71 @@
+"""Dedup lookups and reference counting in the content-addressed media store."""
+import io
+import os
+
+import media_store
+from media_store import MediaStore
+
+
+def upload(store, data, filename='photo.jpg'):
+    return store.save_stream(io.BytesIO(data), filename)
+
+
+def blob_exists(store, name):
+    return os.path.exists(os.path.join(store.folder, name))
+
+
+def test_duplicate_upload_does_not_list_the_folder(tmp_path, monkeypatch):
+    store = MediaStore(str(tmp_path), max_bytes=1 << 20)
+    first = upload(store, b'same bytes')
+
+    def no_listdir(path):
+        raise AssertionError('upload listed the folder')
+    monkeypatch.setattr(media_store.os, 'listdir', no_listdir)
+
+    assert upload(store, b'same bytes', 'copy.jpg') == first
+    assert upload(store, b'other bytes') != first
+
+
+def test_existing_blobs_are_found_after_a_restart(tmp_path):
+    first = upload(MediaStore(str(tmp_path), max_bytes=1 << 20), b'kept bytes', 'a.png')
+    restarted = MediaStore(str(tmp_path), max_bytes=1 << 20)
+    # Same bytes under another extension still land on the stored blob
+    assert upload(restarted, b'kept bytes', 'b.jpg') == first
+
+
+def test_blob_stored_by_another_worker_is_found(tmp_path):
+    a = MediaStore(str(tmp_path), max_bytes=1 << 20, interprocess=True)
+    b = MediaStore(str(tmp_path), max_bytes=1 << 20, interprocess=True)
+    blob = upload(a, b'shared bytes')
+    assert upload(b, b'shared bytes') == blob
+    assert len([n for n in os.listdir(tmp_path) if media_store.is_blob_name(n)]) == 1
+
+
+def test_duplicate_upload_survives_the_last_record_going_away(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1 << 20)
+    blob = upload(store, b'photo of the garden')
+    url = f'/uploads/{blob}'
+    store.update_refs([], [url])  # first record saved
+
+    # The same photo is uploaded again while the only record pointing at it is deleted
+    assert upload(store, b'photo of the garden') == blob
+    store.update_refs([url], [])
+    assert blob_exists(store, blob)
+
+    # The new record takes over the upload's hold; removing it removes the blob
+    store.update_refs([], [url])
+    assert store.stats()['pending_uploads'] == 0
+    store.update_refs([url], [])
+    assert not blob_exists(store, blob)
+
+
+def test_removed_blob_is_stored_again(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=1 << 20)
+    blob = upload(store, b'short lived')
+    url = f'/uploads/{blob}'
+    store.update_refs([], [url])
+    store.update_refs([url], [])
+    assert not blob_exists(store, blob)
+
+    assert upload(store, b'short lived') == blob
+    assert blob_exists(store, blob)
@@ -0,0 +1,35 @@
+"""Query building and incremental maintenance of the FTS5 search index."""
+import pytest
+
+from search_index import SearchIndex, build_match, fts5_available, make_snippet, query_terms
+
+pytestmark = pytest.mark.skipif(not fts5_available(), reason="SQLite built without FTS5")
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / 'search.db'))
+
+
+def test_only_the_last_term_is_a_prefix(index):
+    assert build_match(query_terms('lake hou')) == '"lake" "hou"*'
+    index.append('notes', [('1', None, 'Trip', 'a weekend at the lake house')])
+    assert [r['id'] for r in index.search('lake hou')] == ['1']
+    assert index.search('lak house') == []
+
+
+def test_append_counts_replaced_documents_once(index):
+    index.append('chat', [('0', None, '', 'hello'), ('1', None, '', 'garden')])
+    index.append('chat', [('1', None, '', 'garden roses'), ('2', None, '', 'tulips')])
+    assert index.count('chat') == 3
+    assert index.stats()['documents']['chat'] == 3
+
+
+@pytest.mark.parametrize('query', ['s cat', 'ss cat', 'bus cat'])
+def test_short_terms_are_not_stemmed_to_everything(query):
+    snippet = make_snippet('the dog sat on the mat near a cat', query_terms(query))
+    assert [w for w in snippet.split() if w.startswith('[')] == ['[cat]']
+
+
+def test_plural_terms_match_the_singular():
+    assert '[rose]' in make_snippet('a single rose by the door', query_terms('roses door'))
@@ -0,0 +1,74 @@
+"""SessionStore spill bounds and background updates of shared sessions."""
+import sqlite3
+import time
+
+from context_window import ConversationWindow
+from session_store import SessionStore
+
+
+def stored_rows(db, store):
+    with sqlite3.connect(db) as conn:
+        return conn.execute('SELECT COUNT(*) FROM sessions WHERE store = ?', (store,)).fetchone()[0]
+
+
+def test_spill_table_is_capped(tmp_path):
+    db = str(tmp_path / 's.db')
+    store = SessionStore('t', max_entries=2, spill_db=db, spill_max_rows=50)
+    for i in range(300):
+        store[f"s{i}"] = {'n': i}
+    assert stored_rows(db, 't') <= 51
+    assert store.stats()['spill_trimmed'] >= 240
+    # The most recently spilled sessions are the ones kept
+    assert store.get('s297') == {'n': 297}
+    assert store.get('s0') is None
+
+
+def test_expired_spill_rows_are_purged_while_running(tmp_path):
+    db = str(tmp_path / 's.db')
+    store = SessionStore('t', max_entries=1, spill_db=db, spill_ttl_seconds=1)
+    store['a'] = {'n': 1}
+    store['b'] = {'n': 2}          # spills a
+    assert stored_rows(db, 't') == 1
+    time.sleep(1.1)
+    store['c'] = {'n': 3}          # spills b; the periodic trim drops a
+    assert store.get('a') is None
+
+
+def test_shared_update_retries_on_a_newer_version(tmp_path):
+    db = str(tmp_path / 's.db')
+    worker_a = SessionStore('t', spill_db=db, shared=True)
+    worker_b = SessionStore('t', spill_db=db, shared=True)
+    worker_a['k'] = {'turns': 1}
+    worker_a.get('k')
+    worker_b['k'] = {'turns': 2}   # worker a's cached copy is now stale
+
+    def add_summary(value):
+        value['summary'] = 'done'
+    assert worker_a.update('k', add_summary)
+    assert worker_b.get('k') == {'turns': 2, 'summary': 'done'}
+
+
+def test_background_summary_reaches_the_shared_store(tmp_path):
+    db = str(tmp_path / 's.db')
+
+    def open_store():
+        return SessionStore('conversation', spill_db=db, shared=True, serialize=lambda w: w.to_dict(),
+                            deserialize=lambda d: ConversationWindow.from_dict(d, resume=False))
+    worker_a, worker_b = open_store(), open_store()
+    window = ConversationWindow([], keep_recent=1)
+    worker_a['s'] = window
+    landed = []
+    window.summarize = lambda previous, turns: 'short summary'
+    window.on_summary = lambda previous, batch, summary: landed.append(
+        worker_a.update('s', lambda latest: latest.apply_summary(previous, batch, summary)))
+    for i in range(3):
+        window.append({'role': 'user', 'parts': [{'text': f'q{i}'}]})
+        window.append({'role': 'model', 'parts': [{'text': f'a{i}'}]})
+        worker_a.save('s')
+    deadline = time.monotonic() + 5
+    while not landed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stored = worker_b.get('s')
+    assert landed and all(landed)
+    assert stored.summary == 'short summary'
+    assert stored.folding == []
@@ -0,0 +1,17 @@
+"""Only the front-end files are served from the working directory."""
+import pytest
+
+
+@pytest.mark.parametrize('path', [
+    '/memories.json', '/profile.json', '/sessions.db', '/chat_log/manifest.json',
+    '/tenants/alice/memories.json', '/tenants/alice/.access_token', '/app.py', '/.env',
+])
+def test_private_files_are_not_served(client, app_module, path):
+    app_module.tenants.provision('alice')
+    assert client.get(path).status_code == 404
+
+
+def test_front_end_files_are_served(client, app_module):
+    assert client.get('/').status_code == 200
+    assert client.get('/style.css').status_code == 200
+    assert client.get(app_module.static_assets.url_for('script.js')).status_code == 200
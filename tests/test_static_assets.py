@@ -0,0 +1,37 @@
+"""The front-end manifest is built once, and only rebuilt per request when reloading."""
+import os
+
+from flask import Flask, request
+
+import static_assets
+from static_assets import StaticAssets
+
+
+def serve(assets, path):
+    with Flask(__name__).test_request_context('/' + path):
+        return assets.response(path, request).get_data()
+
+
+def write(root, name, text):
+    with open(os.path.join(root, name), 'w') as f:
+        f.write(text)
+
+
+def test_requests_do_not_touch_the_disk(tmp_path, monkeypatch):
+    write(tmp_path, 'script.js', 'console.log(1);')
+    assets = StaticAssets(str(tmp_path))
+
+    def no_disk(*args):
+        raise AssertionError('static request touched the disk')
+    monkeypatch.setattr(static_assets.os, 'listdir', no_disk)
+    monkeypatch.setattr(static_assets, 'file_stamp', no_disk)
+    assert serve(assets, 'script.js') == b'console.log(1);'
+
+
+def test_edits_are_picked_up_when_reloading(tmp_path):
+    write(tmp_path, 'script.js', 'console.log(1);')
+    fixed = StaticAssets(str(tmp_path))
+    reloading = StaticAssets(str(tmp_path), reload=True)
+    write(tmp_path, 'script.js', 'console.log(22);')
+    assert serve(fixed, 'script.js') == b'console.log(1);'
+    assert serve(reloading, 'script.js') == b'console.log(22);'
@@ -0,0 +1,35 @@
+"""Copying the JSON files into SQLite, from the app or the command line."""
+import json
+import os
+import subprocess
+import sys
+
+from storage import CHAT_FILE, CHAT_LOG_DIR, DATA_FILES, JsonBackend, SqliteBackend
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write(root, name, data):
+    with open(os.path.join(root, name), 'w') as f:
+        json.dump(data, f)
+
+
+def json_backend(root):
+    return JsonBackend({name: str(root / f) for name, f in DATA_FILES.items()},
+                       str(root / CHAT_LOG_DIR), str(root / CHAT_FILE))
+
+
+def test_bare_list_memories_are_imported(tmp_path):
+    write(tmp_path, DATA_FILES['memories'], [{'id': 'm1', 'title': 'First garden'}])
+    target = SqliteBackend(str(tmp_path / 'data.db'))
+    assert target.import_from(json_backend(tmp_path))['memories'] == 1
+    assert target.load('memories')['memories'] == [{'id': 'm1', 'title': 'First garden'}]
+
+
+def test_command_line_import_does_not_start_the_app(tmp_path):
+    write(tmp_path, DATA_FILES['notes'], {'notes': [{'id': 'n1', 'title': 'Note'}]})
+    script = ("import runpy, sys; sys.argv = ['storage.py', 'import-json']; "
+              "runpy.run_module('storage', run_name='__main__'); assert 'app' not in sys.modules")
+    env = dict(os.environ, PYTHONPATH=PACKAGE, SQLITE_DB_FILE='cli.db')
+    subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, check=True)
+    assert SqliteBackend(str(tmp_path / 'cli.db')).load('notes')['notes'] == [{'id': 'n1', 'title': 'Note'}]
@@ -0,0 +1,78 @@
+"""One tenant's requests never reach another tenant's sessions or partition."""
+import os
+
+import pytest
+
+from tenants import TenantError
+
+
+def bearer(token):
+    return {'Authorization': f"Bearer {token}"}
+
+
+@pytest.fixture(scope='module')
+def alice_token(app_module):
+    app_module.tenants.provision('alice')
+    return app_module.tenants.issue_token('alice')
+
+
+@pytest.fixture
+def alice(alice_token):
+    return bearer(alice_token)
+
+
+def test_session_ids_cannot_name_another_tenants_session(client, app_module, alice):
+    assert client.post('/api/chat', json={'message': 'hello', 'session_id': 's1'}, headers=alice).status_code == 200
+    response = client.post('/api/chat', json={'message': 'hi', 'session_id': 'alice:s1'})
+    assert response.status_code == 400
+    response = client.post('/api/chat/stream', json={'message': 'hi', 'session_id': 'alice:s1'})
+    assert response.status_code == 400
+
+
+def test_same_session_id_is_separate_per_tenant(client, app_module, alice):
+    client.post('/api/chat', json={'message': 'from alice', 'session_id': 'shared'}, headers=alice)
+    client.post('/api/chat', json={'message': 'from default', 'session_id': 'shared'})
+    windows = [app_module.conversation_history.get(f"{tenant}:shared") for tenant in ('alice', 'default')]
+    texts = [[p['text'] for turn in w.recent for p in turn['parts']] for w in windows]
+    assert any('from alice' in t for t in texts[0]) and not any('from default' in t for t in texts[0])
+    assert any('from default' in t for t in texts[1]) and not any('from alice' in t for t in texts[1])
+
+
+def test_tenant_cannot_be_chosen_by_name(client, app_module, alice):
+    client.post('/api/notes/items', json={'title': 'Alice only', 'content': 'private'}, headers=alice)
+    for request in ({'headers': {'X-Tenant-ID': 'alice'}}, {'query_string': {'tenant': 'alice'}}):
+        response = client.get('/api/notes', **request)
+        assert response.status_code == 400
+        assert b'Alice only' not in response.data
+
+
+@pytest.mark.parametrize('token', ['alice', 'alice.guess', 'default.x', 'mallory.x', '../etc.x', '.x'])
+def test_wrong_tokens_are_refused(client, app_module, alice, token):
+    assert client.get('/api/notes', headers=bearer(token)).status_code == 401
+    assert not os.path.exists(os.path.join(app_module.TENANTS_DIR, 'mallory'))
+
+
+def test_login_cookie_selects_the_tenant(app_module, alice):
+    client = app_module.app.test_client()
+    client.post('/api/notes/items', json={'title': 'Cookie note', 'content': 'x'}, headers=alice)
+    token = alice['Authorization'].split(' ', 1)[1]
+    assert client.post('/api/login', json={'token': 'alice.wrong'}).status_code == 401
+    assert b'Cookie note' not in client.get('/api/notes').data
+    assert client.post('/api/login', json={'token': token}).get_json()['tenant'] == 'alice'
+    assert b'Cookie note' in client.get('/api/notes').data
+    client.post('/api/logout')
+    assert b'Cookie note' not in client.get('/api/notes').data
+
+
+def test_reissued_token_replaces_the_old_one(client, app_module):
+    app_module.tenants.provision('bob')
+    old = app_module.tenants.issue_token('bob')
+    new = app_module.tenants.issue_token('bob')
+    assert client.get('/api/notes', headers=bearer(old)).status_code == 401
+    assert client.get('/api/notes', headers=bearer(new)).status_code == 200
+
+
+@pytest.mark.parametrize('tenant_id', ['../etc', 'a/b', '.hidden', 'x' * 65])
+def test_invalid_tenant_ids_are_rejected(app_module, tenant_id):
+    with pytest.raises(TenantError):
+        app_module.tenants.provision(tenant_id)
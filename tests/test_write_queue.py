@@ -0,0 +1,69 @@
+"""Failed group commits are retried, isolated per tenant, and never silently dropped."""
+import pytest
+
+from write_queue import PartialCommit, WriteBehindQueue
+
+
+def make_queue(handler, **options):
+    failures = []
+    options.setdefault('on_failure', lambda kind, payloads, error: failures.append((kind, payloads)))
+    queue = WriteBehindQueue({'kind': handler}, linger=0.01, retry_backoff=0.001, **options)
+    return queue, failures
+
+
+def test_transient_failure_is_retried():
+    calls = []
+
+    def handler(payloads):
+        calls.append(list(payloads))
+        if len(calls) < 3:
+            raise OSError('disk busy')
+    queue, failures = make_queue(handler)
+    ticket = queue.submit('kind', 'a')
+    assert ticket.wait(5) and ticket.error is None
+    queue.close()
+    assert calls == [['a']] * 3 and failures == []
+
+
+def test_only_failed_payloads_are_retried_and_then_handed_over():
+    calls = []
+
+    def handler(payloads):
+        calls.append(list(payloads))
+        bad = [p for p in payloads if p.startswith('bad')]
+        if bad:
+            raise PartialCommit(bad, OSError('disk full'))
+    queue, failures = make_queue(handler, retries=2)
+    tickets = {p: queue.submit('kind', p) for p in ('ok-1', 'bad-1', 'ok-2')}
+    queue.flush(5)
+    queue.close()
+    assert calls[0] == ['ok-1', 'bad-1', 'ok-2']
+    assert calls[1:] == [['bad-1'], ['bad-1']]
+    assert tickets['ok-1'].error is None and tickets['ok-2'].error is None
+    assert isinstance(tickets['bad-1'].error, OSError)
+    assert failures == [('kind', ['bad-1'])]
+    assert queue.stats()['committed'] == 2 and queue.stats()['errors'] == 1
+
+
+def test_one_tenants_failure_does_not_drop_another_tenants_writes(app_module):
+    committed = []
+
+    def commit(payloads):
+        if payloads[0] == 'broken':
+            raise OSError('lock timeout')
+        committed.extend(payloads)
+    entries = [('alice', 'broken'), ('default', 'turn-1'), ('default', 'turn-2')]
+    with pytest.raises(PartialCommit) as raised:
+        app_module._commit_per_tenant(entries, commit)
+    assert committed == ['turn-1', 'turn-2']
+    assert raised.value.failed == [entries[0]]
+
+
+def test_parked_writes_are_replayed(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'FAILED_WRITES_FILE', str(tmp_path / 'failed_writes.jsonl'))
+    turn = [{'sender': 'user', 'content': 'parked while the disk was full', 'timestamp': '2026-01-01T00:00:00'}]
+    app_module._park_failed_writes('chat', [('default', turn)], OSError('disk full'))
+    assert app_module.replay_failed_writes() == 1
+    with app_module.use_tenant('default'):
+        assert turn[0] in app_module.load_recent_chat(5)
+    assert not (tmp_path / 'failed_writes.jsonl').exists()
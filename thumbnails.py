@@ -0,0 +1,170 @@
+"""
+Resized derivatives of uploaded photos and videos.
+
+After an upload is stored, a small worker pool renders each width in WIDTHS
+as WebP (JPEG when Pillow has no WebP support), plus a poster frame for
+videos, into <upload folder>/.thumbs/. Requests for a size that is not ready
+yet get the original (images) or nothing (video posters) and queue the job.
+
+Pillow is optional: without it no derivatives are made and everything is
+served as before. Video posters also need an `ffmpeg` binary on PATH.
+"""
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps, features
+    HAVE_PILLOW = True
+except ImportError:
+    HAVE_PILLOW = False
+
+WIDTHS = (160, 320, 640, 1280)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm'}
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+
+def pick_width(requested):
+    """Smallest standard width that covers the requested one"""
+    for width in WIDTHS:
+        if width >= requested:
+            return width
+    return WIDTHS[-1]
+
+
+class ThumbnailPipeline:
+    def __init__(self, folder, workers=2, quality=80):
+        self.folder = folder
+        self.thumb_dir = os.path.join(folder, '.thumbs')
+        self.quality = quality
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.format = 'webp' if HAVE_PILLOW and features.check('webp') else 'jpg'
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self._pending = set()
+        self._failed = set()   # unreadable sources are not retried on every request
+        self._lock = threading.Lock()
+        self.generated = 0
+        self.failures = 0
+        if not os.path.exists(self.thumb_dir):
+            os.makedirs(self.thumb_dir)
+
+    def supports(self, filename):
+        ext = _extension(filename)
+        if not HAVE_PILLOW:
+            return False
+        if ext in VIDEO_EXTENSIONS:
+            return self.ffmpeg is not None
+        return ext in IMAGE_EXTENSIONS
+
+    def derivative_name(self, filename, width):
+        return f"{filename.rsplit('.', 1)[0]}_{width}.{self.format}"
+
+    # -------------------------------------------------------
+    # Lookup
+    # -------------------------------------------------------
+    def lookup(self, filename, requested_width):
+        """
+        Path (relative to thumb_dir) of the derivative for filename at about
+        requested_width, or None if it is not ready. Missing derivatives are queued.
+        """
+        if not self.supports(filename):
+            return None
+        name = self.derivative_name(filename, pick_width(requested_width))
+        if os.path.exists(os.path.join(self.thumb_dir, name)):
+            return name
+        self.submit(filename)
+        return None
+
+    def submit(self, filename):
+        """Queue derivative generation for an upload (no-op if unsupported or already queued)"""
+        if not self.supports(filename):
+            return
+        with self._lock:
+            if filename in self._pending or filename in self._failed:
+                return
+            self._pending.add(filename)
+        self._executor.submit(self._generate, filename)
+
+    # -------------------------------------------------------
+    # Generation
+    # -------------------------------------------------------
+    def _generate(self, filename):
+        source = os.path.join(self.folder, filename)
+        poster = None
+        try:
+            if _extension(filename) in VIDEO_EXTENSIONS:
+                poster = os.path.join(self.thumb_dir, f".poster-{threading.get_ident()}.png")
+                self._extract_poster(source, poster)
+                source = poster
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                if self.format == 'jpg' and image.mode == 'RGBA':
+                    image = image.convert('RGB')
+                for width in WIDTHS:
+                    self._write_variant(image, filename, width)
+            self.generated += 1
+        except Exception as e:
+            self.failures += 1
+            with self._lock:
+                self._failed.add(filename)
+            print(f"Could not create thumbnails for {filename}: {e}")
+        finally:
+            if poster and os.path.exists(poster):
+                os.remove(poster)
+            with self._lock:
+                self._pending.discard(filename)
+
+    def _extract_poster(self, video_path, out_path):
+        # Grab a frame a second in (skips black lead-in frames); fall back to the first frame
+        for offset in ('1', '0'):
+            subprocess.run(
+                [self.ffmpeg, '-y', '-loglevel', 'error', '-ss', offset, '-i', video_path,
+                 '-frames:v', '1', out_path],
+                check=True, timeout=60, stdin=subprocess.DEVNULL
+            )
+            if os.path.exists(out_path) and os.path.getsize(out_path) > 0:
+                return
+        raise RuntimeError("ffmpeg produced no frame")
+
+    def _write_variant(self, image, filename, width):
+        target = os.path.join(self.thumb_dir, self.derivative_name(filename, width))
+        if os.path.exists(target):
+            return
+        variant = image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            variant = image.resize((width, height), Image.LANCZOS)
+        tmp = target + '.tmp'
+        if self.format == 'webp':
+            variant.save(tmp, 'WEBP', quality=self.quality, method=4)
+        else:
+            variant.save(tmp, 'JPEG', quality=self.quality, optimize=True, progressive=True)
+        os.replace(tmp, target)
+
+    def remove(self, filename):
+        """Delete every derivative of an upload (called when its blob is removed)"""
+        for width in WIDTHS:
+            try:
+                os.remove(os.path.join(self.thumb_dir, self.derivative_name(filename, width)))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pillow': HAVE_PILLOW,
+            'ffmpeg': self.ffmpeg is not None,
+            'format': self.format,
+            'pending': pending,
+            'generated': self.generated,
+            'failures': self.failures,
+        }
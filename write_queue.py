@@ -0,0 +1,231 @@
+"""
+Write-behind queue with group commit.
+
+Request handlers submit (kind, payload) and return; one background writer
+drains the queue, lingering a couple of milliseconds so that a burst of
+submissions is committed together. Each kind has a batch handler that
+receives every payload of that kind in the batch, so N chat turns become one
+log append + fsync, and N extractions one atomic memories rewrite.
+
+    wq = WriteBehindQueue({'chat': append_turns, 'memories': merge_all})
+    wq.submit('chat', turn)      # blocks up to put_timeout when the queue is full
+    wq.flush()                   # wait until everything queued so far is committed
+    wq.close()                   # flush and stop (registered with atexit by the app)
+
+A handler that fails is retried retries times with exponential backoff.
+A handler that commits payloads independently (e.g. one tenant at a time)
+raises PartialCommit with the ones that failed, so only those are retried.
+Payloads that still fail go to on_failure(kind, payloads, error), if given,
+to be kept somewhere; their tickets finish with the error.
+
+The queue is not a journal. A submitted write is only in memory until its
+batch is committed, so a crash (kill -9, power loss) loses every write
+still queued, up to max_depth of them, even though the request that made
+it has already been answered. A clean shutdown (close(), which the app runs
+at exit) loses nothing. A caller that must not answer before its write is
+on disk waits on the returned Ticket.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PartialCommit(Exception):
+    """Raised by a handler when only some payloads were committed"""
+    def __init__(self, failed, error):
+        super().__init__(f"{len(failed)} write(s) failed: {error}")
+        self.failed = failed    # the payload objects that were not committed
+        self.error = error
+
+
+class Ticket:
+    """Completion handle for one submitted write"""
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 3)
+
+
+class WriteBehindQueue:
+    def __init__(self, handlers, max_depth=1000, max_batch=256, linger=0.002, put_timeout=2.0,
+                 retries=3, retry_backoff=0.05, on_failure=None):
+        self.handlers = handlers          # kind -> fn(list of payloads)
+        self.max_depth = max_depth
+        self.max_batch = max_batch
+        self.linger = linger
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.on_failure = on_failure      # fn(kind, payloads, error) for writes that kept failing
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._closed = False
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.committed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.retried = 0
+        self.errors = 0
+        self.max_seen_depth = 0
+        self._commit_ms = []              # recent group-commit durations
+        self._wait_ms = []                # recent enqueue -> committed latencies
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    # -------------------------------------------------------
+    # Producers
+    # -------------------------------------------------------
+    def submit(self, kind, payload):
+        """Queue a write; raises QueueFull if the writer is this far behind for put_timeout"""
+        if self._closed:
+            raise QueueFull("write queue is closed")
+        ticket = Ticket()
+        try:
+            self._queue.put((kind, payload, time.monotonic(), ticket), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull(f"write queue is full ({self.max_depth} pending)")
+        with self._lock:
+            self.submitted += 1
+            self.max_seen_depth = max(self.max_seen_depth, self._queue.qsize())
+        return ticket
+
+    def flush(self, timeout=None):
+        """Block until every write queued so far is committed; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=30):
+        """Flush outstanding writes and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    # -------------------------------------------------------
+    # Writer
+    # -------------------------------------------------------
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _commit(self, batch):
+        by_kind = OrderedDict()
+        for kind, payload, queued_at, ticket in batch:
+            by_kind.setdefault(kind, []).append((payload, queued_at, ticket))
+        for kind, entries in by_kind.items():
+            started = time.monotonic()
+            pending, error = entries, None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                    with self._lock:
+                        self.retried += len(pending)
+                failed, error = self._attempt(kind, pending)
+                failed_ids = set(map(id, failed))
+                self._settle([e for e in pending if id(e) not in failed_ids], started)
+                pending = failed
+                if not pending:
+                    break
+                print(f"Write-behind commit of {len(pending)} {kind} write(s) failed "
+                      f"(attempt {attempt + 1} of {self.retries + 1}): {error}")
+            with self._lock:
+                self.batches += 1
+                self.errors += len(pending)
+            if pending and self.on_failure:
+                try:
+                    self.on_failure(kind, [payload for payload, _, _ in pending], error)
+                except Exception as e:
+                    print(f"Could not keep {len(pending)} failed {kind} write(s): {e}")
+            for _, _, ticket in pending:
+                ticket._finish(error)
+
+    def _attempt(self, kind, entries):
+        """Run the handler once; returns (entries not committed, error)"""
+        try:
+            self.handlers[kind]([payload for payload, _, _ in entries])
+            return [], None
+        except PartialCommit as e:
+            failed = set(map(id, e.failed))
+            return [entry for entry in entries if id(entry[0]) in failed], e.error
+        except Exception as e:
+            return entries, e
+
+    def _settle(self, entries, started):
+        if not entries:
+            return
+        finished = time.monotonic()
+        with self._lock:
+            self.committed += len(entries)
+            self._commit_ms = (self._commit_ms + [(finished - started) * 1000])[-1000:]
+            self._wait_ms = (self._wait_ms + [(finished - q) * 1000 for _, q, _ in entries])[-1000:]
+        for _, _, ticket in entries:
+            ticket._finish()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'max_seen_depth': self.max_seen_depth,
+                'submitted': self.submitted,
+                'committed': self.committed,
+                'batches': self.batches,
+                'avg_batch_size': round(self.committed / self.batches, 2) if self.batches else None,
+                'rejected': self.rejected,
+                'retried': self.retried,
+                'errors': self.errors,
+                'commit_ms_p50': _percentile(self._commit_ms, 0.50),
+                'commit_ms_p95': _percentile(self._commit_ms, 0.95),
+                'commit_ms_max': round(max(self._commit_ms), 3) if self._commit_ms else None,
+                'queued_to_committed_ms_p50': _percentile(self._wait_ms, 0.50),
+                'queued_to_committed_ms_p95': _percentile(self._wait_ms, 0.95),
+            }
@@ -0,0 +1,26 @@
+"""
+Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+`python app.py` still starts Flask's single-process development server.
+Under gunicorn every worker process imports the app on its own, so the
+state that used to live in one process is shared instead: create_app()
+turns on MULTIPROCESS, which keeps chat sessions, Double Mention counts and
+background extraction results in SESSION_DB_FILE, and takes inter-process
+file locks around writes to the JSON data files, the chat log and the
+upload refcounts. Settings are read from the environment (and .env) as
+before; the debugger is never enabled here.
+"""
+import os
+
+
+def create_app(multiprocess=True):
+    """Configure the environment for this kind of server and return the Flask app"""
+    if multiprocess:
+        os.environ.setdefault("MULTIPROCESS", "1")
+    from app import app
+    return app
+
+
+application = create_app()